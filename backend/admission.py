@@ -0,0 +1,243 @@
+"""Admission control: concurrency lanes per endpoint class.
+
+Every request is classified into a lane: cheap (single-row reads and
+writes), heavy (exports, overviews, scenarios, aggregates over all
+expenses), import (bulk writes) or admin. A lane runs at most
+ADMISSION_<LANE>_CONCURRENCY requests at once. Up to ADMISSION_<LANE>_QUEUE
+more wait in line, for at most ADMISSION_QUEUE_TIMEOUT seconds. Beyond
+that the request is answered at once with 429 and a Retry-After estimated
+from the lane's recent service time. A burst of exports or imports
+therefore holds only its own lane's share of the threadpool and
+connection pool, and cheap interactive requests never queue behind it.
+
+Limits are per worker process; a concurrency of 0 leaves the lane
+unlimited. Queue times are returned in a Server-Timing header and
+summarized per lane by GET /admin/admission.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from starlette.datastructures import MutableHeaders
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+QUEUE_TIME_SAMPLES = 1000  # recent queue times kept per lane for the percentiles
+
+# lane: (default concurrency, default queue length)
+LANE_DEFAULTS = {
+    "cheap": (64, 256),
+    "heavy": (4, 16),
+    "import": (2, 4),
+    "admin": (1, 2),
+}
+
+# (lane, method or None for any, path pattern); the first match wins, unmatched paths are cheap
+LANE_RULES = [
+    ("admin", None, r"/admin/"),
+    ("import", None, r"/import/"),
+    ("import", "POST", r"/expenses/bulk$"),
+    ("import", "POST", r"/projects/bulk-delete$"),
+    ("heavy", "GET", r"/all-data$"),
+    ("heavy", "GET", r"/projects/\d+/full$"),
+    ("heavy", "GET", r"/(customers|projects)/\d+/cost-overview$"),
+    ("heavy", "POST", r"/scenarios/evaluate$"),
+    ("heavy", "GET", r"/changes$"),
+]
+_COMPILED_RULES = [(lane, method, re.compile(pattern)) for lane, method, pattern in LANE_RULES]
+
+# Never queued: health checks, docs, and the long-lived event stream,
+# which would hold a slot for as long as it is open
+EXEMPT_PATHS = {"/", "/health", "/docs", "/redoc", "/openapi.json", "/events"}
+
+
+def lane_for(method: str, path: str):
+    """Lane name for a request, or None if it bypasses admission control"""
+    if path in EXEMPT_PATHS:
+        return None
+    for lane, rule_method, pattern in _COMPILED_RULES:
+        if (rule_method is None or rule_method == method) and pattern.match(path):
+            return lane
+    return "cheap"
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Lane:
+    """A bounded FIFO of requests in front of at most `concurrency` running ones"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        # Thread lock rather than asyncio primitives: each TestClient request runs on its own event loop
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()  # (loop, future) in arrival order
+        self._queue_times = deque(maxlen=QUEUE_TIME_SAMPLES)
+        self._service_time = 0.0  # moving average of seconds a request holds its slot
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    async def acquire(self, timeout: float):
+        """Seconds spent queued once a slot is held, or None if the lane is saturated"""
+        started = time.monotonic()
+        with self._lock:
+            if self.concurrency <= 0 or (self._active < self.concurrency and not self._waiters):
+                self._active += 1
+                self._admitted(0.0)
+                return 0.0
+            if len(self._waiters) >= self.queue_size:
+                self.stats["rejected"] += 1
+                return None
+            waiter = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            self.stats["queued"] += 1
+
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self.stats["timed_out"] += 1
+                    return None
+            # Otherwise a slot was handed over just as the wait ran out: use it
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = waiter not in self._waiters
+                if not handed_over:
+                    self._waiters.remove(waiter)
+            if handed_over:
+                self.release(0.0)
+            raise
+
+        queued = time.monotonic() - started
+        with self._lock:
+            self._admitted(queued)
+        return queued
+
+    def _admitted(self, queued: float):
+        self.stats["admitted"] += 1
+        self._queue_times.append(queued)
+
+    def release(self, service_time: float):
+        """Hand the slot to the next waiter, or free it"""
+        with self._lock:
+            if service_time:
+                self._service_time = service_time if not self._service_time else (
+                    0.9 * self._service_time + 0.1 * service_time
+                )
+            if self.concurrency > 0 and self._waiters:
+                loop, future = self._waiters.popleft()  # the slot moves to it; _active is unchanged
+                loop.call_soon_threadsafe(_wake, future)
+            else:
+                self._active -= 1
+
+    def retry_after(self) -> int:
+        """Whole seconds until the queue has likely drained, at least 1"""
+        with self._lock:
+            backlog = len(self._waiters) + 1
+        per_slot = backlog / max(self.concurrency, 1)
+        return max(1, math.ceil(self._service_time * per_slot))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            queue_times = sorted(self._queue_times)
+            active, waiting, stats = self._active, len(self._waiters), dict(self.stats)
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "active": active,
+            "waiting": waiting,
+            **stats,
+            "queue_ms": {
+                name: round(_percentile(queue_times, fraction) * 1000, 2)
+                for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+            },
+            "service_ms": round(self._service_time * 1000, 2),
+        }
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def lanes_from_env() -> dict:
+    lanes = {}
+    for name, (concurrency, queue_size) in LANE_DEFAULTS.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        lanes[name] = Lane(
+            name,
+            int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+            int(os.getenv(f"{prefix}_QUEUE", str(queue_size))),
+        )
+    return lanes
+
+
+default_lanes = lanes_from_env()
+
+
+def snapshot() -> dict:
+    """Per-lane limits, occupancy, counters and queue-time percentiles"""
+    return {"enabled": ADMISSION_ENABLED, "queue_timeout": ADMISSION_QUEUE_TIMEOUT,
+            "lanes": {name: lane.snapshot() for name, lane in default_lanes.items()}}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware holding each request in its lane's queue until a slot is free"""
+
+    def __init__(self, app, lanes: dict = None, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.app = app
+        self.lanes = lanes if lanes is not None else default_lanes
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        lane_name = None
+        if scope["type"] == "http" and self.enabled:
+            lane_name = lane_for(scope["method"], scope["path"])
+        if lane_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.lanes[lane_name]
+        queued = await lane.acquire(self.queue_timeout)
+        if queued is None:
+            await self._reject(lane, send)
+            return
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", f'queue;dur={queued * 1000:.1f};desc="{lane_name}"'
+                )
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            lane.release(time.monotonic() - started)
+
+    @staticmethod
+    async def _reject(lane: Lane, send):
+        body = json.dumps({"detail": f"Too many concurrent {lane.name} requests, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(lane.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
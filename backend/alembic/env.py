@@ -6,10 +6,12 @@ try:
 except Exception:
     load_dotenv = None
 
+import sqlalchemy as sa
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
+from alembic.script import ScriptDirectory
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -29,7 +31,87 @@ if load_dotenv:
 
 database_url = os.environ.get('DATABASE_URL')
 if database_url:
-    config.set_main_option('sqlalchemy.url', database_url)
+    # The ini parser treats % as interpolation; URL-encoded passwords and options contain it
+    config.set_main_option('sqlalchemy.url', database_url.replace('%', '%%'))
+
+# Longest a migration statement waits for a lock; the API queues behind a waiting
+# ALTER TABLE, so a deploy should fail fast rather than stall it ('0' waits forever)
+MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+
+# The tables the first revision builds on. They predate Alembic (the app used to
+# create them), so a database Alembic has never touched gets them here, in their
+# original shape, before 0001_create_project_customers runs
+core_metadata = sa.MetaData()
+sa.Table(
+    'customers', core_metadata,
+    sa.Column('id', sa.Integer(), primary_key=True, index=True),
+    sa.Column('name', sa.String(255), nullable=False, unique=True, index=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+)
+sa.Table(
+    'projects', core_metadata,
+    sa.Column('id', sa.Integer(), primary_key=True, index=True),
+    sa.Column('name', sa.String(255), nullable=False, index=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+)
+sa.Table(
+    'expenses', core_metadata,
+    sa.Column('id', sa.Integer(), primary_key=True, index=True),
+    sa.Column('project_id', sa.Integer(), sa.ForeignKey('projects.id'), nullable=False, index=True),
+    sa.Column('expense_type', sa.String(255), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+)
+
+
+def _cascades(inspector, table, column):
+    return any(
+        fk['constrained_columns'] == [column] and (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE'
+        for fk in inspector.get_foreign_keys(table)
+    )
+
+
+# Newest first: what the app's create_all left behind at each revision, for databases
+# it built without Alembic. 0002 and 0003 (partitions, covering indexes) are never
+# made by create_all, so a schema from before 0004 is stamped at 0001 and goes through them
+CREATE_ALL_REVISIONS = [
+    ('0010_change_log', lambda inspector: inspector.has_table('change_log')),
+    ('0009_cascade_deletes', lambda inspector: _cascades(inspector, 'expenses', 'project_id')),
+    ('0008_leaderboards', lambda inspector: inspector.has_table('project_totals')),
+    ('0007_expense_types', lambda inspector: inspector.has_table('expense_types')),
+    ('0006_allocation_history', lambda inspector: inspector.has_table('allocation_history')),
+    ('0005_expense_source_key',
+     lambda inspector: any(c['name'] == 'source_key' for c in inspector.get_columns('expenses'))),
+    ('0004_integer_money',
+     lambda inspector: any(c['name'] == 'amount_ore' for c in inspector.get_columns('expenses'))),
+    ('0001_create_project_customers', lambda inspector: True),
+]
+
+
+def prepare_unversioned_database(connection):
+    """
+    Bring a database Alembic has never touched to a revision it can upgrade from.
+
+    Returns the revision to stamp when create_all already built the schema
+    (project_customers exists), so those revisions are not run over it;
+    otherwise creates the missing core tables and returns None.
+    """
+    inspector = sa.inspect(connection)
+    revision = None
+    if not inspector.has_table('alembic_version'):
+        if inspector.has_table('project_customers'):
+            revision = next(revision for revision, built in CREATE_ALL_REVISIONS if built(inspector))
+        else:
+            core_metadata.create_all(connection, checkfirst=True)
+    # End the inspection's transaction too: Alembic only commits transactions it began itself
+    connection.commit()
+    return revision
 
 
 def run_migrations_offline():
@@ -53,7 +135,21 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=None)
+        if connection.dialect.name == 'postgresql':
+            connection.execute(
+                sa.text("SELECT set_config('lock_timeout', :value, false)"), {'value': MIGRATION_LOCK_TIMEOUT}
+            )
+            connection.commit()
+
+        stamp = prepare_unversioned_database(connection)
+
+        # One transaction per revision, so a migration's locks are released before the next one starts
+        context.configure(connection=connection, target_metadata=None, transaction_per_migration=True)
+
+        if stamp:
+            print(f"Schema was built by create_all without Alembic; stamping it at {stamp}")
+            context.get_context().stamp(ScriptDirectory.from_config(config), stamp)
+            connection.commit()
 
         with context.begin_transaction():
             context.run_migrations()
@@ -0,0 +1,119 @@
+"""hash-partition expenses on project_id
+
+Revision ID: 0002_partition_expenses
+Revises: 0001_create_project_customers
+Create Date: 2026-10-19 00:00:00.000000
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import copy_rows, with_lock_retries
+
+# revision identifiers, used by Alembic.
+revision = '0002_partition_expenses'
+down_revision = '0001_create_project_customers'
+branch_labels = None
+depends_on = None
+
+# The same setting as models.EXPENSE_PARTITIONS; the API checks the result at startup
+EXPENSE_PARTITIONS = int(os.getenv('EXPENSE_PARTITIONS', '8'))
+
+EXPENSE_COLUMNS = 'id, project_id, expense_type, amount, description, created_at, updated_at'
+NEW_ROW = ', '.join(f'NEW.{column}' for column in EXPENSE_COLUMNS.split(', '))
+
+COLUMN_DEFINITIONS = """
+    id integer NOT NULL DEFAULT nextval('expenses_id_seq'),
+    project_id integer NOT NULL REFERENCES projects(id),
+    expense_type varchar(255) NOT NULL,
+    amount double precision NOT NULL,
+    description text,
+    created_at timestamp without time zone,
+    updated_at timestamp without time zone
+"""
+
+
+def _is_partitioned(bind) -> bool:
+    return bool(bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'expenses'::regclass"
+    )).scalar())
+
+
+def _rebuild_expenses(new_table: str, definition: str, primary_key: str, partitions: int = 0):
+    """
+    Move expenses into a new table without blocking writes for the copy.
+
+    The new table is built next to expenses and a trigger mirrors every
+    write into it; copy_rows then brings over the existing rows in committed
+    batches. Only the final swap of names locks expenses, briefly. Each step
+    is skipped or repeated safely, so an interrupted run can be started again.
+    """
+    with op.get_context().autocommit_block():
+        with_lock_retries(f'CREATE TABLE IF NOT EXISTS {new_table} ({COLUMN_DEFINITIONS}, '
+                          f'CONSTRAINT {new_table}_pkey PRIMARY KEY ({primary_key})) {definition}')
+        for remainder in range(partitions):
+            with_lock_retries(
+                f'CREATE TABLE IF NOT EXISTS expenses_p{remainder} PARTITION OF {new_table} '
+                f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+            )
+        # Indexes on an empty table (on the parent: created on every partition)
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{new_table}_id ON {new_table} (id)')  # online: ok
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{new_table}_project_id ON {new_table} (project_id)')  # online: ok
+
+        op.execute(f"""
+        CREATE OR REPLACE FUNCTION {new_table}_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM {new_table} WHERE id = OLD.id AND project_id = OLD.project_id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {new_table} ({EXPENSE_COLUMNS}) VALUES ({NEW_ROW})
+                ON CONFLICT ON CONSTRAINT {new_table}_pkey DO UPDATE SET
+                    expense_type = EXCLUDED.expense_type, amount = EXCLUDED.amount,
+                    description = EXCLUDED.description, created_at = EXCLUDED.created_at,
+                    updated_at = EXCLUDED.updated_at;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """)
+        with_lock_retries(
+            f'CREATE OR REPLACE TRIGGER {new_table}_sync AFTER INSERT OR UPDATE OR DELETE ON expenses '
+            f'FOR EACH ROW EXECUTE FUNCTION {new_table}_sync()'
+        )
+
+    copy_rows('expenses', new_table, EXPENSE_COLUMNS)
+
+    with op.get_context().autocommit_block():
+        # One statement, so one transaction: readers never see expenses missing
+        with_lock_retries(f"""
+        ALTER TABLE expenses RENAME TO expenses_old;
+        ALTER INDEX expenses_pkey RENAME TO expenses_old_pkey;
+        ALTER INDEX IF EXISTS ix_expenses_id RENAME TO ix_expenses_old_id;
+        ALTER INDEX IF EXISTS ix_expenses_project_id RENAME TO ix_expenses_old_project_id;
+        ALTER TABLE {new_table} RENAME TO expenses;
+        ALTER INDEX {new_table}_pkey RENAME TO expenses_pkey;
+        ALTER INDEX ix_{new_table}_id RENAME TO ix_expenses_id;
+        ALTER INDEX ix_{new_table}_project_id RENAME TO ix_expenses_project_id;
+        ALTER SEQUENCE expenses_id_seq OWNED BY expenses.id;
+        DROP TABLE expenses_old;
+        DROP FUNCTION {new_table}_sync();
+        """)
+        op.execute('ANALYZE expenses')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if EXPENSE_PARTITIONS <= 0 or _is_partitioned(bind):
+        return
+    # The partition key must be part of every unique constraint, including the PK
+    _rebuild_expenses('expenses_partitioned', 'PARTITION BY HASH (project_id)', 'id, project_id',
+                      partitions=EXPENSE_PARTITIONS)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if not _is_partitioned(bind):
+        return
+    _rebuild_expenses('expenses_unpartitioned', '', 'id')
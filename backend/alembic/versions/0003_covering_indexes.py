@@ -0,0 +1,72 @@
+"""align project_customers with the models and add covering indexes
+
+Revision ID: 0003_covering_indexes
+Revises: 0002_partition_expenses
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003_covering_indexes'
+down_revision = '0002_partition_expenses'
+branch_labels = None
+depends_on = None
+
+# Single-column indexes made redundant by the composite/covering ones below
+REDUNDANT_INDEXES = [
+    ('idx_pc_project', 'project_customers'),
+    ('idx_pc_customer', 'project_customers'),
+    ('ix_project_customers_project_id', 'project_customers'),
+    ('ix_project_customers_customer_id', 'project_customers'),
+    ('ix_expenses_project_id', 'expenses'),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # Tables created by create_all used Float; the migration and models use NUMERIC(5,2)
+    pct_type = next(c['type'] for c in inspector.get_columns('project_customers') if c['name'] == 'cost_percentage')
+    if isinstance(pct_type, sa.Float):
+        op.alter_column(
+            'project_customers', 'cost_percentage',
+            type_=sa.Numeric(5, 2),
+            postgresql_using='round(cost_percentage::numeric, 2)',
+        )
+
+    unique_names = {c['name'] for c in inspector.get_unique_constraints('project_customers')}
+    if 'uq_project_customer' not in unique_names:
+        op.create_unique_constraint('uq_project_customer', 'project_customers', ['project_id', 'customer_id'])
+
+    check_names = {c['name'] for c in inspector.get_check_constraints('project_customers')}
+    if 'valid_cost_percentage' in check_names:
+        op.drop_constraint('valid_cost_percentage', 'project_customers', type_='check')
+        op.create_check_constraint(
+            'ck_cost_percentage_range', 'project_customers',
+            'cost_percentage >= 0 AND cost_percentage <= 100',
+        )
+
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_expenses_project_amount '
+        'ON expenses (project_id) INCLUDE (amount)'
+    )
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_pc_customer_project '
+        'ON project_customers (customer_id, project_id) INCLUDE (cost_percentage)'
+    )
+
+    for index_name, _table in REDUNDANT_INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+    # Fresh statistics so the planner costs the new indexes
+    op.execute('ANALYZE expenses')
+    op.execute('ANALYZE project_customers')
+
+
+def downgrade():
+    op.create_index('idx_pc_project', 'project_customers', ['project_id'])
+    op.create_index('idx_pc_customer', 'project_customers', ['customer_id'])
+    op.create_index('ix_expenses_project_id', 'expenses', ['project_id'])
+    op.drop_index('ix_pc_customer_project', table_name='project_customers')
+    op.drop_index('ix_expenses_project_amount', table_name='expenses')
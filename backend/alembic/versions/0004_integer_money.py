@@ -0,0 +1,121 @@
+"""store amounts as integer øre and cost shares as basis points
+
+Revision ID: 0004_integer_money
+Revises: 0003_covering_indexes
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+
+from online_migrations import (
+    add_check_constraint, add_column, backfill, create_index_concurrently, drop_column, drop_constraint,
+    drop_index_concurrently, set_not_null,
+)
+
+# revision identifiers, used by Alembic.
+revision = '0004_integer_money'
+down_revision = '0003_covering_indexes'
+branch_labels = None
+depends_on = None
+
+CHECK_TOTAL_BP_SQL = """
+CREATE OR REPLACE FUNCTION check_total_pct() RETURNS trigger AS $$
+DECLARE
+  total bigint;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT COALESCE(SUM(cost_basis_points),0) INTO total FROM project_customers WHERE project_id = NEW.project_id;
+    IF total + NEW.cost_basis_points > 10000 THEN
+      RAISE EXCEPTION 'Allocation > 100%% for project %', NEW.project_id;
+    END IF;
+    RETURN NEW;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT COALESCE(SUM(cost_basis_points),0) - COALESCE(OLD.cost_basis_points,0) INTO total FROM project_customers WHERE project_id = NEW.project_id;
+    IF total + NEW.cost_basis_points > 10000 THEN
+      RAISE EXCEPTION 'Allocation > 100%% for project %', NEW.project_id;
+    END IF;
+    RETURN NEW;
+  ELSE
+    RETURN OLD;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CHECK_TOTAL_PCT_SQL = """
+CREATE OR REPLACE FUNCTION check_total_pct() RETURNS trigger AS $$
+DECLARE
+  total numeric;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT COALESCE(SUM(cost_percentage),0) INTO total FROM project_customers WHERE project_id = NEW.project_id;
+    IF total + NEW.cost_percentage > 100 THEN
+      RAISE EXCEPTION 'Allocation > 100%% for project %', NEW.project_id;
+    END IF;
+    RETURN NEW;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT COALESCE(SUM(cost_percentage),0) - COALESCE(OLD.cost_percentage,0) INTO total FROM project_customers WHERE project_id = NEW.project_id;
+    IF total + NEW.cost_percentage > 100 THEN
+      RAISE EXCEPTION 'Allocation > 100%% for project %', NEW.project_id;
+    END IF;
+    RETURN NEW;
+  ELSE
+    RETURN OLD;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    # expenses.amount (double precision NOK) -> expenses.amount_ore (bigint)
+    add_column('expenses', 'amount_ore', 'BIGINT')
+    backfill('expenses', 'amount_ore = round(amount::numeric * 100)', where='amount_ore IS NULL')
+    set_not_null('expenses', 'amount_ore')
+    drop_index_concurrently('ix_expenses_project_amount')
+    drop_column('expenses', 'amount')
+    create_index_concurrently('ix_expenses_project_amount', 'expenses', 'project_id', include='amount_ore')
+
+    # project_customers.cost_percentage (numeric percent) -> cost_basis_points (integer)
+    add_column('project_customers', 'cost_basis_points', 'INTEGER')
+    backfill('project_customers', 'cost_basis_points = round(cost_percentage * 100)',
+             where='cost_basis_points IS NULL')
+    set_not_null('project_customers', 'cost_basis_points')
+    add_check_constraint(
+        'project_customers', 'ck_cost_basis_points_range',
+        'cost_basis_points >= 0 AND cost_basis_points <= 10000',
+    )
+    # The allocation trigger keeps its name and now compares basis points
+    op.execute(CHECK_TOTAL_BP_SQL)
+    drop_index_concurrently('ix_pc_customer_project')
+    drop_constraint('project_customers', 'ck_cost_percentage_range')
+    drop_column('project_customers', 'cost_percentage')
+    create_index_concurrently(
+        'ix_pc_customer_project', 'project_customers', 'customer_id, project_id', include='cost_basis_points'
+    )
+
+    op.execute('ANALYZE expenses')
+    op.execute('ANALYZE project_customers')
+
+
+def downgrade():
+    add_column('expenses', 'amount', 'DOUBLE PRECISION')
+    backfill('expenses', 'amount = amount_ore / 100.0', where='amount IS NULL')
+    set_not_null('expenses', 'amount')
+    drop_index_concurrently('ix_expenses_project_amount')
+    drop_column('expenses', 'amount_ore')
+    create_index_concurrently('ix_expenses_project_amount', 'expenses', 'project_id', include='amount')
+
+    add_column('project_customers', 'cost_percentage', 'NUMERIC(5, 2)')
+    backfill('project_customers', 'cost_percentage = cost_basis_points / 100.0', where='cost_percentage IS NULL')
+    set_not_null('project_customers', 'cost_percentage')
+    add_check_constraint(
+        'project_customers', 'ck_cost_percentage_range',
+        'cost_percentage >= 0 AND cost_percentage <= 100',
+    )
+    op.execute(CHECK_TOTAL_PCT_SQL)
+    drop_index_concurrently('ix_pc_customer_project')
+    drop_constraint('project_customers', 'ck_cost_basis_points_range')
+    drop_column('project_customers', 'cost_basis_points')
+    create_index_concurrently(
+        'ix_pc_customer_project', 'project_customers', 'customer_id, project_id', include='cost_percentage'
+    )
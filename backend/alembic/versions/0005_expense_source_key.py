@@ -0,0 +1,26 @@
+"""key imported expenses on their source row for idempotent re-imports
+
+Revision ID: 0005_expense_source_key
+Revises: 0004_integer_money
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from online_migrations import add_column, create_index_concurrently, drop_column, drop_index_concurrently
+
+# revision identifiers, used by Alembic.
+revision = '0005_expense_source_key'
+down_revision = '0004_integer_money'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column('expenses', 'source_key', 'VARCHAR(64)')
+    add_column('expenses', 'fingerprint', 'VARCHAR(64)')
+    # Includes the partition key, so it is valid on the partitioned table
+    create_index_concurrently('uq_expenses_project_source', 'expenses', 'project_id, source_key', unique=True)
+
+
+def downgrade():
+    drop_index_concurrently('uq_expenses_project_source')
+    drop_column('expenses', 'fingerprint')
+    drop_column('expenses', 'source_key')
@@ -0,0 +1,102 @@
+"""append-only allocation and expense history with compacted snapshots
+
+Revision ID: 0006_allocation_history
+Revises: 0005_expense_source_key
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_allocation_history'
+down_revision = '0005_expense_source_key'
+branch_labels = None
+depends_on = None
+
+# Baseline snapshot of the live tables, so as_of works from the moment of the upgrade
+BASELINE_SNAPSHOT_SQL = """
+WITH snapshot AS (
+    INSERT INTO history_snapshots (covers_until, created_at)
+    VALUES (now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc')
+    RETURNING id
+), allocations AS (
+    INSERT INTO snapshot_allocations (snapshot_id, project_id, customer_id, cost_basis_points)
+    SELECT snapshot.id, pc.project_id, pc.customer_id, pc.cost_basis_points
+    FROM snapshot, project_customers pc
+)
+INSERT INTO snapshot_expense_totals (snapshot_id, project_id, total_ore)
+SELECT snapshot.id, e.project_id, SUM(e.amount_ore)
+FROM snapshot, expenses e
+GROUP BY snapshot.id, e.project_id
+HAVING SUM(e.amount_ore) <> 0
+"""
+
+
+def upgrade():
+    op.create_table(
+        'allocation_history',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('cost_basis_points', sa.Integer(), nullable=True),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+    )
+    # Indexes on the tables created here, before anything writes to them
+    op.create_index('ix_allocation_history_project', 'allocation_history', ['project_id', 'changed_at'])  # online: ok
+    op.create_index('ix_allocation_history_customer', 'allocation_history', ['customer_id', 'changed_at'])  # online: ok
+    op.create_index('ix_allocation_history_changed_at', 'allocation_history', ['changed_at'])  # online: ok
+
+    op.create_table(
+        'expense_history',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('expense_id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('amount_ore', sa.BigInteger(), nullable=True),
+        sa.Column('amount_delta_ore', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_expense_history_project', 'expense_history', ['project_id', 'changed_at'])  # online: ok
+    op.create_index('ix_expense_history_changed_at', 'expense_history', ['changed_at'])  # online: ok
+
+    op.create_table(
+        'history_snapshots',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('covers_until', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_history_snapshots_covers_until', 'history_snapshots', ['covers_until'])
+
+    op.create_table(
+        'snapshot_allocations',
+        sa.Column('snapshot_id', sa.Integer(), sa.ForeignKey('history_snapshots.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('project_id', sa.Integer(), primary_key=True),
+        sa.Column('customer_id', sa.Integer(), primary_key=True),
+        sa.Column('cost_basis_points', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_snapshot_allocations_customer', 'snapshot_allocations', ['snapshot_id', 'customer_id'])
+
+    op.create_table(
+        'snapshot_expense_totals',
+        sa.Column('snapshot_id', sa.Integer(), sa.ForeignKey('history_snapshots.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('project_id', sa.Integer(), primary_key=True),
+        sa.Column('total_ore', sa.BigInteger(), nullable=False),
+    )
+
+    op.execute(BASELINE_SNAPSHOT_SQL)
+
+
+def downgrade():
+    op.drop_table('snapshot_expense_totals')
+    op.drop_table('snapshot_allocations')
+    op.drop_index('ix_history_snapshots_covers_until', table_name='history_snapshots')
+    op.drop_table('history_snapshots')
+    # Each table is dropped right after its indexes
+    op.drop_index('ix_expense_history_changed_at', table_name='expense_history')  # online: ok
+    op.drop_index('ix_expense_history_project', table_name='expense_history')  # online: ok
+    op.drop_table('expense_history')
+    op.drop_index('ix_allocation_history_changed_at', table_name='allocation_history')  # online: ok
+    op.drop_index('ix_allocation_history_customer', table_name='allocation_history')  # online: ok
+    op.drop_index('ix_allocation_history_project', table_name='allocation_history')  # online: ok
+    op.drop_table('allocation_history')
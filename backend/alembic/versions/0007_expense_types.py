@@ -0,0 +1,66 @@
+"""dictionary-encode expense types into a SMALLINT foreign key
+
+Revision ID: 0007_expense_types
+Revises: 0006_allocation_history
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import (
+    add_column, add_foreign_key, backfill, create_index_concurrently, drop_column, drop_constraint,
+    drop_index_concurrently, set_not_null,
+)
+
+# revision identifiers, used by Alembic.
+revision = '0007_expense_types'
+down_revision = '0006_allocation_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'expense_types',
+        sa.Column('id', sa.SmallInteger(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(255), nullable=False, unique=True),
+    )
+    op.execute('INSERT INTO expense_types (name) SELECT DISTINCT expense_type FROM expenses ORDER BY 1')
+
+    add_column('expenses', 'expense_type_id', 'SMALLINT')
+    backfill(
+        'expenses',
+        'expense_type_id = (SELECT t.id FROM expense_types t WHERE t.name = expenses.expense_type)',
+        where='expense_type_id IS NULL',
+    )
+    set_not_null('expenses', 'expense_type_id')
+    add_foreign_key('expenses', 'expenses_expense_type_id_fkey', 'expense_type_id', 'expense_types')
+
+    drop_index_concurrently('ix_expenses_project_amount')
+    create_index_concurrently(
+        'ix_expenses_project_amount', 'expenses', 'project_id, expense_type_id', include='amount_ore'
+    )
+    create_index_concurrently('ix_expenses_type_amount', 'expenses', 'expense_type_id', include='amount_ore')
+    drop_column('expenses', 'expense_type')
+
+    # The backfill left every expense row behind a dead tuple
+    op.execute('ANALYZE expenses')
+    op.execute('ANALYZE expense_types')
+
+
+def downgrade():
+    add_column('expenses', 'expense_type', 'VARCHAR(255)')
+    backfill(
+        'expenses',
+        'expense_type = (SELECT t.name FROM expense_types t WHERE t.id = expenses.expense_type_id)',
+        where='expense_type IS NULL',
+    )
+    set_not_null('expenses', 'expense_type')
+
+    drop_index_concurrently('ix_expenses_type_amount')
+    drop_index_concurrently('ix_expenses_project_amount')
+    create_index_concurrently('ix_expenses_project_amount', 'expenses', 'project_id', include='amount_ore')
+
+    drop_constraint('expenses', 'expenses_expense_type_id_fkey')
+    drop_column('expenses', 'expense_type_id')
+    op.drop_table('expense_types')
@@ -0,0 +1,99 @@
+"""maintained cost aggregates with ranking indexes for the leaderboards
+
+Revision ID: 0008_leaderboards
+Revises: 0007_expense_types
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0008_leaderboards'
+down_revision = '0007_expense_types'
+branch_labels = None
+depends_on = None
+
+BACKFILL_SQL = [
+    """
+    INSERT INTO project_type_totals (project_id, expense_type_id, total_ore)
+    SELECT project_id, expense_type_id, SUM(amount_ore)
+    FROM expenses GROUP BY project_id, expense_type_id HAVING SUM(amount_ore) <> 0
+    """,
+    """
+    INSERT INTO project_totals (project_id, total_ore)
+    SELECT project_id, SUM(total_ore) FROM project_type_totals GROUP BY project_id
+    """,
+    # Largest remainder split, as money.allocate: floors first, leftover øre to the
+    # largest remainders, ties to the lower customer id
+    """
+    WITH shares AS (
+        SELECT pc.project_id, pc.customer_id,
+               COALESCE(pt.total_ore, 0) * pc.cost_basis_points AS exact,
+               COALESCE(pt.total_ore, 0) * LEAST(SUM(pc.cost_basis_points) OVER w, 10000) / 10000 AS target
+        FROM project_customers pc LEFT JOIN project_totals pt ON pt.project_id = pc.project_id
+        WINDOW w AS (PARTITION BY pc.project_id)
+    ), ranked AS (
+        SELECT project_id, customer_id, exact / 10000 AS base,
+               target - SUM(exact / 10000) OVER (PARTITION BY project_id) AS leftover,
+               ROW_NUMBER() OVER (PARTITION BY project_id ORDER BY exact % 10000 DESC, customer_id) AS position
+        FROM shares
+    )
+    INSERT INTO customer_project_costs (project_id, customer_id, allocated_ore)
+    SELECT project_id, customer_id, base + CASE WHEN position <= leftover THEN 1 ELSE 0 END
+    FROM ranked
+    """,
+    """
+    INSERT INTO customer_totals (customer_id, allocated_ore)
+    SELECT customer_id, SUM(allocated_ore) FROM customer_project_costs
+    GROUP BY customer_id HAVING SUM(allocated_ore) <> 0
+    """,
+]
+
+
+def upgrade():
+    op.create_table(
+        'project_totals',
+        sa.Column('project_id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('total_ore', sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        'project_type_totals',
+        sa.Column('project_id', sa.Integer(), primary_key=True),
+        sa.Column('expense_type_id', sa.SmallInteger(), primary_key=True),
+        sa.Column('total_ore', sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        'customer_project_costs',
+        sa.Column('project_id', sa.Integer(), primary_key=True),
+        sa.Column('customer_id', sa.Integer(), primary_key=True),
+        sa.Column('allocated_ore', sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        'customer_totals',
+        sa.Column('customer_id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('allocated_ore', sa.BigInteger(), nullable=False),
+    )
+
+    for statement in BACKFILL_SQL:
+        op.execute(statement)
+
+    op.create_index('ix_project_totals_ranking', 'project_totals', [sa.text('total_ore DESC'), 'project_id'])
+    op.create_index(
+        'ix_project_type_totals_ranking', 'project_type_totals',
+        ['expense_type_id', sa.text('total_ore DESC'), 'project_id'],
+    )
+    op.create_index(
+        'ix_customer_project_costs_ranking', 'customer_project_costs',
+        ['customer_id', sa.text('allocated_ore DESC'), 'project_id'],
+    )
+    op.create_index('ix_customer_totals_ranking', 'customer_totals', [sa.text('allocated_ore DESC'), 'customer_id'])
+
+    for table in ('project_totals', 'project_type_totals', 'customer_project_costs', 'customer_totals'):
+        op.execute(f'ANALYZE {table}')
+
+
+def downgrade():
+    op.drop_table('customer_totals')
+    op.drop_table('customer_project_costs')
+    op.drop_table('project_type_totals')
+    op.drop_table('project_totals')
@@ -0,0 +1,55 @@
+"""ON DELETE CASCADE from projects and customers to their expenses and shares
+
+Revision ID: 0009_cascade_deletes
+Revises: 0008_leaderboards
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from online_migrations import add_foreign_key, drop_constraint, rename_constraint
+
+# revision identifiers, used by Alembic.
+revision = '0009_cascade_deletes'
+down_revision = '0008_leaderboards'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table): the children the ORM used to load and delete row by row.
+# project_customers already cascades when created by 0001, but not when created by create_all.
+CASCADING_KEYS = [
+    ('expenses', 'project_id', 'projects'),
+    ('project_customers', 'project_id', 'projects'),
+    ('project_customers', 'customer_id', 'customers'),
+]
+
+
+def _foreign_key(inspector, table, column, referred_table):
+    return next(
+        (fk for fk in inspector.get_foreign_keys(table)
+         if fk['constrained_columns'] == [column] and fk['referred_table'] == referred_table),
+        None,
+    )
+
+
+def _replace_foreign_key(old, table, column, referred_table, ondelete=None):
+    """Build the new key next to the old one, then swap, so the column is never unchecked"""
+    name = f'{table}_{column}_fkey'
+    add_foreign_key(table, f'{name}_new', column, referred_table, ondelete=ondelete)
+    if old is not None:
+        drop_constraint(table, old['name'])
+    rename_constraint(table, f'{name}_new', name)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, column, referred_table in CASCADING_KEYS:
+        fk = _foreign_key(inspector, table, column, referred_table)
+        if fk is not None and (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+            continue
+        _replace_foreign_key(fk, table, column, referred_table, ondelete='CASCADE')
+
+
+def downgrade():
+    fk = _foreign_key(sa.inspect(op.get_bind()), 'expenses', 'project_id', 'projects')
+    _replace_foreign_key(fk, 'expenses', 'project_id', 'projects')
@@ -0,0 +1,53 @@
+"""change log outbox behind the /changes feed, backfilled with the current rows
+
+Revision ID: 0010_change_log
+Revises: 0009_cascade_deletes
+Create Date: 2026-10-19 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0010_change_log'
+down_revision = '0009_cascade_deletes'
+branch_labels = None
+depends_on = None
+
+# Every existing row as an upsert of the migration's transaction, so a consumer
+# starting without a token gets the full data set from the feed itself
+BACKFILL_SQL = [
+    f"""
+    INSERT INTO change_log (txid, entity, entity_id, action, changed_at)
+    SELECT pg_current_xact_id()::text::bigint, '{entity}', id, 'upsert', now() AT TIME ZONE 'utc'
+    FROM {table} ORDER BY id
+    """
+    for entity, table in (
+        ('customer', 'customers'),
+        ('project', 'projects'),
+        ('expense', 'expenses'),
+        ('allocation', 'project_customers'),
+    )
+]
+
+
+def upgrade():
+    op.create_table(
+        'change_log',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('txid', sa.BigInteger(), nullable=False),
+        sa.Column('entity', sa.String(16), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.String(8), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+    )
+
+    for statement in BACKFILL_SQL:
+        op.execute(statement)
+
+    # change_log is new and not yet written by the API; building after the backfill is faster
+    op.create_index('ix_change_log_position', 'change_log', ['txid', 'id'])  # online: ok
+    op.execute('ANALYZE change_log')
+
+
+def downgrade():
+    op.drop_table('change_log')
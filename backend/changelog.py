@@ -0,0 +1,183 @@
+"""
+Outbox behind the /changes feed, for downstream systems that mirror our data.
+
+Every transaction that writes a customer, project, expense or allocation
+appends (entity, id, action) rows to change_log. ORM flushes are recorded
+by a session hook, Core writes (the RETURNING paths, the import upsert and
+cascaded deletes) call record / record_cascaded_deletes themselves.
+
+Rows are stamped with the writing transaction's id and read in (txid, id)
+order. A sequence alone is not enough: a transaction can take a lower id
+and commit after a higher one has been read. The feed therefore only
+returns rows of transactions older than the reader's snapshot xmin, which
+have all finished. Its token is the position to continue from, so each
+change is delivered once, and a sync costs time proportional to the
+changes since the token. An open transaction holds the feed back until
+it ends.
+
+A page lists each changed entity once, with its current state or a
+tombstone if it no longer exists. Applying pages in order converges on the
+database's state. An "all" / "reset" entry (from /admin/reset-db) tells
+consumers to drop their copy first.
+"""
+from fastapi import HTTPException
+from sqlalchemy import BigInteger, Text, cast, event, func, insert, literal, or_, select, text, tuple_
+from sqlalchemy.orm import Session
+
+import dialect
+from models import ChangeLog, Customer, Expense, Project, ProjectCustomer
+from schemas import CustomerResponse, ExpenseResponse, ProjectCustomerResponse, ProjectResponse
+
+# entity name: (model, response schema)
+ENTITIES = {
+    "customer": (Customer, CustomerResponse),
+    "project": (Project, ProjectResponse),
+    "expense": (Expense, ExpenseResponse),
+    "allocation": (ProjectCustomer, ProjectCustomerResponse),
+}
+_ENTITY_NAMES = {model: name for name, (model, _) in ENTITIES.items()}
+
+
+# ============ Recording ============
+
+def _txid(db: Session):
+    """SQL expression for the current transaction's position in the feed"""
+    if dialect.is_postgres(db):
+        return cast(cast(func.pg_current_xact_id(), Text), BigInteger)
+    # SQLite writers are serialized until commit, so one past the last recorded txid is in commit order
+    return select(func.coalesce(func.max(ChangeLog.txid), 0) + 1).scalar_subquery()
+
+
+def _write(db: Session, rows: list, txid=None):
+    if rows:
+        db.connection().execute(insert(ChangeLog.__table__).values(txid=_txid(db) if txid is None else txid), rows)
+
+
+def record(db: Session, entity: str, ids, action: str = "upsert"):
+    """Log rows written by Core statements, which the flush hook does not see"""
+    _write(db, [{"entity": entity, "entity_id": entity_id, "action": action} for entity_id in ids])
+
+
+def last_txid(db: Session) -> int:
+    """Newest txid in the log, 0 if it is empty"""
+    return int(db.query(func.coalesce(func.max(ChangeLog.txid), 0)).scalar())
+
+
+def record_reset(db: Session, after_txid: int = 0):
+    """
+    Tell consumers that everything before this was dropped.
+
+    after_txid is last_txid() from before the log was recreated. SQLite
+    numbers txids from the log itself, so the reset entry continues after
+    it; otherwise a token from before the reset would be past the entry.
+    """
+    txid = _txid(db) if dialect.is_postgres(db) else after_txid + 1
+    _write(db, [{"entity": "all", "entity_id": 0, "action": "reset"}], txid=txid)
+
+
+def record_cascaded_deletes(db: Session, project_ids=(), customer_ids=()):
+    """Tombstones for the expenses and allocations ON DELETE CASCADE is about to remove"""
+    txid = _txid(db)
+    if project_ids:
+        db.execute(insert(ChangeLog.__table__).from_select(
+            ["txid", "entity", "entity_id", "action"],
+            select(txid, literal("expense"), Expense.id, literal("delete"))
+            .where(Expense.project_id.in_(project_ids)),
+        ))
+    if project_ids or customer_ids:
+        db.execute(insert(ChangeLog.__table__).from_select(
+            ["txid", "entity", "entity_id", "action"],
+            select(txid, literal("allocation"), ProjectCustomer.id, literal("delete")).where(or_(
+                ProjectCustomer.project_id.in_(project_ids or []),
+                ProjectCustomer.customer_id.in_(customer_ids or []),
+            )),
+        ))
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session, flush_context):
+    rows = []
+    for objects, action in ((session.new, "upsert"), (session.dirty, "upsert"), (session.deleted, "delete")):
+        for obj in objects:
+            entity = _ENTITY_NAMES.get(type(obj))
+            if entity is None:
+                continue
+            if action == "upsert" and obj not in session.new and not session.is_modified(obj):
+                continue
+            rows.append({"entity": entity, "entity_id": obj.id, "action": action})
+    _write(session, rows)
+
+
+# ============ Reading ============
+
+def format_token(txid: int, row_id: int) -> str:
+    return f"{txid}-{row_id}"
+
+
+def parse_token(token: str) -> tuple:
+    """(txid, id) to continue from; an empty token starts at the beginning of the log"""
+    if not token:
+        return (0, 0)
+    try:
+        txid, row_id = (int(part) for part in token.split("-"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid change token")
+    return (txid, row_id)
+
+
+def horizon(db: Session) -> int:
+    """Every transaction below this txid has finished, and the committed ones are visible"""
+    if dialect.is_postgres(db):
+        return int(db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar())
+    return last_txid(db) + 1
+
+
+def changed_entities(db: Session, position: tuple, horizon: int, limit: int) -> tuple:
+    """
+    ({(entity, id): action}, next position, has_more) for up to limit log rows from position.
+
+    Each entity appears once, in the order of its last change; the caller
+    reads its current state. Only transactions below horizon are included.
+    """
+    rows = db.query(ChangeLog.txid, ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.action).filter(
+        tuple_(ChangeLog.txid, ChangeLog.id) >= position,
+        ChangeLog.txid < horizon,
+    ).order_by(ChangeLog.txid, ChangeLog.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if has_more:
+        next_position = (rows[-1].txid, rows[-1].id + 1)
+    else:
+        # Never move backwards, e.g. on a replica that is behind the primary
+        next_position = max(position, (horizon, 0))
+
+    latest = {}
+    for row in rows:
+        latest.pop((row.entity, row.entity_id), None)
+        latest[(row.entity, row.entity_id)] = row.action
+    return latest, next_position, has_more
+
+
+def read_changes(db: Session, since: str, limit: int) -> dict:
+    """One page of the feed after the token since: changed entities, the next token and has_more"""
+    position = parse_token(since)
+    dialect.begin_snapshot(db)
+    latest, next_position, has_more = changed_entities(db, position, horizon(db), limit)
+
+    current = {}
+    for entity, (model, schema) in ENTITIES.items():
+        ids = [entity_id for (name, entity_id) in latest if name == entity]
+        for start in range(0, len(ids), 1000):
+            for obj in db.query(model).filter(model.id.in_(ids[start:start + 1000])):
+                current[(entity, obj.id)] = schema.model_validate(obj).model_dump(mode="json")
+
+    changes = []
+    for (entity, entity_id), action in latest.items():
+        if action == "reset":
+            changes.append({"entity": entity, "id": entity_id, "action": "reset", "data": None})
+        elif (entity, entity_id) in current:
+            changes.append({"entity": entity, "id": entity_id, "action": "upsert",
+                            "data": current[(entity, entity_id)]})
+        else:
+            changes.append({"entity": entity, "id": entity_id, "action": "delete", "data": None})
+    return {"changes": changes, "next": format_token(*next_position), "has_more": has_more}
@@ -1,23 +1,150 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
-from models import Customer, Project, Expense, ProjectCustomer
+from sqlalchemy import Text, delete, event, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from collections import Counter
+from datetime import datetime
+from models import Customer, Project, Expense, ProjectCustomer, CustomerProjectCost, CustomerTotal, ProjectTotal, ProjectTypeTotal
 from schemas import (
     CustomerCreate, CustomerUpdate, ProjectCreate, ProjectUpdate,
-    ExpenseCreate, ExpenseUpdate, ProjectCustomerCreate, ProjectCustomerUpdate,
-    CustomerCostOverview, CustomerCostDetail, ProjectCostOverview, ProjectCostDetail
+    ExpenseCreate, ExpenseUpdate, ExpenseTypeTotal, ProjectCustomerCreate, ProjectCustomerUpdate,
+    DASHBOARD_TOP_SIZE, DashboardSummary, LeaderboardEntry, CustomerCostOverview, CustomerCostDetail, ProjectCostOverview, ProjectCostDetail,
+    ScenarioRequest, ScenarioComparison, ScenarioResult, ScenarioProjectResult, ScenarioCustomerResult
 )
 from fastapi import HTTPException
+from money import FULL_ALLOCATION_BP, allocate, from_ore, from_basis_points
+import changelog
+import dialect
+import events
+import history
+import leaderboards
+from expense_types import expense_type_cache
+
+
+# ============ Change Events ============
+
+PENDING_CHANGES_KEY = "pending_changes"
+
+
+def _publish_change(db: Session, entity: str, action: str, entity_id=None,
+                    project_id: int = None, customer_ids=None):
+    """Queue a change delta; it is published with the affected totals when the transaction commits"""
+    if not events.is_enabled(db):
+        return
+    db.info.setdefault(PENDING_CHANGES_KEY, []).append((entity, action, entity_id, project_id, customer_ids))
+
+
+@event.listens_for(Session, "before_commit")
+def _publish_pending_changes(session):
+    """
+    Publish queued deltas with totals read from the leaderboard aggregates:
+    one primary key lookup per project and customer, instead of summing
+    expenses and re-splitting every project the customers share.
+
+    Each delta carries what a client needs to patch the figures it shows:
+    names, the project's allocation rows, and on the last delta of the
+    transaction a summary of how the dashboard totals moved.
+    """
+    pending = session.info.pop(PENDING_CHANGES_KEY, None)
+    if not pending:
+        return
+    leaderboards.refresh_marked(session)
+    changes = leaderboards.pop_changes(session)
+    deltas = []
+    for entity, action, entity_id, project_id, customer_ids in pending:
+        customer_ids = set(customer_ids or [])
+        delta = {"entity": entity, "action": action, "id": entity_id}
+        if project_id is not None:
+            shares = session.execute(
+                select(ProjectCustomer.id, ProjectCustomer.customer_id, Customer.name,
+                       ProjectCustomer.cost_basis_points, CustomerProjectCost.allocated_ore)
+                .join(Customer, Customer.id == ProjectCustomer.customer_id)
+                .outerjoin(CustomerProjectCost, (CustomerProjectCost.project_id == ProjectCustomer.project_id)
+                           & (CustomerProjectCost.customer_id == ProjectCustomer.customer_id))
+                .where(ProjectCustomer.project_id == project_id)
+                .order_by(ProjectCustomer.customer_id)
+            ).all()
+            customer_ids.update(share.customer_id for share in shares)
+            name, description, total = session.execute(
+                select(Project.name, Project.description, ProjectTotal.total_ore)
+                .outerjoin(ProjectTotal, ProjectTotal.project_id == Project.id)
+                .where(Project.id == project_id)
+            ).one_or_none() or (None, None, None)
+            delta["project"] = {
+                "id": project_id, "name": name, "description": description, "total_expenses": from_ore(total or 0),
+                # The project's allocation rows, as GET /projects/{id}/customers returns them
+                "shares": [
+                    {"id": share_id, "customer_id": customer_id, "customer_name": customer_name,
+                     "cost_percentage": from_basis_points(basis_points), "cost_share": from_ore(allocated or 0)}
+                    for share_id, customer_id, customer_name, basis_points, allocated in shares
+                ],
+            }
+        if customer_ids:
+            totals = {
+                customer_id: (name, allocated) for customer_id, name, allocated in session.execute(
+                    select(Customer.id, Customer.name, CustomerTotal.allocated_ore)
+                    .outerjoin(CustomerTotal, CustomerTotal.customer_id == Customer.id)
+                    .where(Customer.id.in_(customer_ids))
+                )
+            }
+            delta["customers"] = [
+                {"id": customer_id, "name": totals.get(customer_id, (None, 0))[0],
+                 "total_cost": from_ore(totals.get(customer_id, (None, 0))[1] or 0)}
+                for customer_id in sorted(customer_ids)
+            ]
+        deltas.append(delta)
+
+    summary = {
+        "total_expenses_change": from_ore(changes["expenses"]),
+        "allocated_cost_change": from_ore(changes["allocated"]),
+    }
+    if any(entity == "allocation" or (entity != "expense" and action == "deleted") for entity, action, *_ in pending):
+        summary["invalid_allocation_count"] = session.scalar(
+            select(func.count()).select_from(_invalid_allocations())
+        )
+    deltas[-1]["summary"] = summary
+    for delta in deltas:
+        events.publish_change(session, delta)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending_changes(session):
+    session.info.pop(PENDING_CHANGES_KEY, None)
+
+
+# ============ Single-statement writes ============
+# Creates, updates and deletes are one INSERT / UPDATE / DELETE ... RETURNING;
+# a missing or conflicting row shows up as an empty result, not as a prior SELECT.
+# These statements bypass the flush hooks, so callers record history, the change
+# log and leaderboard projects themselves, like import_expenses.
+
+def _returning_one(db: Session, stmt):
+    """First ORM object a RETURNING statement produced, or None"""
+    return db.scalars(stmt, execution_options={"populate_existing": True}).first()
+
+
+def _commit_returned(db: Session, obj):
+    """Commit, keeping obj loaded: a RETURNING row needs no refresh SELECT afterwards"""
+    if isinstance(obj, Expense):
+        # Detached, the response can only read the type name from the cache: make sure it is there
+        expense_type_cache.name_for(obj.expense_type_id, db)
+    db.expunge(obj)
+    db.commit()
+    return obj
 
 
 # ============ Customer Operations ============
 
 def create_customer(db: Session, customer: CustomerCreate):
-    """Create a new customer"""
-    db_customer = Customer(name=customer.name, description=customer.description)
-    db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    """Create a new customer; 409 if the name is taken, decided by the unique index"""
+    db_customer = _returning_one(db, dialect.insert(db)(Customer).values(
+        name=customer.name, description=customer.description
+    ).on_conflict_do_nothing(index_elements=[Customer.name]).returning(Customer))
+    if db_customer is None:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Customer with this name already exists")
+    changelog.record(db, "customer", [db_customer.id])
+    _publish_change(db, "customer", "created", db_customer.id, customer_ids=[db_customer.id])
+    return _commit_returned(db, db_customer)
 
 
 def get_customer(db: Session, customer_id: int):
@@ -31,40 +158,68 @@ def get_customers(db: Session, skip: int = 0, limit: int = 100):
 
 
 def update_customer(db: Session, customer_id: int, customer: CustomerUpdate):
-    """Update a customer"""
-    db_customer = get_customer(db, customer_id)
-    if not db_customer:
+    """Update a customer; None if it does not exist, 409 if the new name is taken"""
+    update_data = customer.model_dump(exclude_unset=True)
+    if not update_data:
+        return get_customer(db, customer_id)
+
+    try:
+        db_customer = _returning_one(
+            db, update(Customer).where(Customer.id == customer_id).values(update_data).returning(Customer)
+        )
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Customer with this name already exists")
+    if db_customer is None:
+        db.rollback()
         return None
-    
-    update_data = customer.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_customer, key, value)
-    
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    changelog.record(db, "customer", [customer_id])
+    _publish_change(db, "customer", "updated", customer_id, customer_ids=[customer_id])
+    return _commit_returned(db, db_customer)
 
 
 def delete_customer(db: Session, customer_id: int):
-    """Delete a customer"""
-    db_customer = get_customer(db, customer_id)
-    if not db_customer:
+    """
+    Delete a customer; ON DELETE CASCADE removes its shares without loading them.
+
+    Returns {"allocations": removed share count}, or None if the customer does not exist.
+    """
+    # Allocation locks before the row lock, in the order allocation writes take them
+    for project_id in _customer_project_ids(db, [customer_id]):
+        dialect.advisory_xact_lock(db, project_id)
+    if not db.query(Customer.id).filter(Customer.id == customer_id).with_for_update().first():
+        db.rollback()
         return None
-    
-    db.delete(db_customer)
+
+    project_ids = _customer_project_ids(db, [customer_id])
+    _, allocations = history.record_cascaded_deletes(db, customer_ids=[customer_id])
+    changelog.record_cascaded_deletes(db, customer_ids=[customer_id])
+    changelog.record(db, "customer", [customer_id], action="delete")
+    db.execute(delete(Customer.__table__).where(Customer.id == customer_id))
+    leaderboards.mark_projects(db, project_ids)
+    _publish_change(db, "customer", "deleted", customer_id)
     db.commit()
-    return db_customer
+    return {"allocations": allocations}
+
+
+def _customer_project_ids(db: Session, customer_ids) -> list:
+    return sorted(
+        project_id for (project_id,) in db.query(ProjectCustomer.project_id).filter(
+            ProjectCustomer.customer_id.in_(customer_ids)
+        ).distinct()
+    )
 
 
 # ============ Project Operations ============
 
 def create_project(db: Session, project: ProjectCreate):
     """Create a new project"""
-    db_project = Project(name=project.name, description=project.description)
-    db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
-    return db_project
+    db_project = _returning_one(
+        db, insert(Project).values(name=project.name, description=project.description).returning(Project)
+    )
+    changelog.record(db, "project", [db_project.id])
+    _publish_change(db, "project", "created", db_project.id, project_id=db_project.id)
+    return _commit_returned(db, db_project)
 
 
 def get_project(db: Session, project_id: int):
@@ -78,50 +233,90 @@ def get_projects(db: Session, skip: int = 0, limit: int = 100):
 
 
 def update_project(db: Session, project_id: int, project: ProjectUpdate):
-    """Update a project"""
-    db_project = get_project(db, project_id)
-    if not db_project:
+    """Update a project; None if it does not exist"""
+    update_data = project.model_dump(exclude_unset=True)
+    if not update_data:
+        return get_project(db, project_id)
+
+    db_project = _returning_one(
+        db, update(Project).where(Project.id == project_id).values(update_data).returning(Project)
+    )
+    if db_project is None:
+        db.rollback()
         return None
-    
-    update_data = project.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_project, key, value)
-    
-    db.commit()
-    db.refresh(db_project)
-    return db_project
+    changelog.record(db, "project", [project_id])
+    _publish_change(db, "project", "updated", project_id, project_id=project_id)
+    return _commit_returned(db, db_project)
 
 
 def delete_project(db: Session, project_id: int):
-    """Delete a project"""
-    db_project = get_project(db, project_id)
-    if not db_project:
+    """Delete a project; returns the removed child counts, or None if it does not exist"""
+    summary = delete_projects(db, [project_id])
+    if not summary["project_ids"]:
         return None
-    
-    db.delete(db_project)
+    return summary
+
+
+def delete_projects(db: Session, project_ids: list) -> dict:
+    """
+    Delete projects with one DELETE; ON DELETE CASCADE removes their expenses and shares.
+
+    The children are never loaded: the projects are locked against new
+    children first, then history.record_cascaded_deletes writes their history
+    rows and counts them. Ids that do not exist are returned in not_found.
+    """
+    requested = sorted(set(project_ids))
+    # Allocation locks before the row locks, in the order allocation writes take them
+    for project_id in requested:
+        dialect.advisory_xact_lock(db, project_id)
+    found = [
+        project_id for (project_id,) in db.query(Project.id).filter(
+            Project.id.in_(requested)
+        ).order_by(Project.id).with_for_update()
+    ]
+    summary = {"project_ids": found, "not_found": sorted(set(requested) - set(found)),
+               "expenses": 0, "allocations": 0}
+    if not found:
+        db.rollback()
+        return summary
+
+    customer_ids = {}
+    for project_id, customer_id in db.query(ProjectCustomer.project_id, ProjectCustomer.customer_id).filter(
+        ProjectCustomer.project_id.in_(found)
+    ):
+        customer_ids.setdefault(project_id, []).append(customer_id)
+    summary["expenses"], summary["allocations"] = history.record_cascaded_deletes(db, project_ids=found)
+    changelog.record_cascaded_deletes(db, project_ids=found)
+    changelog.record(db, "project", found, action="delete")
+    db.execute(delete(Project.__table__).where(Project.id.in_(found)))
+    leaderboards.mark_projects(db, found)
+    for project_id in found:
+        _publish_change(db, "project", "deleted", project_id, customer_ids=customer_ids.get(project_id))
     db.commit()
-    return db_project
+    return summary
 
 
 # ============ Expense Operations ============
 
 def create_expense(db: Session, expense: ExpenseCreate):
-    """Create a new expense"""
-    # Verify project exists
-    project = get_project(db, expense.project_id)
-    if not project:
+    """Create a new expense; INSERT ... SELECT from projects, so a missing project inserts nothing (404)"""
+    type_id = expense_type_cache.id_for(db, expense.expense_type)
+    db_expense = _returning_one(db, insert(Expense).from_select(
+        ["project_id", "expense_type_id", "amount_ore", "description"],
+        select(Project.id, literal(type_id), literal(expense.amount_ore), literal(expense.description, Text))
+        .where(Project.id == expense.project_id),
+    ).returning(Expense))
+    if db_expense is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Project not found")
-    
-    db_expense = Expense(
-        project_id=expense.project_id,
-        expense_type=expense.expense_type,
-        amount=expense.amount,
-        description=expense.description
+
+    history.record_expense_changes(
+        db, [(db_expense.id, db_expense.project_id, db_expense.amount_ore, db_expense.amount_ore)]
     )
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    changelog.record(db, "expense", [db_expense.id])
+    leaderboards.mark_projects(db, [db_expense.project_id])
+    _publish_change(db, "expense", "created", db_expense.id, project_id=db_expense.project_id)
+    return _commit_returned(db, db_expense)
 
 
 def get_expense(db: Session, expense_id: int):
@@ -140,34 +335,73 @@ def get_expenses(db: Session, skip: int = 0, limit: int = 100):
 
 
 def update_expense(db: Session, expense_id: int, expense: ExpenseUpdate):
-    """Update an expense"""
-    db_expense = get_expense(db, expense_id)
-    if not db_expense:
+    """Update an expense; None if it does not exist"""
+    update_data = expense.column_values()
+    if 'expense_type' in update_data:
+        update_data['expense_type_id'] = expense_type_cache.id_for(db, update_data.pop('expense_type'))
+    if not update_data:
+        return get_expense(db, expense_id)
+
+    updated = _update_expense_returning(db, expense_id, update_data)
+    if updated is None:
+        db.rollback()
         return None
-    
-    update_data = expense.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_expense, key, value)
-    
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    db_expense, previous_amount = updated
+
+    if db_expense.amount_ore != previous_amount:
+        history.record_expense_changes(db, [
+            (expense_id, db_expense.project_id, db_expense.amount_ore, db_expense.amount_ore - previous_amount)
+        ])
+    changelog.record(db, "expense", [expense_id])
+    if update_data.keys() & {"amount_ore", "expense_type_id"}:
+        leaderboards.mark_projects(db, [db_expense.project_id])
+    _publish_change(db, "expense", "updated", expense_id, project_id=db_expense.project_id)
+    return _commit_returned(db, db_expense)
+
+
+def _update_expense_returning(db: Session, expense_id: int, values: dict):
+    """UPDATE ... RETURNING (expense, amount before the update), or None if it does not exist"""
+    if dialect.is_postgres(db):
+        # The CTE locks the row, so its amount is the version the UPDATE replaces
+        previous = select(Expense.id, Expense.project_id, Expense.amount_ore).where(
+            Expense.id == expense_id
+        ).with_for_update().cte("previous")
+        return db.execute(
+            update(Expense).where(Expense.id == previous.c.id, Expense.project_id == previous.c.project_id)
+            .values(values).returning(Expense, previous.c.amount_ore),
+            execution_options={"populate_existing": True},
+        ).first()
+
+    # SQLite's RETURNING cannot read other tables; with its single writer the amount can be read first
+    previous_amount = db.query(Expense.amount_ore).filter(Expense.id == expense_id).scalar()
+    if previous_amount is None:
+        return None
+    db_expense = _returning_one(db, update(Expense).where(Expense.id == expense_id).values(values).returning(Expense))
+    return db_expense, previous_amount
 
 
 def delete_expense(db: Session, expense_id: int):
-    """Delete an expense"""
-    db_expense = get_expense(db, expense_id)
-    if not db_expense:
+    """Delete an expense; returns its (id, project_id, amount_ore), or None if it does not exist"""
+    deleted = db.execute(
+        delete(Expense).where(Expense.id == expense_id)
+        .returning(Expense.id, Expense.project_id, Expense.amount_ore)
+    ).first()
+    if deleted is None:
+        db.rollback()
         return None
-    
-    db.delete(db_expense)
+
+    history.record_expense_changes(db, [(deleted.id, deleted.project_id, None, -deleted.amount_ore)])
+    changelog.record(db, "expense", [deleted.id], action="delete")
+    leaderboards.mark_projects(db, [deleted.project_id])
+    _publish_change(db, "expense", "deleted", expense_id, project_id=deleted.project_id)
     db.commit()
-    return db_expense
+    return deleted
 
 
 def bulk_create_expenses(db: Session, expenses: list):
     """Create multiple expenses"""
     db_expenses = []
+    type_ids = expense_type_cache.ids_for(db, [expense.expense_type for expense in expenses])
     for expense in expenses:
         # Verify project exists
         project = get_project(db, expense.project_id)
@@ -176,17 +410,128 @@ def bulk_create_expenses(db: Session, expenses: list):
         
         db_expense = Expense(
             project_id=expense.project_id,
-            expense_type=expense.expense_type,
-            amount=expense.amount,
+            expense_type_id=type_ids[expense.expense_type],
+            amount_ore=expense.amount_ore,
             description=expense.description
         )
         db_expenses.append(db_expense)
     
     db.add_all(db_expenses)
+    db.flush()
+    for project_id in sorted({e.project_id for e in db_expenses}):
+        _publish_change(db, "expense", "imported", project_id=project_id)
     db.commit()
     return db_expenses
 
 
+IMPORT_BATCH_SIZE = 1000  # rows per fingerprint lookup / upsert statement
+
+
+def import_expenses(db: Session, rows: list, occurrences: Counter = None) -> dict:
+    """
+    Idempotently import expenses keyed on (project_id, source key).
+
+    Rows already stored with the same fingerprint are skipped without a
+    write, rows whose content changed are updated in place with
+    INSERT ... ON CONFLICT, and the rest are inserted. Returns the counts
+    of new, changed and unchanged rows.
+
+    Keyless rows are numbered per fingerprint so that identical copies are
+    all kept; pass the same occurrences Counter for every part of one export
+    that is imported in several calls.
+    """
+    occurrences = Counter() if occurrences is None else occurrences
+    # When an export repeats a source ID, its last row wins
+    latest = {}
+    for row in rows:
+        if row.source_key:
+            key = row.import_key()
+        else:
+            occurrences[row.fingerprint] += 1
+            key = row.import_key(occurrences[row.fingerprint])
+        latest[(row.project_id, key)] = row
+    keyed_rows = list(latest.items())
+
+    insert = dialect.insert(db)
+    summary = {"new": 0, "changed": 0, "unchanged": 0}
+    touched_project_ids = set()
+
+    for start in range(0, len(keyed_rows), IMPORT_BATCH_SIZE):
+        batch = keyed_rows[start:start + IMPORT_BATCH_SIZE]
+        project_ids = {row.project_id for _, row in batch}
+
+        existing_project_ids = {
+            pid for (pid,) in db.query(Project.id).filter(Project.id.in_(project_ids)).all()
+        }
+        missing_project_ids = sorted(project_ids - existing_project_ids)
+        if missing_project_ids:
+            db.rollback()
+            raise HTTPException(status_code=404, detail=f"Project {missing_project_ids[0]} not found")
+
+        stored = {
+            (project_id, source_key): (fingerprint, amount_ore)
+            for project_id, source_key, fingerprint, amount_ore in db.query(
+                Expense.project_id, Expense.source_key, Expense.fingerprint, Expense.amount_ore
+            ).filter(
+                Expense.project_id.in_(project_ids),
+                Expense.source_key.in_({source_key for (_, source_key), _ in batch})
+            ).all()
+        }
+
+        type_ids = expense_type_cache.ids_for(db, [row.expense_type for _, row in batch])
+        values = []
+        for key, row in batch:
+            if key not in stored:
+                summary["new"] += 1
+            elif stored[key][0] != row.fingerprint:
+                summary["changed"] += 1
+            else:
+                summary["unchanged"] += 1
+                continue
+            values.append({
+                "project_id": row.project_id,
+                "expense_type_id": type_ids[row.expense_type],
+                "amount_ore": row.amount_ore,
+                "description": row.description,
+                "source_key": key[1],
+                "fingerprint": row.fingerprint,
+            })
+            touched_project_ids.add(row.project_id)
+
+        if not values:
+            continue
+
+        stmt = insert(Expense).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Expense.project_id, Expense.source_key],
+            set_={
+                "expense_type_id": stmt.excluded.expense_type_id,
+                "amount_ore": stmt.excluded.amount_ore,
+                "description": stmt.excluded.description,
+                "fingerprint": stmt.excluded.fingerprint,
+                "updated_at": datetime.utcnow(),
+            },
+            # A concurrent import may already have written the same content
+            where=Expense.fingerprint.is_distinct_from(stmt.excluded.fingerprint),
+        ).returning(Expense.id, Expense.project_id, Expense.source_key, Expense.amount_ore)
+
+        # The upsert bypasses the ORM, so it records its own history and change log rows
+        written = db.execute(stmt).all()
+        history.record_expense_changes(db, [
+            (expense_id, project_id, amount_ore,
+             amount_ore - (stored[(project_id, source_key)][1] if (project_id, source_key) in stored else 0))
+            for expense_id, project_id, source_key, amount_ore in written
+        ])
+        changelog.record(db, "expense", [expense_id for expense_id, _, _, _ in written])
+
+    # Core writes are invisible to the flush hook that maintains the leaderboards
+    leaderboards.mark_projects(db, touched_project_ids)
+    for project_id in sorted(touched_project_ids):
+        _publish_change(db, "expense", "imported", project_id=project_id)
+    db.commit()
+    return summary
+
+
 # ============ Project Customer (Cost Sharing) Operations ============
 
 def add_customer_to_project(db: Session, project_customer: ProjectCustomerCreate):
@@ -201,7 +546,7 @@ def add_customer_to_project(db: Session, project_customer: ProjectCustomerCreate
         raise HTTPException(status_code=404, detail="Project not found")
     
     # Acquire advisory lock for this project to serialize allocation changes
-    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": project_customer.project_id})
+    dialect.advisory_xact_lock(db, project_customer.project_id)
 
     # Check if customer already exists in project
     existing = db.query(ProjectCustomer).filter(
@@ -212,20 +557,21 @@ def add_customer_to_project(db: Session, project_customer: ProjectCustomerCreate
     if existing:
         raise HTTPException(status_code=400, detail="Customer already added to this project")
     # Validate that adding this allocation won't push total > 100
-    current_total = db.query(func.coalesce(func.sum(ProjectCustomer.cost_percentage), 0)).filter(
+    current_total = int(db.query(func.coalesce(func.sum(ProjectCustomer.cost_basis_points), 0)).filter(
         ProjectCustomer.project_id == project_customer.project_id
-    ).scalar() or 0.0
+    ).scalar() or 0)
 
-    new_total = float(current_total) + float(project_customer.cost_percentage)
-    if new_total > 100.0 + 1e-9:
-        raise HTTPException(status_code=400, detail=f"Allocation exceeds 100% (current: {current_total}%, adding: {project_customer.cost_percentage}%)")
+    if current_total + project_customer.cost_basis_points > FULL_ALLOCATION_BP:
+        raise HTTPException(status_code=400, detail=f"Allocation exceeds 100% (current: {from_basis_points(current_total)}%, adding: {project_customer.cost_percentage}%)")
 
     db_pc = ProjectCustomer(
         project_id=project_customer.project_id,
         customer_id=project_customer.customer_id,
-        cost_percentage=project_customer.cost_percentage
+        cost_basis_points=project_customer.cost_basis_points
     )
     db.add(db_pc)
+    db.flush()
+    _publish_change(db, "allocation", "created", db_pc.id, project_id=db_pc.project_id)
     db.commit()
     db.refresh(db_pc)
     return db_pc
@@ -247,24 +593,27 @@ def get_project_customer(db: Session, project_id: int, customer_id: int):
 def update_project_customer(db: Session, project_id: int, customer_id: int, 
                            project_customer: ProjectCustomerUpdate):
     """Update cost percentage for a customer in a project"""
+    # Acquire advisory lock for this project to serialize allocation changes;
+    # load the row only afterwards so a concurrent removal is seen
+    dialect.advisory_xact_lock(db, project_id)
+
     db_pc = get_project_customer(db, project_id, customer_id)
     if not db_pc:
         return None
-    # Acquire advisory lock for this project to serialize allocation changes
-    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": project_id})
 
     # Validate that updating this allocation won't push total > 100
     # Sum current allocations excluding this customer
-    current_total_excluding = db.query(func.coalesce(func.sum(ProjectCustomer.cost_percentage), 0)).filter(
+    current_total_excluding = int(db.query(func.coalesce(func.sum(ProjectCustomer.cost_basis_points), 0)).filter(
         ProjectCustomer.project_id == project_id,
         ProjectCustomer.customer_id != customer_id
-    ).scalar() or 0.0
+    ).scalar() or 0)
 
-    new_total = float(current_total_excluding) + float(project_customer.cost_percentage)
-    if new_total > 100.0 + 1e-9:
-        raise HTTPException(status_code=400, detail=f"Allocation exceeds 100% (others: {current_total_excluding}%, setting: {project_customer.cost_percentage}%)")
+    if current_total_excluding + project_customer.cost_basis_points > FULL_ALLOCATION_BP:
+        raise HTTPException(status_code=400, detail=f"Allocation exceeds 100% (others: {from_basis_points(current_total_excluding)}%, setting: {project_customer.cost_percentage}%)")
 
-    db_pc.cost_percentage = project_customer.cost_percentage
+    db_pc.cost_basis_points = project_customer.cost_basis_points
+    db.flush()
+    _publish_change(db, "allocation", "updated", db_pc.id, project_id=project_id)
     db.commit()
     db.refresh(db_pc)
     return db_pc
@@ -273,31 +622,33 @@ def update_project_customer(db: Session, project_id: int, customer_id: int,
 def remove_customer_from_project(db: Session, project_id: int, customer_id: int):
     """Remove a customer from a project"""
     # Acquire advisory lock for this project to serialize allocation changes
-    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": project_id})
+    dialect.advisory_xact_lock(db, project_id)
 
     db_pc = get_project_customer(db, project_id, customer_id)
     if not db_pc:
         return None
     
     db.delete(db_pc)
+    db.flush()
+    _publish_change(db, "allocation", "deleted", db_pc.id, project_id=project_id, customer_ids=[customer_id])
     db.commit()
     return db_pc
 
 
 def validate_project_cost_allocation(db: Session, project_id: int) -> dict:
-    """Validate that cost percentages for a project sum to 100%"""
+    """Validate that cost percentages for a project sum to exactly 100%"""
     project_customers = get_project_customers(db, project_id)
-    total_percentage = sum(pc.cost_percentage for pc in project_customers)
+    total_basis_points = sum(pc.cost_basis_points for pc in project_customers)
     
     return {
         "project_id": project_id,
-        "total_percentage": total_percentage,
-        "is_valid": total_percentage == 100 if project_customers else True,
+        "total_percentage": from_basis_points(total_basis_points),
+        "is_valid": total_basis_points == FULL_ALLOCATION_BP if project_customers else True,
         "customer_count": len(project_customers),
         "allocation_details": [
             {
                 "customer_id": pc.customer_id,
-                "cost_percentage": pc.cost_percentage
+                "cost_percentage": from_basis_points(pc.cost_basis_points)
             } for pc in project_customers
         ]
     }
@@ -305,77 +656,561 @@ def validate_project_cost_allocation(db: Session, project_id: int) -> dict:
 
 # ============ Cost Overview Operations ============
 
-def get_customer_cost_overview(db: Session, customer_id: int) -> CustomerCostOverview:
-    """Get total costs and breakdown per project for a customer"""
+def get_project_totals(db: Session, project_ids) -> dict:
+    """Total expenses in øre per project, as one integer SUM ... GROUP BY"""
+    if not project_ids:
+        return {}
+    rows = db.query(Expense.project_id, func.sum(Expense.amount_ore)).filter(
+        Expense.project_id.in_(project_ids)
+    ).group_by(Expense.project_id).all()
+    totals = {project_id: 0 for project_id in project_ids}
+    totals.update({project_id: int(total or 0) for project_id, total in rows})
+    return totals
+
+
+def get_expense_type_totals(db: Session, project_id: int = None) -> list:
+    """Expense count and total per expense type, grouped on the SMALLINT type id"""
+    query = db.query(Expense.expense_type_id, func.count(), func.sum(Expense.amount_ore))
+    if project_id is not None:
+        if not get_project(db, project_id):
+            raise HTTPException(status_code=404, detail="Project not found")
+        query = query.filter(Expense.project_id == project_id)
+    rows = query.group_by(Expense.expense_type_id).all()
+    totals = [
+        ExpenseTypeTotal(
+            expense_type_id=type_id,
+            expense_type=expense_type_cache.name_for(type_id, db),
+            expense_count=count,
+            total_expenses=from_ore(int(total or 0)),
+        ) for type_id, count, total in rows
+    ]
+    return sorted(totals, key=lambda total: total.expense_type)
+
+
+def get_allocated_costs(db: Session, project_ids, project_totals: dict = None) -> dict:
+    """
+    Allocated cost in øre per (project_id, customer_id) for the given projects.
+
+    Each project's total is split over all of its customers with the largest
+    remainder method, so a fully allocated project adds up to the øre.
+    """
+    if not project_ids:
+        return {}
+    if project_totals is None:
+        project_totals = get_project_totals(db, project_ids)
+
+    rows = db.query(
+        ProjectCustomer.project_id, ProjectCustomer.customer_id, ProjectCustomer.cost_basis_points
+    ).filter(
+        ProjectCustomer.project_id.in_(project_ids)
+    ).order_by(ProjectCustomer.project_id, ProjectCustomer.customer_id).all()
+
+    shares = {}
+    for project_id, customer_id, basis_points in rows:
+        shares.setdefault(project_id, []).append((customer_id, basis_points))
+
+    allocated = {}
+    for project_id, project_shares in shares.items():
+        parts = allocate(project_totals.get(project_id, 0), [bp for _, bp in project_shares])
+        for (customer_id, _), part in zip(project_shares, parts):
+            allocated[(project_id, customer_id)] = part
+    return allocated
+
+
+def get_customer_totals(db: Session, customer_ids) -> dict:
+    """Total allocated cost in øre per customer"""
+    if not customer_ids:
+        return {}
+    project_ids = [
+        project_id for (project_id,) in db.query(ProjectCustomer.project_id).filter(
+            ProjectCustomer.customer_id.in_(customer_ids)
+        ).distinct().all()
+    ]
+    totals = {customer_id: 0 for customer_id in customer_ids}
+    for (_, customer_id), part in get_allocated_costs(db, project_ids).items():
+        if customer_id in totals:
+            totals[customer_id] += part
+    return totals
+
+
+def get_customer_cost_overview(db: Session, customer_id: int, as_of: datetime = None) -> CustomerCostOverview:
+    """Get total costs and breakdown per project for a customer, now or under the split at as_of"""
     customer = get_customer(db, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+    if as_of is not None:
+        return _customer_cost_overview_as_of(db, customer, history.normalize_as_of(as_of))
     
-    project_customers = db.query(ProjectCustomer).filter(
+    project_customers = db.query(
+        ProjectCustomer.project_id, Project.name, ProjectCustomer.cost_basis_points
+    ).join(Project, Project.id == ProjectCustomer.project_id).filter(
         ProjectCustomer.customer_id == customer_id
-    ).all()
+    ).order_by(ProjectCustomer.project_id).all()
+    
+    project_ids = [project_id for project_id, _, _ in project_customers]
+    project_totals = get_project_totals(db, project_ids)
+    allocated = get_allocated_costs(db, project_ids, project_totals)
     
-    total_cost = 0.0
+    total_cost = 0
     projects_details = []
     
-    for pc in project_customers:
-        project = pc.project
-        # Get total expenses for this project
-        total_expenses = db.query(func.sum(Expense.amount)).filter(
-            Expense.project_id == project.id
-        ).scalar() or 0.0
-        
-        # Calculate allocated cost based on percentage
-        allocated_cost = total_expenses * (pc.cost_percentage / 100)
+    for project_id, project_name, basis_points in project_customers:
+        allocated_cost = allocated.get((project_id, customer_id), 0)
         total_cost += allocated_cost
         
         projects_details.append(CustomerCostDetail(
-            project_id=project.id,
-            project_name=project.name,
-            cost_percentage=pc.cost_percentage,
-            total_expenses=total_expenses,
-            allocated_cost=allocated_cost
+            project_id=project_id,
+            project_name=project_name,
+            cost_percentage=from_basis_points(basis_points),
+            total_expenses=from_ore(project_totals[project_id]),
+            allocated_cost=from_ore(allocated_cost)
         ))
     
     return CustomerCostOverview(
         customer_id=customer_id,
         customer_name=customer.name,
-        total_cost=total_cost,
+        total_cost=from_ore(total_cost),
         projects=projects_details
     )
 
 
-def get_project_cost_overview(db: Session, project_id: int) -> ProjectCostOverview:
-    """Get total costs and breakdown per customer for a project"""
+def get_project_cost_overview(db: Session, project_id: int, as_of: datetime = None) -> ProjectCostOverview:
+    """Get total costs and breakdown per customer for a project, now or at as_of"""
     project = get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    if as_of is not None:
+        return _project_cost_overview_as_of(db, project, history.normalize_as_of(as_of))
     
     # Get total expenses for this project
-    total_expenses = db.query(func.sum(Expense.amount)).filter(
-        Expense.project_id == project_id
-    ).scalar() or 0.0
+    total_expenses = get_project_totals(db, [project_id])[project_id]
     
-    project_customers = db.query(ProjectCustomer).filter(
+    project_customers = db.query(
+        ProjectCustomer.customer_id, Customer.name, ProjectCustomer.cost_basis_points
+    ).join(Customer, Customer.id == ProjectCustomer.customer_id).filter(
         ProjectCustomer.project_id == project_id
-    ).all()
+    ).order_by(ProjectCustomer.customer_id).all()
     
+    return _build_project_cost_overview(project_id, project.name, total_expenses, project_customers)
+
+
+def _build_project_cost_overview(project_id: int, project_name: str, total_expenses: int,
+                                 project_customers) -> ProjectCostOverview:
+    """Overview from the project total in øre and (customer_id, name, basis_points) rows ordered by customer"""
+    parts = allocate(total_expenses, [bp for _, _, bp in project_customers])
     customers_details = []
     
-    for pc in project_customers:
-        customer = pc.customer
-        allocated_cost = total_expenses * (pc.cost_percentage / 100)
-        
+    for (customer_id, customer_name, basis_points), allocated_cost in zip(project_customers, parts):
         customers_details.append(ProjectCostDetail(
-            customer_id=customer.id,
-            customer_name=customer.name,
-            cost_percentage=pc.cost_percentage,
-            allocated_cost=allocated_cost
+            customer_id=customer_id,
+            customer_name=customer_name,
+            cost_percentage=from_basis_points(basis_points),
+            allocated_cost=from_ore(allocated_cost)
         ))
     
     return ProjectCostOverview(
         project_id=project_id,
-        project_name=project.name,
-        total_expenses=total_expenses,
+        project_name=project_name,
+        total_expenses=from_ore(total_expenses),
         customers=customers_details
     )
+
+
+def _names(db: Session, model, ids) -> dict:
+    """id -> name for current rows; history may mention rows deleted since"""
+    if not ids:
+        return {}
+    found = dict(db.query(model.id, model.name).filter(model.id.in_(ids)).all())
+    return {id_: found.get(id_, f"{model.__name__} {id_} (deleted)") for id_ in ids}
+
+
+def _project_cost_overview_as_of(db: Session, project: Project, as_of: datetime) -> ProjectCostOverview:
+    """Project overview from the nearest history snapshot plus later changes up to as_of"""
+    snapshot = history.snapshot_for(db, as_of)
+    total_expenses = history.project_totals_as_of(db, snapshot, as_of, [project.id])[project.id]
+    shares = history.allocations_as_of(db, snapshot, as_of, project_ids=[project.id]).get(project.id, {})
+    names = _names(db, Customer, sorted(shares))
+    project_customers = [(customer_id, names[customer_id], shares[customer_id]) for customer_id in sorted(shares)]
+    return _build_project_cost_overview(project.id, project.name, total_expenses, project_customers)
+
+
+def _customer_cost_overview_as_of(db: Session, customer: Customer, as_of: datetime) -> CustomerCostOverview:
+    """Customer overview under the splits and expense totals in effect at as_of"""
+    snapshot = history.snapshot_for(db, as_of)
+    project_ids = sorted(history.allocations_as_of(db, snapshot, as_of, customer_ids=[customer.id]))
+    # Splits use every customer of each project, like the live overview
+    shares = history.allocations_as_of(db, snapshot, as_of, project_ids=project_ids)
+    project_totals = history.project_totals_as_of(db, snapshot, as_of, project_ids)
+    names = _names(db, Project, project_ids)
+
+    total_cost = 0
+    projects_details = []
+    for project_id in project_ids:
+        allocated_cost = _split(project_totals[project_id], shares[project_id])[customer.id]
+        total_cost += allocated_cost
+        projects_details.append(CustomerCostDetail(
+            project_id=project_id,
+            project_name=names[project_id],
+            cost_percentage=from_basis_points(shares[project_id][customer.id]),
+            total_expenses=from_ore(project_totals[project_id]),
+            allocated_cost=from_ore(allocated_cost)
+        ))
+
+    return CustomerCostOverview(
+        customer_id=customer.id,
+        customer_name=customer.name,
+        total_cost=from_ore(total_cost),
+        projects=projects_details
+    )
+
+
+# ============ Dashboard ============
+
+def _invalid_allocations():
+    """Projects whose shares do not add up to 100%"""
+    return select(ProjectCustomer.project_id).group_by(ProjectCustomer.project_id).having(
+        func.sum(ProjectCustomer.cost_basis_points) != FULL_ALLOCATION_BP
+    ).subquery()
+
+
+def get_dashboard_summary(db: Session) -> DashboardSummary:
+    """
+    Landing page figures: a single SELECT of scalar subqueries, plus the
+    top DASHBOARD_TOP_SIZE customers and projects so the page needs no
+    other request.
+
+    Totals come from the maintained aggregates in leaderboards.py, so only
+    the counts touch the base tables, and the top lists are short index
+    walks. Projects without customers count as valid, as in
+    validate_project_cost_allocation.
+    """
+    customers, projects, expenses, total, allocated, invalid = db.execute(select(
+        select(func.count()).select_from(Customer).scalar_subquery(),
+        select(func.count()).select_from(Project).scalar_subquery(),
+        select(func.count()).select_from(Expense).scalar_subquery(),
+        select(func.coalesce(func.sum(ProjectTotal.total_ore), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(CustomerTotal.allocated_ore), 0)).scalar_subquery(),
+        select(func.count()).select_from(_invalid_allocations()).scalar_subquery(),
+    )).one()
+    total, allocated = int(total), int(allocated)
+    return DashboardSummary(
+        customer_count=customers,
+        project_count=projects,
+        expense_count=expenses,
+        total_expenses=from_ore(total),
+        average_project_expenses=from_ore(round(total / projects)) if projects else 0.0,
+        average_expense=from_ore(round(total / expenses)) if expenses else 0.0,
+        allocated_cost=from_ore(allocated),
+        unallocated_cost=from_ore(total - allocated),
+        invalid_allocation_count=invalid,
+        top_customers=get_top_customers(db, DASHBOARD_TOP_SIZE),
+        top_projects=get_top_projects(db, DASHBOARD_TOP_SIZE),
+    )
+
+
+# ============ Leaderboards ============
+
+def _ranked(rows) -> list:
+    return [
+        LeaderboardEntry(rank=rank, id=entity_id, name=name, total_cost=from_ore(total))
+        for rank, (entity_id, name, total) in enumerate(rows, start=1)
+    ]
+
+
+def get_top_projects(db: Session, limit: int, customer_id: int = None, expense_type: str = None) -> list:
+    """
+    Most expensive projects, read from the maintained aggregates in leaderboards.py.
+
+    Overall by expense total; with customer_id by that customer's allocated
+    cost; with expense_type by the total of that type. Each walks a ranking
+    index and stops after limit rows.
+    """
+    if customer_id is not None and expense_type is not None:
+        raise HTTPException(status_code=400, detail="Use either customer_id or expense_type, not both")
+
+    if customer_id is not None:
+        if not get_customer(db, customer_id):
+            raise HTTPException(status_code=404, detail="Customer not found")
+        query = db.query(CustomerProjectCost.project_id, Project.name, CustomerProjectCost.allocated_ore).join(
+            Project, Project.id == CustomerProjectCost.project_id
+        ).filter(CustomerProjectCost.customer_id == customer_id).order_by(
+            CustomerProjectCost.allocated_ore.desc(), CustomerProjectCost.project_id
+        )
+    elif expense_type is not None:
+        type_id = expense_type_cache.lookup(db, expense_type)
+        if type_id is None:
+            raise HTTPException(status_code=404, detail="Expense type not found")
+        query = db.query(ProjectTypeTotal.project_id, Project.name, ProjectTypeTotal.total_ore).join(
+            Project, Project.id == ProjectTypeTotal.project_id
+        ).filter(ProjectTypeTotal.expense_type_id == type_id).order_by(
+            ProjectTypeTotal.total_ore.desc(), ProjectTypeTotal.project_id
+        )
+    else:
+        query = db.query(ProjectTotal.project_id, Project.name, ProjectTotal.total_ore).join(
+            Project, Project.id == ProjectTotal.project_id
+        ).order_by(ProjectTotal.total_ore.desc(), ProjectTotal.project_id)
+
+    return _ranked(query.limit(limit).all())
+
+
+def get_top_customers(db: Session, limit: int) -> list:
+    """Customers with the highest allocated cost across all projects"""
+    return _ranked(
+        db.query(CustomerTotal.customer_id, Customer.name, CustomerTotal.allocated_ore).join(
+            Customer, Customer.id == CustomerTotal.customer_id
+        ).order_by(CustomerTotal.allocated_ore.desc(), CustomerTotal.customer_id).limit(limit).all()
+    )
+
+
+# ============ What-if Scenarios ============
+
+def _split(total_ore: int, shares: dict) -> dict:
+    """{customer_id: basis_points} -> {customer_id: øre}, in customer order like get_allocated_costs"""
+    customer_ids = sorted(shares)
+    parts = allocate(total_ore, [shares[customer_id] for customer_id in customer_ids])
+    return dict(zip(customer_ids, parts))
+
+
+def _scenario_project(project_id: int, project_name: str, total_expenses: int, shares: dict,
+                      parts: dict, customer_names: dict) -> ScenarioProjectResult:
+    total_basis_points = sum(shares.values())
+    return ScenarioProjectResult(
+        project_id=project_id,
+        project_name=project_name,
+        total_expenses=from_ore(total_expenses),
+        total_percentage=from_basis_points(total_basis_points),
+        is_valid=total_basis_points == FULL_ALLOCATION_BP if shares else True,
+        customers=[
+            ProjectCostDetail(
+                customer_id=customer_id,
+                customer_name=customer_names[customer_id],
+                cost_percentage=from_basis_points(shares[customer_id]),
+                allocated_cost=from_ore(parts[customer_id]),
+            ) for customer_id in sorted(shares)
+        ],
+    )
+
+
+def evaluate_scenarios(db: Session, request: ScenarioRequest) -> ScenarioComparison:
+    """
+    Evaluate hypothetical allocation changes without writing anything.
+
+    Expense totals and allocations of every project any scenario touches, and
+    of the other projects of the customers involved, are read once from one
+    snapshot. Each scenario then only re-splits the projects it changes;
+    everything else reuses the baseline split.
+    """
+    changes = [change for scenario in request.scenarios for change in scenario.changes]
+    changed_project_ids = {change.project_id for change in changes}
+    changed_customer_ids = {change.customer_id for change in changes}
+
+    dialect.begin_snapshot(db)
+
+    project_names = dict(db.query(Project.id, Project.name).filter(Project.id.in_(changed_project_ids)).all())
+    missing_project_ids = sorted(changed_project_ids - project_names.keys())
+    if missing_project_ids:
+        raise HTTPException(status_code=404, detail=f"Projects not found: {missing_project_ids}")
+
+    rows = db.query(
+        ProjectCustomer.project_id, ProjectCustomer.customer_id, ProjectCustomer.cost_basis_points
+    ).filter(ProjectCustomer.project_id.in_(changed_project_ids)).all()
+    customer_ids = changed_customer_ids | {customer_id for _, customer_id, _ in rows}
+
+    customer_names = dict(db.query(Customer.id, Customer.name).filter(Customer.id.in_(customer_ids)).all())
+    missing_customer_ids = sorted(changed_customer_ids - customer_names.keys())
+    if missing_customer_ids:
+        raise HTTPException(status_code=404, detail=f"Customers not found: {missing_customer_ids}")
+
+    # The customers' other projects, split over all of their customers, for the customer totals
+    other_rows = db.query(
+        ProjectCustomer.project_id, ProjectCustomer.customer_id, ProjectCustomer.cost_basis_points
+    ).filter(
+        ProjectCustomer.project_id.in_(
+            db.query(ProjectCustomer.project_id).filter(ProjectCustomer.customer_id.in_(customer_ids))
+        ),
+        ProjectCustomer.project_id.notin_(changed_project_ids),
+    ).all()
+
+    shares = {project_id: {} for project_id in changed_project_ids}
+    for project_id, customer_id, basis_points in rows + other_rows:
+        shares.setdefault(project_id, {})[customer_id] = basis_points
+    project_totals = get_project_totals(db, list(shares))
+
+    baseline_parts = {project_id: _split(project_totals[project_id], shares[project_id]) for project_id in shares}
+    baseline_costs = {customer_id: 0 for customer_id in customer_ids}
+    for parts in baseline_parts.values():
+        for customer_id, part in parts.items():
+            if customer_id in baseline_costs:
+                baseline_costs[customer_id] += part
+
+    baseline = [
+        _scenario_project(project_id, project_names[project_id], project_totals[project_id],
+                          shares[project_id], baseline_parts[project_id], customer_names)
+        for project_id in sorted(changed_project_ids)
+    ]
+
+    results = []
+    for scenario in request.scenarios:
+        scenario_shares = {}
+        for change in scenario.changes:
+            project_shares = scenario_shares.setdefault(change.project_id, dict(shares[change.project_id]))
+            if change.cost_basis_points:
+                project_shares[change.customer_id] = change.cost_basis_points
+            else:
+                project_shares.pop(change.customer_id, None)
+
+        errors, projects, deltas = [], [], {}
+        for project_id in sorted(scenario_shares):
+            project_shares = scenario_shares[project_id]
+            parts = _split(project_totals[project_id], project_shares)
+            total_basis_points = sum(project_shares.values())
+            if total_basis_points > FULL_ALLOCATION_BP:
+                errors.append(
+                    f"Project {project_id} allocation exceeds 100% ({from_basis_points(total_basis_points)}%)"
+                )
+            projects.append(_scenario_project(project_id, project_names[project_id], project_totals[project_id],
+                                              project_shares, parts, customer_names))
+            for customer_id in parts.keys() | baseline_parts[project_id].keys():
+                deltas[customer_id] = (
+                    deltas.get(customer_id, 0) + parts.get(customer_id, 0) - baseline_parts[project_id].get(customer_id, 0)
+                )
+
+        results.append(ScenarioResult(
+            name=scenario.name,
+            is_valid=not errors and all(project.is_valid for project in projects),
+            errors=errors,
+            projects=projects,
+            customers=[
+                ScenarioCustomerResult(
+                    customer_id=customer_id,
+                    customer_name=customer_names[customer_id],
+                    baseline_cost=from_ore(baseline_costs[customer_id]),
+                    total_cost=from_ore(baseline_costs[customer_id] + delta),
+                    delta=from_ore(delta),
+                ) for customer_id, delta in sorted(deltas.items())
+            ],
+        ))
+
+    return ScenarioComparison(baseline=baseline, scenarios=results)
+
+
+# ============ Project Detail ============
+
+# API field -> model column for the sparse fieldsets of /projects/{id}/full
+PROJECT_DETAIL_FIELDS = {
+    "project": {
+        "id": Project.id, "name": Project.name, "description": Project.description,
+        "created_at": Project.created_at, "updated_at": Project.updated_at,
+    },
+    "expenses": {
+        "id": Expense.id, "project_id": Expense.project_id, "expense_type": Expense.expense_type_id,
+        "amount": Expense.amount_ore, "description": Expense.description,
+        "created_at": Expense.created_at, "updated_at": Expense.updated_at,
+    },
+    "customers": {
+        "id": ProjectCustomer.id, "project_id": ProjectCustomer.project_id,
+        "customer_id": ProjectCustomer.customer_id, "cost_percentage": ProjectCustomer.cost_basis_points,
+        "created_at": ProjectCustomer.created_at, "updated_at": ProjectCustomer.updated_at,
+        "customer_name": Customer.name,
+    },
+}
+# Only returned when asked for in fields=
+PROJECT_DETAIL_OPTIONAL_FIELDS = {"customers": {"customer_name"}}
+PROJECT_DETAIL_INCLUDES = ("expenses", "customers", "cost_overview")
+# Storage units -> API units
+_DETAIL_CONVERTERS = {"amount": from_ore, "cost_percentage": from_basis_points}
+
+
+def parse_project_detail_params(include: str = None, fields: str = None):
+    """
+    Parse include=expenses,customers,cost_overview and
+    fields=project.name,expenses.amount,... into (includes, {section: [field, ...]}).
+
+    Without include everything is returned; sections without a fields entry
+    return all their default fields. Row ids are always returned.
+    """
+    if include is None:
+        includes = set(PROJECT_DETAIL_INCLUDES)
+    else:
+        includes = {name.strip() for name in include.split(",") if name.strip()}
+        unknown = includes - set(PROJECT_DETAIL_INCLUDES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+
+    selected = {}
+    for item in (fields or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        section, _, name = item.partition(".")
+        if section not in PROJECT_DETAIL_FIELDS or name not in PROJECT_DETAIL_FIELDS[section]:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {item}")
+        selected.setdefault(section, ["id"])
+        if name not in selected[section]:
+            selected[section].append(name)
+
+    for section, columns in PROJECT_DETAIL_FIELDS.items():
+        if section not in selected:
+            optional = PROJECT_DETAIL_OPTIONAL_FIELDS.get(section, set())
+            selected[section] = [name for name in columns if name not in optional]
+    return includes, selected
+
+
+def _detail_rows(rows, names: list) -> list:
+    return [
+        {name: _DETAIL_CONVERTERS.get(name, lambda value: value)(value) for name, value in zip(names, row)}
+        for row in rows
+    ]
+
+
+def get_project_detail(db: Session, project_id: int, includes: set, fields: dict):
+    """
+    Project with the requested relations in a fixed number of queries.
+
+    Every section is one column-level SELECT of just the requested fields:
+    the project, its expenses, its customer shares (joined with the
+    customer when a name is needed) and, for the cost overview, one SUM.
+    The overview reuses the share rows instead of reloading the project.
+    Returns None if the project does not exist.
+    """
+    names = fields["project"]
+    # The cost overview needs the project name even when it was not requested
+    project_names = names + ["name"] if "cost_overview" in includes and "name" not in names else names
+    project = db.query(*[PROJECT_DETAIL_FIELDS["project"][name] for name in project_names]).filter(
+        Project.id == project_id
+    ).first()
+    if project is None:
+        return None
+    detail = {"project": _detail_rows([project[:len(names)]], names)[0]}
+
+    if "expenses" in includes:
+        names = fields["expenses"]
+        rows = db.query(*[PROJECT_DETAIL_FIELDS["expenses"][name] for name in names]).filter(
+            Expense.project_id == project_id
+        ).order_by(Expense.id).all()
+        detail["expenses"] = _detail_rows(rows, names)
+        if "expense_type" in names:
+            for expense in detail["expenses"]:
+                expense["expense_type"] = expense_type_cache.name_for(expense["expense_type"], db)
+
+    if "customers" in includes or "cost_overview" in includes:
+        names = fields["customers"] if "customers" in includes else ["id"]
+        query_names = list(names)
+        if "cost_overview" in includes:
+            query_names += [name for name in ("customer_id", "customer_name", "cost_percentage") if name not in names]
+        query = db.query(*[PROJECT_DETAIL_FIELDS["customers"][name] for name in query_names])
+        if "customer_name" in query_names:
+            query = query.join(Customer, Customer.id == ProjectCustomer.customer_id)
+        rows = query.filter(ProjectCustomer.project_id == project_id).order_by(ProjectCustomer.customer_id).all()
+
+        if "customers" in includes:
+            detail["customers"] = _detail_rows([row[:len(names)] for row in rows], names)
+        if "cost_overview" in includes:
+            positions = [query_names.index(name) for name in ("customer_id", "customer_name", "cost_percentage")]
+            shares = [tuple(row[i] for i in positions) for row in rows]
+            total_expenses = get_project_totals(db, [project_id])[project_id]
+            detail["cost_overview"] = _build_project_cost_overview(
+                project_id, project[project_names.index("name")], total_expenses, shares
+            )
+
+    return detail
@@ -1,11 +1,20 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+from fastapi import Request
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+import dialect
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/casedb")
+# Optional read replica for read-only routes; falls back to the primary when unset
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+# Seconds a replica health check result is trusted before probing again
+REPLICA_HEALTH_TTL = float(os.getenv("REPLICA_HEALTH_TTL", "5"))
 
 # Create engine with connection pooling
 engine = create_engine(
@@ -14,8 +23,55 @@ engine = create_engine(
     pool_recycle=3600,   # Recycle connections after 1 hour
 )
 
+dialect.enable_foreign_keys(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if DATABASE_READ_URL:
+    read_engine = create_engine(
+        DATABASE_READ_URL,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        connect_args={"connect_timeout": 2} if DATABASE_READ_URL.startswith("postgresql") else {},
+    )
+    dialect.enable_foreign_keys(read_engine)
+else:
+    read_engine = engine
+
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+
+class ReplicaHealth:
+    """Cached replica liveness so a dead replica costs one probe per TTL, not one per request"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._healthy = True
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_healthy(self) -> bool:
+        if time.monotonic() - self._checked_at < self.ttl:
+            return self._healthy
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.ttl:
+                self._healthy = self._probe()
+                self._checked_at = time.monotonic()
+        return self._healthy
+
+    @staticmethod
+    def _probe() -> bool:
+        try:
+            with read_engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            print(f"Warning: Read replica unavailable, routing reads to primary: {e}")
+            return False
+
+
+replica_health = ReplicaHealth(REPLICA_HEALTH_TTL)
+
 
 def get_db():
     """Dependency for getting database session"""
@@ -24,3 +80,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def wants_read_your_writes(request: Request) -> bool:
+    """True if the client asked to see its own writes (X-Read-Your-Writes: true)"""
+    return request.headers.get("x-read-your-writes", "").lower() in ("1", "true")
+
+
+def get_read_db(request: Request):
+    """
+    Dependency for read-only routes.
+
+    Uses the replica when configured and healthy. Send
+    `X-Read-Your-Writes: true` to read from the primary, e.g. right after a write.
+    """
+    use_primary = read_engine is engine or wants_read_your_writes(request) or not replica_health.is_healthy()
+    db = SessionLocal() if use_primary else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
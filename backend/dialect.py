@@ -0,0 +1,107 @@
+"""Database-specific operations behind one interface.
+
+PostgreSQL is the production database. SQLite (file or in-memory) runs the
+same API for local development and tests: advisory locks become in-process
+locks with the same transaction scope, and sequence resets are not needed
+because SQLite picks max(id) + 1 by itself.
+"""
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# Tables with an integer id sequence (PostgreSQL names them <table>_id_seq)
+SEQUENCE_TABLES = ("projects", "customers", "expenses", "project_customers")
+
+_local_locks = defaultdict(threading.Lock)
+_local_locks_guard = threading.Lock()
+
+
+def is_postgres(bind) -> bool:
+    """bind: engine, connection or session"""
+    if isinstance(bind, Session):
+        bind = bind.get_bind()
+    return bind.dialect.name == "postgresql"
+
+
+def enable_foreign_keys(engine):
+    """SQLite enforces foreign keys, and so ON DELETE CASCADE, only when asked per connection"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _foreign_keys_on(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+def insert(db: Session):
+    """Dialect insert() construct, for on_conflict_do_update upserts"""
+    return postgresql.insert if is_postgres(db) else sqlite.insert
+
+
+def begin_snapshot(db: Session):
+    """
+    Make the session's transaction read from one consistent snapshot.
+
+    PostgreSQL: a REPEATABLE READ, READ ONLY transaction; must be called
+    before the session's first query. A SQLite read transaction already
+    sees one snapshot.
+    """
+    if is_postgres(db) and not db.in_transaction():
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+
+
+def advisory_xact_lock(db: Session, key: int):
+    """
+    Serialize writers on key until the current transaction ends.
+
+    PostgreSQL: pg_advisory_xact_lock. Elsewhere: a process-local lock
+    released when the session's transaction commits or rolls back.
+    """
+    if is_postgres(db):
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": key})
+        return
+
+    held = db.info.setdefault("advisory_locks", {})
+    if key in held:  # re-entrant within one transaction, like the PostgreSQL lock
+        return
+    with _local_locks_guard:
+        lock = _local_locks[key]
+    lock.acquire()
+    held[key] = (lock, db.get_transaction() or db.begin())
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_local_locks(session, transaction):
+    held = session.info.get("advisory_locks")
+    if not held:
+        return
+    for key, (lock, locked_in) in list(held.items()):
+        if locked_in is transaction:
+            del held[key]
+            lock.release()
+
+
+def reset_sequences(db: Session, tables=SEQUENCE_TABLES):
+    """Move id sequences past existing rows after inserting explicit ids; no-op outside PostgreSQL"""
+    if not is_postgres(db):
+        return
+    for table in tables:
+        db.execute(text(f"SELECT setval('{table}_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM {table}))"))
+
+
+def expense_partitions(engine):
+    """
+    Number of partitions the expenses table has (0 for a plain table), or
+    None before it exists. Always 0 outside PostgreSQL.
+    """
+    with engine.connect() as connection:
+        if not is_postgres(connection):
+            return 0 if inspect(connection).has_table("expenses") else None
+        exists, partitions = connection.execute(text(
+            "SELECT to_regclass('expenses') IS NOT NULL, "
+            "(SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass('expenses'))"
+        )).one()
+        return partitions if exists else None
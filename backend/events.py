@@ -0,0 +1,160 @@
+"""Live change feed: Postgres LISTEN/NOTIFY fanned out to Server-Sent Events clients.
+
+Writes in crud.py build a delta with the updated totals and call
+publish_change() inside their transaction, so the notification is only
+delivered when the write commits. A single listener
+thread per worker holds one LISTEN connection and forwards each payload to
+the asyncio queues of the connected /events subscribers.
+
+Each event carries an id (worker instance and sequence number). A client
+that reconnects sends the last id it saw: the worker replays what it
+missed from a short in-memory log, or, when it cannot (another worker,
+or too long ago), sends a resync event telling the client to refetch.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import engine
+import dialect
+
+CHANGE_CHANNEL = os.getenv("CHANGE_CHANNEL", "case_changes")
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("CHANGE_QUEUE_SIZE", "256"))
+# Recent events kept per worker for clients that reconnect
+REPLAY_SIZE = int(os.getenv("CHANGE_REPLAY_SIZE", "1000"))
+MAX_PAYLOAD_BYTES = 7900
+
+RESYNC = json.dumps({"action": "resync"})
+
+
+# ============ Publishing ============
+
+def is_enabled(db: Session) -> bool:
+    """LISTEN/NOTIFY is PostgreSQL-only; other databases simply publish nothing"""
+    return dialect.is_postgres(db)
+
+
+def publish_change(db: Session, delta: dict):
+    """
+    Queue a compact change delta on the current transaction.
+
+    pg_notify is transactional, so subscribers only see the delta once the
+    write commits. Call after flush() and before commit().
+    """
+    if not is_enabled(db):
+        return
+
+    payload = json.dumps(delta, separators=(",", ":"))
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        # NOTIFY payloads are capped at 8000 bytes; let clients refetch instead
+        delta = {key: value for key, value in delta.items() if key not in ("customers", "project")}
+        delta["resync"] = True
+        payload = json.dumps(delta, separators=(",", ":"))
+
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANGE_CHANNEL, "payload": payload})
+
+
+# ============ Fan-out ============
+
+class ChangeListener:
+    """Holds one LISTEN connection per worker and fans notifications out to subscribers"""
+
+    def __init__(self, channel: str = CHANGE_CHANNEL, replay_size: int = REPLAY_SIZE):
+        self.channel = channel
+        self.instance = uuid.uuid4().hex[:12]
+        self._sequence = 0
+        self._recent = deque(maxlen=replay_size)  # (sequence, payload)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _event_id(self, sequence: int) -> str:
+        return f"{self.instance}-{sequence}"
+
+    def _missed(self, last_event_id: str) -> list:
+        """(event id, payload) after last_event_id, or a single resync if they are not all here"""
+        instance, _, sequence = last_event_id.rpartition("-")
+        resync = [(self._event_id(self._sequence), RESYNC)]
+        if instance != self.instance or not sequence.isdigit() or int(sequence) > self._sequence:
+            return resync
+        sequence = int(sequence)
+        if sequence < self._sequence and (not self._recent or self._recent[0][0] > sequence + 1):
+            return resync
+        missed = [(self._event_id(n), payload) for n, payload in self._recent if n > sequence]
+        return missed if len(missed) < SUBSCRIBER_QUEUE_SIZE else resync
+
+    def subscribe(self, last_event_id: str = None) -> asyncio.Queue:
+        """
+        Queue of (event id, payload) for one client. With the id of the last
+        event a reconnecting client saw, the queue starts with what it missed.
+        """
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            # Under the lock, so no event falls between the replay and the subscription
+            for item in self._missed(last_event_id) if last_event_id else []:
+                queue.put_nowait(item)
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="change-listener", daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers = {(loop, q) for loop, q in self._subscribers if q is not queue}
+
+    def _dispatch(self, payload: str):
+        with self._lock:
+            self._sequence += 1
+            self._recent.append((self._sequence, payload))
+            item = (self._event_id(self._sequence), payload)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, item)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, item: tuple):
+        # A slow client gets told to resync instead of blocking everyone else
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            item = (item[0], RESYNC)
+        queue.put_nowait(item)
+
+    def _run(self):
+        import psycopg2
+
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                conn = psycopg2.connect(engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                try:
+                    while self._subscribers:
+                        if select.select([conn], [], [], 5.0) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self._dispatch(conn.notifies.pop(0).payload)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Warning: Change listener lost its connection: {e}")
+                self._dispatch(RESYNC)
+                time.sleep(2)
+
+
+listener = ChangeListener()
@@ -0,0 +1,106 @@
+"""
+Expense type dictionary.
+
+Expense rows store a SMALLINT expense_type_id; each name is stored once in
+expense_types. The API and the CSV importers keep speaking names, and this
+module maps between the two through a process-wide cache. The cache is
+loaded from the table on first use and reloaded on a miss, e.g. for a type
+another worker created.
+
+Unknown names are inserted on first use, in the caller's transaction. The
+cache only learns about them once that transaction commits, so a
+rolled-back insert never leaves a dangling id behind.
+"""
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import dialect
+from models import ExpenseType
+
+PENDING_KEY = "pending_expense_types"
+
+
+class ExpenseTypeCache:
+    """name <-> id for expense types"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}    # name -> id
+        self._names = {}  # id -> name
+
+    def load(self, db: Session):
+        rows = db.query(ExpenseType.id, ExpenseType.name).all()
+        with self._lock:
+            self._ids = {name: type_id for type_id, name in rows}
+            self._names = {type_id: name for type_id, name in rows}
+
+    def clear(self):
+        with self._lock:
+            self._ids, self._names = {}, {}
+
+    @staticmethod
+    def _pending(db: Session) -> dict:
+        return db.info.setdefault(PENDING_KEY, {})
+
+    def ids_for(self, db: Session, names) -> dict:
+        """{name: id} for names, inserting the ones that do not exist yet"""
+        pending = self._pending(db)
+        ids = {name: self._ids.get(name) or pending.get(name) for name in set(names)}
+        missing = [name for name, type_id in ids.items() if type_id is None]
+        if missing:
+            self.load(db)
+            missing = [name for name in missing if name not in self._ids]
+            ids.update({name: self._ids[name] for name in ids if name in self._ids})
+        if missing:
+            insert = dialect.insert(db)
+            db.execute(
+                insert(ExpenseType).values([{"name": name} for name in sorted(missing)])
+                .on_conflict_do_nothing(index_elements=[ExpenseType.name])
+            )
+            created = dict(db.query(ExpenseType.name, ExpenseType.id).filter(ExpenseType.name.in_(missing)).all())
+            pending.update(created)
+            ids.update(created)
+        return ids
+
+    def lookup(self, db: Session, name: str):
+        """Id of an existing expense type, or None; never inserts"""
+        type_id = self._ids.get(name) or self._pending(db).get(name)
+        if type_id is None:
+            self.load(db)
+            type_id = self._ids.get(name)
+        return type_id
+
+    def id_for(self, db: Session, name: str) -> int:
+        return self.ids_for(db, [name])[name]
+
+    def name_for(self, type_id: int, db: Session = None) -> str:
+        """Name of an expense type id; reloads from db on a miss"""
+        name = self._names.get(type_id)
+        if name is None and db is not None:
+            name = next((n for n, i in self._pending(db).items() if i == type_id), None)
+            if name is None:
+                self.load(db)
+                name = self._names.get(type_id)
+        return name
+
+    def _publish(self, created: dict):
+        with self._lock:
+            self._ids = {**self._ids, **created}
+            self._names = {**self._names, **{type_id: name for name, type_id in created.items()}}
+
+
+expense_type_cache = ExpenseTypeCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_created_types(session):
+    created = session.info.pop(PENDING_KEY, None)
+    if created:
+        expense_type_cache._publish(created)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_created_types(session):
+    session.info.pop(PENDING_KEY, None)
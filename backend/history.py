@@ -0,0 +1,283 @@
+"""
+Append-only history of allocation and expense changes, with point-in-time reads.
+
+Every ORM flush that inserts, changes or deletes a ProjectCustomer share or
+an expense amount appends rows to allocation_history / expense_history in
+the same transaction. Core statements that bypass the ORM (the import
+upsert) call record_expense_changes themselves.
+
+Snapshots compact history into the full allocation table and one expense
+total per project, as of covers_until. The state at any as_of is the
+latest snapshot with covers_until <= as_of plus the history rows in
+(covers_until, as_of]. Snapshots are taken every HISTORY_SNAPSHOT_INTERVAL
+seconds and cover history up to HISTORY_SNAPSHOT_LAG seconds ago, so
+transactions still in flight are not missed.
+
+One process takes them, not the API workers: the docker-compose history
+service, or cron.
+
+Usage:
+    python history.py           take a snapshot if the latest is old enough
+    python history.py --loop    and again every HISTORY_SNAPSHOT_INTERVAL seconds
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from sqlalchemy import event, func, insert, inspect, literal, null, or_, select
+from sqlalchemy.orm import Session
+
+import dialect
+from models import (
+    AllocationHistory, Expense, ExpenseHistory, HistorySnapshot, ProjectCustomer,
+    SnapshotAllocation, SnapshotExpenseTotal,
+)
+
+HISTORY_SNAPSHOT_INTERVAL = float(os.getenv("HISTORY_SNAPSHOT_INTERVAL", "3600"))
+HISTORY_SNAPSHOT_LAG = float(os.getenv("HISTORY_SNAPSHOT_LAG", "300"))
+SNAPSHOT_LOCK_KEY = 727_002  # advisory lock key: one snapshot writer at a time
+
+
+def normalize_as_of(as_of: datetime) -> datetime:
+    """Timestamps are stored as naive UTC"""
+    if as_of.tzinfo is not None:
+        return as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    return as_of
+
+
+# ============ Recording ============
+
+def record_expense_changes(db: Session, changes: list):
+    """Append (expense_id, project_id, new amount or None, delta) rows"""
+    if not changes:
+        return
+    now = datetime.utcnow()
+    db.connection().execute(insert(ExpenseHistory.__table__), [
+        {"expense_id": expense_id, "project_id": project_id, "amount_ore": amount_ore,
+         "amount_delta_ore": delta, "changed_at": now}
+        for expense_id, project_id, amount_ore, delta in changes
+    ])
+
+
+def record_cascaded_deletes(db: Session, project_ids=(), customer_ids=()) -> tuple:
+    """
+    History rows for the expenses and shares ON DELETE CASCADE is about to remove.
+
+    Deleting projects removes their expenses and shares; deleting customers
+    removes their shares. Written with INSERT ... SELECT, so the children are
+    never loaded; returns the (expense, share) row counts.
+    """
+    now = datetime.utcnow()
+    expenses = allocations = 0
+    if project_ids:
+        expenses = db.execute(insert(ExpenseHistory.__table__).from_select(
+            ["expense_id", "project_id", "amount_ore", "amount_delta_ore", "changed_at"],
+            select(Expense.id, Expense.project_id, null(), -Expense.amount_ore, literal(now))
+            .where(Expense.project_id.in_(project_ids)),
+        )).rowcount
+    if project_ids or customer_ids:
+        allocations = db.execute(insert(AllocationHistory.__table__).from_select(
+            ["project_id", "customer_id", "cost_basis_points", "changed_at"],
+            select(ProjectCustomer.project_id, ProjectCustomer.customer_id, null(), literal(now)).where(or_(
+                ProjectCustomer.project_id.in_(project_ids or []),
+                ProjectCustomer.customer_id.in_(customer_ids or []),
+            )),
+        )).rowcount
+    return expenses, allocations
+
+
+def _previous(obj, attribute: str):
+    changes = inspect(obj).attrs[attribute].history
+    return changes.deleted[0] if changes.deleted else getattr(obj, attribute)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session, flush_context):
+    allocations, expenses = [], []
+
+    for obj in session.new:
+        if isinstance(obj, ProjectCustomer):
+            allocations.append((obj.project_id, obj.customer_id, obj.cost_basis_points))
+        elif isinstance(obj, Expense):
+            expenses.append((obj.id, obj.project_id, obj.amount_ore, obj.amount_ore))
+
+    for obj in session.dirty:
+        if isinstance(obj, ProjectCustomer):
+            if inspect(obj).attrs.cost_basis_points.history.has_changes():
+                allocations.append((obj.project_id, obj.customer_id, obj.cost_basis_points))
+        elif isinstance(obj, Expense):
+            if inspect(obj).attrs.amount_ore.history.has_changes():
+                delta = obj.amount_ore - _previous(obj, "amount_ore")
+                expenses.append((obj.id, obj.project_id, obj.amount_ore, delta))
+
+    for obj in session.deleted:
+        if isinstance(obj, ProjectCustomer):
+            allocations.append((_previous(obj, "project_id"), _previous(obj, "customer_id"), None))
+        elif isinstance(obj, Expense):
+            expenses.append((obj.id, _previous(obj, "project_id"), None, -_previous(obj, "amount_ore")))
+
+    if allocations:
+        now = datetime.utcnow()
+        session.connection().execute(insert(AllocationHistory.__table__), [
+            {"project_id": project_id, "customer_id": customer_id, "cost_basis_points": basis_points,
+             "changed_at": now}
+            for project_id, customer_id, basis_points in allocations
+        ])
+    record_expense_changes(session, expenses)
+
+
+# ============ Point-in-time reads ============
+
+def snapshot_for(db: Session, as_of: datetime) -> HistorySnapshot:
+    """Latest snapshot at or before as_of; 400 if history does not reach back that far"""
+    snapshot = db.query(HistorySnapshot).filter(
+        HistorySnapshot.covers_until <= as_of
+    ).order_by(HistorySnapshot.covers_until.desc()).first()
+    if snapshot is None:
+        earliest = db.query(func.min(HistorySnapshot.covers_until)).scalar()
+        detail = f"History starts at {earliest.isoformat()}" if earliest else "No history has been recorded yet"
+        raise HTTPException(status_code=400, detail=f"as_of is before the recorded history. {detail}")
+    return snapshot
+
+
+def allocations_as_of(db: Session, snapshot: HistorySnapshot, as_of: datetime,
+                      project_ids=None, customer_ids=None) -> dict:
+    """{project_id: {customer_id: basis_points}} at as_of, filtered by project or customer"""
+    def scoped(query, model):
+        if project_ids is not None:
+            query = query.filter(model.project_id.in_(project_ids))
+        if customer_ids is not None:
+            query = query.filter(model.customer_id.in_(customer_ids))
+        return query
+
+    shares = {}
+    for project_id, customer_id, basis_points in scoped(db.query(
+        SnapshotAllocation.project_id, SnapshotAllocation.customer_id, SnapshotAllocation.cost_basis_points
+    ).filter(SnapshotAllocation.snapshot_id == snapshot.id), SnapshotAllocation):
+        shares.setdefault(project_id, {})[customer_id] = basis_points
+
+    for project_id, customer_id, basis_points in scoped(db.query(
+        AllocationHistory.project_id, AllocationHistory.customer_id, AllocationHistory.cost_basis_points
+    ).filter(
+        AllocationHistory.changed_at > snapshot.covers_until,
+        AllocationHistory.changed_at <= as_of,
+    ), AllocationHistory).order_by(AllocationHistory.changed_at, AllocationHistory.id):
+        if basis_points is None:
+            shares.get(project_id, {}).pop(customer_id, None)
+        else:
+            shares.setdefault(project_id, {})[customer_id] = basis_points
+
+    return {project_id: project_shares for project_id, project_shares in shares.items() if project_shares}
+
+
+def project_totals_as_of(db: Session, snapshot: HistorySnapshot, as_of: datetime, project_ids) -> dict:
+    """Total expenses in øre per project at as_of"""
+    totals = {project_id: 0 for project_id in project_ids}
+    if not project_ids:
+        return totals
+    for project_id, total in db.query(SnapshotExpenseTotal.project_id, SnapshotExpenseTotal.total_ore).filter(
+        SnapshotExpenseTotal.snapshot_id == snapshot.id,
+        SnapshotExpenseTotal.project_id.in_(project_ids),
+    ):
+        totals[project_id] += int(total)
+    for project_id, delta in db.query(ExpenseHistory.project_id, func.sum(ExpenseHistory.amount_delta_ore)).filter(
+        ExpenseHistory.project_id.in_(project_ids),
+        ExpenseHistory.changed_at > snapshot.covers_until,
+        ExpenseHistory.changed_at <= as_of,
+    ).group_by(ExpenseHistory.project_id):
+        totals[project_id] += int(delta or 0)
+    return totals
+
+
+# ============ Snapshots ============
+
+def take_snapshot(db: Session, now: datetime = None):
+    """
+    Compact history into a new snapshot; returns it, or None if the latest is recent enough.
+
+    The first snapshot is a baseline copied from the live tables as of now.
+    Later ones fold the previous snapshot with the history rows up to
+    now - HISTORY_SNAPSHOT_LAG.
+    """
+    now = now or datetime.utcnow()
+    dialect.advisory_xact_lock(db, SNAPSHOT_LOCK_KEY)
+    previous = db.query(HistorySnapshot).order_by(HistorySnapshot.covers_until.desc()).first()
+
+    if previous is None:
+        covers_until = now
+        shares = {}
+        for project_id, customer_id, basis_points in db.query(
+            ProjectCustomer.project_id, ProjectCustomer.customer_id, ProjectCustomer.cost_basis_points
+        ):
+            shares.setdefault(project_id, {})[customer_id] = basis_points
+        totals = {
+            project_id: int(total or 0) for project_id, total in db.query(
+                Expense.project_id, func.sum(Expense.amount_ore)
+            ).group_by(Expense.project_id)
+        }
+    else:
+        covers_until = now - timedelta(seconds=HISTORY_SNAPSHOT_LAG)
+        if covers_until <= previous.covers_until:
+            db.commit()
+            return None
+        shares = allocations_as_of(db, previous, covers_until)
+        totals = {
+            project_id: int(total) for project_id, total in db.query(
+                SnapshotExpenseTotal.project_id, SnapshotExpenseTotal.total_ore
+            ).filter(SnapshotExpenseTotal.snapshot_id == previous.id)
+        }
+        for project_id, delta in db.query(ExpenseHistory.project_id, func.sum(ExpenseHistory.amount_delta_ore)).filter(
+            ExpenseHistory.changed_at > previous.covers_until,
+            ExpenseHistory.changed_at <= covers_until,
+        ).group_by(ExpenseHistory.project_id):
+            totals[project_id] = totals.get(project_id, 0) + int(delta or 0)
+
+    snapshot = HistorySnapshot(covers_until=covers_until)
+    db.add(snapshot)
+    db.flush()
+    allocation_rows = [
+        {"snapshot_id": snapshot.id, "project_id": project_id, "customer_id": customer_id,
+         "cost_basis_points": basis_points}
+        for project_id, project_shares in shares.items() for customer_id, basis_points in project_shares.items()
+    ]
+    if allocation_rows:
+        db.execute(insert(SnapshotAllocation), allocation_rows)
+    total_rows = [
+        {"snapshot_id": snapshot.id, "project_id": project_id, "total_ore": total}
+        for project_id, total in totals.items() if total
+    ]
+    if total_rows:
+        db.execute(insert(SnapshotExpenseTotal), total_rows)
+    db.commit()
+    return snapshot
+
+
+def run_snapshots(session_factory, interval: float = HISTORY_SNAPSHOT_INTERVAL, once: bool = False):
+    """Take a snapshot now and, unless once, every interval seconds after"""
+    while True:
+        db = session_factory()
+        try:
+            snapshot = take_snapshot(db)
+            if snapshot is not None:
+                print(f"History snapshot {snapshot.id} covers changes until {snapshot.covers_until.isoformat()}")
+            elif once:
+                print("Latest history snapshot is recent enough")
+        except Exception as e:
+            db.rollback()
+            print(f"Warning: Could not take history snapshot: {e}")
+            if once:
+                raise
+        finally:
+            db.close()
+        if once:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import SessionLocal
+
+    run_snapshots(SessionLocal, once="--loop" not in sys.argv[1:])
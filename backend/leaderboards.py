@@ -0,0 +1,193 @@
+"""
+Maintained aggregates behind the top-N cost leaderboards.
+
+project_totals, project_type_totals, customer_project_costs and
+customer_totals hold the expense totals and allocated costs that the cost
+overviews compute on the fly. Each has a ranking index, so "top K" is an
+index scan of K rows however many expenses there are.
+
+The aggregates change in the same transaction as the data: ORM flushes
+mark the projects whose expenses or shares changed, Core writes (the
+import upsert) call mark_projects themselves, and just before commit the
+marked projects are recomputed from the live rows under their allocation
+lock. Customer totals move by the difference, so transactions touching
+different projects of one customer do not overwrite each other. The
+differences summed over the transaction are kept for pop_changes, which
+the change feed uses to move the dashboard totals.
+
+Usage (after loading data with raw SQL): python leaderboards.py
+"""
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+
+import dialect
+from models import (
+    CustomerProjectCost, CustomerTotal, Expense, Project, ProjectCustomer, ProjectTotal, ProjectTypeTotal,
+)
+from money import allocate
+
+PENDING_KEY = "leaderboard_projects"
+CHANGES_KEY = "leaderboard_changes"
+REFRESH_BATCH_SIZE = 500  # projects per aggregate query
+
+
+def mark_projects(db: Session, project_ids):
+    """Recompute these projects' aggregates when the transaction commits"""
+    db.info.setdefault(PENDING_KEY, set()).update(project_ids)
+
+
+def _previous(obj, attribute: str):
+    changes = inspect(obj).attrs[attribute].history
+    return changes.deleted[0] if changes.deleted else getattr(obj, attribute)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_flush(session, flush_context):
+    project_ids = set()
+    for obj in session.new:
+        if isinstance(obj, (Expense, ProjectCustomer)):
+            project_ids.add(obj.project_id)
+    for obj in session.dirty:
+        if isinstance(obj, Expense):
+            if any(inspect(obj).attrs[name].history.has_changes()
+                   for name in ("amount_ore", "expense_type_id", "project_id")):
+                project_ids.update({obj.project_id, _previous(obj, "project_id")})
+        elif isinstance(obj, ProjectCustomer):
+            if inspect(obj).attrs.cost_basis_points.history.has_changes():
+                project_ids.add(obj.project_id)
+    for obj in session.deleted:
+        if isinstance(obj, (Expense, ProjectCustomer)):
+            project_ids.add(_previous(obj, "project_id"))
+        elif isinstance(obj, Project):
+            project_ids.add(obj.id)
+    if project_ids:
+        mark_projects(session, project_ids)
+
+
+@event.listens_for(Session, "before_commit")
+def refresh_marked(session):
+    """Recompute the marked projects now; runs at commit, or earlier for readers of the aggregates"""
+    if not session.info.get(PENDING_KEY):
+        return
+    session.flush()
+    refresh_projects(session, session.info.pop(PENDING_KEY))
+
+
+def pop_changes(session) -> dict:
+    """How much the expense total and the allocated total moved in this transaction, in øre"""
+    return session.info.pop(CHANGES_KEY, None) or {"expenses": 0, "allocated": 0}
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_marked(session):
+    session.info.pop(PENDING_KEY, None)
+    session.info.pop(CHANGES_KEY, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_changes(session):
+    session.info.pop(CHANGES_KEY, None)
+
+
+def refresh_projects(db: Session, project_ids, lock: bool = True):
+    """Recompute the aggregates of project_ids from expenses and project_customers"""
+    project_ids = sorted(project_ids)
+    if lock:
+        # Same per-project lock as allocation writes, taken in id order
+        for project_id in project_ids:
+            dialect.advisory_xact_lock(db, project_id)
+    for start in range(0, len(project_ids), REFRESH_BATCH_SIZE):
+        _refresh_batch(db, project_ids[start:start + REFRESH_BATCH_SIZE])
+
+
+def _refresh_batch(db: Session, project_ids: list):
+    type_totals = db.execute(
+        select(Expense.project_id, Expense.expense_type_id, func.sum(Expense.amount_ore))
+        .where(Expense.project_id.in_(project_ids))
+        .group_by(Expense.project_id, Expense.expense_type_id)
+    ).all()
+    project_totals = {}
+    for project_id, _, total in type_totals:
+        project_totals[project_id] = project_totals.get(project_id, 0) + int(total)
+
+    shares = {}
+    for project_id, customer_id, basis_points in db.execute(
+        select(ProjectCustomer.project_id, ProjectCustomer.customer_id, ProjectCustomer.cost_basis_points)
+        .where(ProjectCustomer.project_id.in_(project_ids))
+        .order_by(ProjectCustomer.project_id, ProjectCustomer.customer_id)
+    ):
+        shares.setdefault(project_id, []).append((customer_id, basis_points))
+    costs = []
+    for project_id, project_shares in shares.items():
+        parts = allocate(project_totals.get(project_id, 0), [bp for _, bp in project_shares])
+        costs.extend((project_id, customer_id, part) for (customer_id, _), part in zip(project_shares, parts))
+
+    previous_total = db.scalar(
+        select(func.coalesce(func.sum(ProjectTotal.total_ore), 0)).where(ProjectTotal.project_id.in_(project_ids))
+    )
+    deltas = {}
+    for customer_id, allocated in db.execute(
+        select(CustomerProjectCost.customer_id, CustomerProjectCost.allocated_ore)
+        .where(CustomerProjectCost.project_id.in_(project_ids))
+    ):
+        deltas[customer_id] = deltas.get(customer_id, 0) - int(allocated)
+    for _, customer_id, allocated in costs:
+        deltas[customer_id] = deltas.get(customer_id, 0) + allocated
+
+    for table in (ProjectTotal.__table__, ProjectTypeTotal.__table__, CustomerProjectCost.__table__):
+        db.execute(delete(table).where(table.c.project_id.in_(project_ids)))
+    rows = [
+        {"project_id": project_id, "total_ore": total} for project_id, total in project_totals.items() if total
+    ]
+    if rows:
+        db.execute(insert(ProjectTotal.__table__), rows)
+    rows = [
+        {"project_id": project_id, "expense_type_id": type_id, "total_ore": int(total)}
+        for project_id, type_id, total in type_totals if total
+    ]
+    if rows:
+        db.execute(insert(ProjectTypeTotal.__table__), rows)
+    rows = [
+        {"project_id": project_id, "customer_id": customer_id, "allocated_ore": allocated}
+        for project_id, customer_id, allocated in costs
+    ]
+    if rows:
+        db.execute(insert(CustomerProjectCost.__table__), rows)
+
+    changes = db.info.setdefault(CHANGES_KEY, {"expenses": 0, "allocated": 0})
+    changes["expenses"] += sum(project_totals.values()) - int(previous_total)
+    changes["allocated"] += sum(deltas.values())
+
+    changed = sorted(customer_id for customer_id, delta in deltas.items() if delta)
+    if changed:
+        stmt = dialect.insert(db)(CustomerTotal.__table__).values([
+            {"customer_id": customer_id, "allocated_ore": deltas[customer_id]} for customer_id in changed
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[CustomerTotal.customer_id],
+            set_={"allocated_ore": CustomerTotal.__table__.c.allocated_ore + stmt.excluded.allocated_ore},
+        ))
+        db.execute(delete(CustomerTotal.__table__).where(
+            CustomerTotal.customer_id.in_(changed), CustomerTotal.allocated_ore == 0
+        ))
+
+
+def rebuild(db: Session):
+    """Recompute every aggregate from scratch and commit; for data loaded outside the API"""
+    for model in (CustomerTotal, CustomerProjectCost, ProjectTypeTotal, ProjectTotal):
+        db.execute(delete(model.__table__))
+    project_ids = {project_id for (project_id,) in db.execute(select(Expense.project_id).distinct())}
+    project_ids.update(project_id for (project_id,) in db.execute(select(ProjectCustomer.project_id).distinct()))
+    refresh_projects(db, project_ids, lock=False)
+    db.commit()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        rebuild(session)
+        print("Rebuilt leaderboard aggregates")
+    finally:
+        session.close()
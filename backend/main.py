@@ -1,25 +1,40 @@
-from fastapi import FastAPI, UploadFile, File, Depends
+from fastapi import FastAPI, UploadFile, File, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import csv
 import io
+from collections import Counter
+import threading
+from pydantic import ValidationError
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 import os
 from dotenv import load_dotenv
 
 # Import our modules
-from models import Base
-from models import Project
-from database import engine, get_db
+from models import EXPENSE_PARTITIONS, PARTITION_EXPENSES, Project
+from database import SessionLocal, engine, get_db
 from routes import router
-from schemas import ExpenseCreate
+from admission import AdmissionMiddleware
+from negotiation import CompressionMiddleware, MsgPackNegotiationMiddleware
+from profiling import ProfilingMiddleware
+from schemas import ExpenseImportRow
 import crud
+import dialect
+import read_model
 from seed import init_db
 
 load_dotenv()
 
-# Initialize database and seed with data
-if os.getenv("INIT_DB_ON_START", "true").lower() == "true":
-    init_db()
+# Importing the app does no I/O: seeding happens after startup, once per deployment
+INIT_DB_ON_START = os.getenv("INIT_DB_ON_START", "true").lower() == "true"
+# When Alembic owns the schema (migrate service), workers never run create_all
+SCHEMA_FROM_ALEMBIC = os.getenv("SCHEMA_FROM_ALEMBIC", "false").lower() == "true"
+
+# Streaming ingest: rows per committed batch and the longest accepted line
+NDJSON_BATCH_SIZE = int(os.getenv("NDJSON_BATCH_SIZE", "500"))
+NDJSON_MAX_LINE_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 100
 
 app = FastAPI(
     title="Case API",
@@ -36,10 +51,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated gzip/br/zstd for large responses and opt-in MessagePack bodies
+app.add_middleware(MsgPackNegotiationMiddleware)
+app.add_middleware(CompressionMiddleware)
+
+# A profiled request includes validation, encoding and compression
+app.add_middleware(ProfilingMiddleware)
+
+# Outermost, so a request turned away by its saturated lane costs nothing else
+app.add_middleware(AdmissionMiddleware)
+
 # Include routes
 app.include_router(router)
 
 
+@app.on_event("startup")
+def check_expense_partitions():
+    """Refuse to start when the expenses mapping (EXPENSE_PARTITIONS) does not match the migrated table"""
+    expected = EXPENSE_PARTITIONS if PARTITION_EXPENSES else 0
+    try:
+        found = dialect.expense_partitions(engine)
+    except OperationalError as e:
+        print(f"Warning: Could not check expense partitions: {e}")
+        return
+    # None: no table yet, create_all or the migrations will build it as mapped
+    if found is not None and found != expected:
+        raise RuntimeError(
+            f"expenses has {found} partitions but EXPENSE_PARTITIONS={EXPENSE_PARTITIONS}; "
+            f"set EXPENSE_PARTITIONS={found} to match the schema"
+        )
+
+
+@app.on_event("startup")
+def start_background_seed():
+    """Seed in the background so workers pass readiness checks immediately"""
+    if INIT_DB_ON_START:
+        threading.Thread(
+            target=init_db,
+            kwargs={"create_schema": not SCHEMA_FROM_ALEMBIC},
+            name="seed",
+            daemon=True,
+        ).start()
+
+
+@app.on_event("startup")
+def start_read_model():
+    """Warm the in-memory cost graph and keep polling change_log for updates"""
+    if read_model.READ_MODEL_ENABLED:
+        threading.Thread(
+            target=read_model.run_refresh,
+            args=(SessionLocal,),
+            name="read-model",
+            daemon=True,
+        ).start()
+
+
 @app.get("/", tags=["Health"])
 def read_root():
     return {
@@ -54,6 +120,29 @@ def health_check():
     return {"status": "healthy"}
 
 
+def ensure_projects(db: Session, project_ids, source: str) -> int:
+    """Auto-create referenced projects that do not exist yet; returns how many were created"""
+    existing_project_ids = {
+        pid for (pid,) in db.query(Project.id).filter(Project.id.in_(project_ids)).all()
+    }
+    missing_project_ids = sorted(set(project_ids) - existing_project_ids)
+
+    if missing_project_ids:
+        db.add_all([
+            Project(
+                id=project_id,
+                name=f"Project {project_id}",
+                description=f"Auto-created from {source} (ProjectID {project_id})",
+            )
+            for project_id in missing_project_ids
+        ])
+        db.flush()
+        # Explicit ids leave the sequence behind: move it on before POST /projects collides
+        dialect.reset_sequences(db, ["projects"])
+        db.commit()
+    return len(missing_project_ids)
+
+
 @app.post("/import/expenses-csv", tags=["Import"])
 async def import_expenses_from_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
     """
@@ -61,7 +150,9 @@ async def import_expenses_from_csv(file: UploadFile = File(...), db: Session = D
     
     CSV format should include columns: ID, ProjectID, ExpenseType, Amount, Description
     
-    The ID column is ignored (auto-generated), and the rest are mapped to expense fields.
+    The ID column is the row's key in the source export: re-uploading the same
+    export only writes rows that are new or changed. Without an ID the row is
+    keyed by its content.
     """
     if not file.filename.endswith('.csv'):
         return {"error": "File must be a CSV"}
@@ -76,7 +167,8 @@ async def import_expenses_from_csv(file: UploadFile = File(...), db: Session = D
     
     for row_num, row in enumerate(reader, start=2):  # Start at 2 because header is row 1
         try:
-            expense = ExpenseCreate(
+            expense = ExpenseImportRow(
+                source_key=row.get('ID'),
                 project_id=int(row['ProjectID']),
                 expense_type=row['ExpenseType'],
                 amount=float(row['Amount']),
@@ -95,37 +187,122 @@ async def import_expenses_from_csv(file: UploadFile = File(...), db: Session = D
         }
     
     try:
-        # Ensure referenced projects exist before inserting expenses
-        existing_project_ids = {
-            pid for (pid,) in db.query(Project.id).filter(Project.id.in_(project_ids)).all()
-        }
-        missing_project_ids = sorted(project_ids - existing_project_ids)
-
-        if missing_project_ids:
-            db.add_all([
-                Project(
-                    id=project_id,
-                    name=f"Project {project_id}",
-                    description=f"Auto-created from CSV import (ProjectID {project_id})",
-                )
-                for project_id in missing_project_ids
-            ])
-            db.commit()
-
-        created = crud.bulk_create_expenses(db, expenses)
+        created_projects = ensure_projects(db, project_ids, source="CSV import")
+        summary = crud.import_expenses(db, expenses)
         return {
             "status": "success",
-            "imported": len(created),
-            "created_projects": len(missing_project_ids),
-            "message": f"Successfully imported {len(created)} expenses"
+            "imported": summary["new"] + summary["changed"],
+            **summary,
+            "created_projects": created_projects,
+            "message": (
+                f"Imported {summary['new']} new and {summary['changed']} changed expenses "
+                f"({summary['unchanged']} unchanged)"
+            )
         }
     except Exception as e:
+        db.rollback()
         return {
             "status": "error",
             "message": str(e)
         }
 
 
+class LineTooLong(Exception):
+    """An NDJSON line exceeded NDJSON_MAX_LINE_BYTES"""
+
+
+async def _ndjson_lines(request: Request):
+    """Yield the body's lines as they arrive, holding at most one partial line"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > NDJSON_MAX_LINE_BYTES:
+                raise LineTooLong(f"line longer than {NDJSON_MAX_LINE_BYTES} bytes")
+            yield line
+        if len(buffer) > NDJSON_MAX_LINE_BYTES:
+            raise LineTooLong(f"line longer than {NDJSON_MAX_LINE_BYTES} bytes")
+    if buffer:
+        yield buffer
+
+
+def _import_ndjson_batch(db: Session, batch: list, occurrences: Counter):
+    created_projects = ensure_projects(db, {expense.project_id for expense in batch}, source="NDJSON import")
+    return created_projects, crud.import_expenses(db, batch, occurrences)
+
+
+@app.post("/import/expenses-ndjson", tags=["Import"])
+async def import_expenses_from_ndjson(request: Request, db: Session = Depends(get_db)):
+    """
+    Stream expenses as newline-delimited JSON, one expense per line:
+
+    {"project_id": 1, "expense_type": "Kontorkostnader", "amount": 1250.5, "description": "...", "source_key": "A-17"}
+
+    Lines are validated and written in batches of NDJSON_BATCH_SIZE while the
+    body is still arriving. The next chunk is only read once the current
+    batch is committed, so memory stays constant and a faster sender is held
+    back by TCP flow control. Rows are keyed like the CSV import, so resending
+    after a dropped connection is safe. Invalid lines are skipped and reported.
+    An oversized line stops the import: the lines before it are still written,
+    and the result has status "aborted" with the counts committed so far.
+    """
+    summary = {"new": 0, "changed": 0, "unchanged": 0}
+    received = rejected = batches = created_projects = 0
+    errors = []
+    batch = []
+    occurrences = Counter()  # keyless rows are numbered across the whole stream, not per batch
+
+    async def write_batch():
+        nonlocal batches, created_projects
+        created, result = await run_in_threadpool(_import_ndjson_batch, db, batch, occurrences)
+        created_projects += created
+        for key, count in result.items():
+            summary[key] += count
+        batches += 1
+        batch.clear()
+
+    line_num = 0
+    aborted = False
+    try:
+        async for line in _ndjson_lines(request):
+            line_num += 1
+            if not line.strip():
+                continue
+            received += 1
+            try:
+                batch.append(ExpenseImportRow.model_validate_json(line))
+            except ValidationError as e:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    problems = "; ".join(
+                        f"{'.'.join(str(part) for part in error['loc']) or 'line'}: {error['msg']}"
+                        for error in e.errors()
+                    )
+                    errors.append(f"Line {line_num}: {problems}")
+                continue
+            if len(batch) >= NDJSON_BATCH_SIZE:
+                await write_batch()
+    except LineTooLong as e:
+        # Earlier batches are already committed: report them rather than fail the whole request
+        aborted = True
+        errors.append(f"Line {line_num + 1}: {e}; import stopped, resend from this line")
+
+    if batch:
+        await write_batch()
+
+    return {
+        "status": "aborted" if aborted else "partial_import" if rejected else "success",
+        "received": received,
+        "imported": summary["new"] + summary["changed"],
+        **summary,
+        "rejected": rejected,
+        "batches": batches,
+        "created_projects": created_projects,
+        "errors": errors,
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,10 +1,24 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, CheckConstraint
+from sqlalchemy import (
+    Column, Integer, BigInteger, SmallInteger, String, ForeignKey, DateTime, Text, CheckConstraint,
+    UniqueConstraint, Index, DDL, event,
+)
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import os
 
 Base = declarative_base()
 
+# Hash partitions for expenses on project_id, 0 for a plain table. A deployment setting:
+# 0002_partition_expenses creates this many, and the API refuses to start when the
+# migrated table has a different number (main.check_expense_partitions).
+EXPENSE_PARTITIONS = int(os.getenv("EXPENSE_PARTITIONS", "8"))
+# SQLite has no partitions, and autoincrements only a single-column integer key
+PARTITION_EXPENSES = EXPENSE_PARTITIONS > 0 and make_url(
+    os.getenv("DATABASE_URL", "postgresql://")
+).get_backend_name() == "postgresql"
+
 
 class Customer(Base):
     __tablename__ = "customers"
@@ -15,7 +29,9 @@ class Customer(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    projects = relationship("ProjectCustomer", back_populates="customer", cascade="all, delete-orphan")
+    # passive_deletes: ON DELETE CASCADE removes the children, they are never loaded to be deleted
+    projects = relationship("ProjectCustomer", back_populates="customer", cascade="all, delete-orphan",
+                            passive_deletes=True)
 
 
 class Project(Base):
@@ -27,8 +43,9 @@ class Project(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    expenses = relationship("Expense", back_populates="project", cascade="all, delete-orphan")
-    customers = relationship("ProjectCustomer", back_populates="project", cascade="all, delete-orphan")
+    expenses = relationship("Expense", back_populates="project", cascade="all, delete-orphan", passive_deletes=True)
+    customers = relationship("ProjectCustomer", back_populates="project", cascade="all, delete-orphan",
+                             passive_deletes=True)
 
 
 class ProjectCustomer(Base):
@@ -36,13 +53,16 @@ class ProjectCustomer(Base):
     __tablename__ = "project_customers"
     
     __table_args__ = (
-        CheckConstraint("cost_percentage >= 0 AND cost_percentage <= 100", name="valid_cost_percentage"),
+        CheckConstraint("cost_basis_points >= 0 AND cost_basis_points <= 10000", name="ck_cost_basis_points_range"),
+        UniqueConstraint("project_id", "customer_id", name="uq_project_customer"),
+        # Covering index for per-customer reads; per-project reads use uq_project_customer
+        Index("ix_pc_customer_project", "customer_id", "project_id", postgresql_include=["cost_basis_points"]),
     )
 
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
-    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
-    cost_percentage = Column(Float, nullable=False)  # 0-100
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), nullable=False)
+    cost_basis_points = Column(Integer, nullable=False)  # 0-10000 (1% = 100 bp)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -50,15 +70,181 @@ class ProjectCustomer(Base):
     customer = relationship("Customer", back_populates="projects")
 
 
+class ExpenseType(Base):
+    """Dictionary of expense type names; expenses reference them by a SMALLINT id"""
+    __tablename__ = "expense_types"
+
+    # SQLite only autoincrements INTEGER primary keys
+    id = Column(SmallInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    name = Column(String(255), unique=True, nullable=False)
+
+
 class Expense(Base):
+    """Expense row; partitioned tables key on (id, project_id) so per-project queries prune to one partition"""
     __tablename__ = "expenses"
+    __table_args__ = (
+        # Covering indexes: SUM(amount) per project, and per project and type, or per type alone,
+        # are index-only scans
+        Index("ix_expenses_project_amount", "project_id", "expense_type_id", postgresql_include=["amount_ore"]),
+        Index("ix_expenses_type_amount", "expense_type_id", postgresql_include=["amount_ore"]),
+        # Re-imports upsert on the source row key instead of inserting duplicates
+        Index("uq_expenses_project_source", "project_id", "source_key", unique=True),
+        {"postgresql_partition_by": "HASH (project_id)"} if PARTITION_EXPENSES else {},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
-    expense_type = Column(String(255), nullable=False)
-    amount = Column(Float, nullable=False)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False,
+                        primary_key=PARTITION_EXPENSES)
+    expense_type_id = Column(SmallInteger, ForeignKey("expense_types.id"), nullable=False)  # name via expense_types.py
+    amount_ore = Column(BigInteger, nullable=False)  # NOK * 100
     description = Column(Text, nullable=True)
+    source_key = Column(String(64), nullable=True)  # row ID (or content hash) in the imported export
+    fingerprint = Column(String(64), nullable=True)  # sha256 of the imported content
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     project = relationship("Project", back_populates="expenses")
+
+
+# ============ History (append-only) ============
+# No foreign keys: history outlives the projects, customers and expenses it describes.
+# BIGINT ids on PostgreSQL; SQLite only autoincrements INTEGER primary keys.
+HistoryId = BigInteger().with_variant(Integer, "sqlite")
+
+
+class AllocationHistory(Base):
+    """One row per change of a project-customer share"""
+    __tablename__ = "allocation_history"
+    __table_args__ = (
+        Index("ix_allocation_history_project", "project_id", "changed_at"),
+        Index("ix_allocation_history_customer", "customer_id", "changed_at"),
+        Index("ix_allocation_history_changed_at", "changed_at"),
+    )
+
+    id = Column(HistoryId, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, nullable=False)
+    customer_id = Column(Integer, nullable=False)
+    cost_basis_points = Column(Integer, nullable=True)  # NULL: allocation removed
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ExpenseHistory(Base):
+    """One row per expense insert, amount change or delete, with its effect on the project total"""
+    __tablename__ = "expense_history"
+    __table_args__ = (
+        Index("ix_expense_history_project", "project_id", "changed_at"),
+        Index("ix_expense_history_changed_at", "changed_at"),
+    )
+
+    id = Column(HistoryId, primary_key=True, autoincrement=True)
+    expense_id = Column(Integer, nullable=False)
+    project_id = Column(Integer, nullable=False)
+    amount_ore = Column(BigInteger, nullable=True)  # NULL: expense deleted
+    amount_delta_ore = Column(BigInteger, nullable=False)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class HistorySnapshot(Base):
+    """Compacted state of all history rows with changed_at <= covers_until"""
+    __tablename__ = "history_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    covers_until = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SnapshotAllocation(Base):
+    __tablename__ = "snapshot_allocations"
+    __table_args__ = (
+        Index("ix_snapshot_allocations_customer", "snapshot_id", "customer_id"),
+    )
+
+    snapshot_id = Column(Integer, ForeignKey("history_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    project_id = Column(Integer, primary_key=True)
+    customer_id = Column(Integer, primary_key=True)
+    cost_basis_points = Column(Integer, nullable=False)
+
+
+class SnapshotExpenseTotal(Base):
+    __tablename__ = "snapshot_expense_totals"
+
+    snapshot_id = Column(Integer, ForeignKey("history_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    project_id = Column(Integer, primary_key=True)
+    total_ore = Column(BigInteger, nullable=False)
+
+
+# ============ Maintained aggregates (leaderboards.py) ============
+# Kept in step with expenses and project_customers at commit time, so top-N
+# reads walk a ranking index instead of aggregating every expense.
+
+class ProjectTotal(Base):
+    """Expense total per project"""
+    __tablename__ = "project_totals"
+
+    project_id = Column(Integer, primary_key=True, autoincrement=False)
+    total_ore = Column(BigInteger, nullable=False)
+
+
+class ProjectTypeTotal(Base):
+    """Expense total per project and expense type"""
+    __tablename__ = "project_type_totals"
+
+    project_id = Column(Integer, primary_key=True)
+    expense_type_id = Column(SmallInteger, primary_key=True)
+    total_ore = Column(BigInteger, nullable=False)
+
+
+class CustomerProjectCost(Base):
+    """A customer's allocated share of a project's expenses"""
+    __tablename__ = "customer_project_costs"
+
+    project_id = Column(Integer, primary_key=True)
+    customer_id = Column(Integer, primary_key=True)
+    allocated_ore = Column(BigInteger, nullable=False)
+
+
+class CustomerTotal(Base):
+    """Allocated cost per customer across all projects"""
+    __tablename__ = "customer_totals"
+
+    customer_id = Column(Integer, primary_key=True, autoincrement=False)
+    allocated_ore = Column(BigInteger, nullable=False)
+
+
+# Ranking indexes: highest cost first, ties by id
+Index("ix_project_totals_ranking", ProjectTotal.total_ore.desc(), ProjectTotal.project_id)
+Index("ix_project_type_totals_ranking", ProjectTypeTotal.expense_type_id, ProjectTypeTotal.total_ore.desc(),
+      ProjectTypeTotal.project_id)
+Index("ix_customer_project_costs_ranking", CustomerProjectCost.customer_id, CustomerProjectCost.allocated_ore.desc(),
+      CustomerProjectCost.project_id)
+Index("ix_customer_totals_ranking", CustomerTotal.allocated_ore.desc(), CustomerTotal.customer_id)
+
+
+# ============ Change log (changelog.py) ============
+
+class ChangeLog(Base):
+    """Outbox row naming a customer, project, expense or allocation changed by a transaction"""
+    __tablename__ = "change_log"
+    __table_args__ = (
+        # Feed position: consumers read (txid, id) ranges
+        Index("ix_change_log_position", "txid", "id"),
+    )
+
+    id = Column(HistoryId, primary_key=True, autoincrement=True)
+    txid = Column(BigInteger, nullable=False)  # writing transaction's id (PostgreSQL xid)
+    entity = Column(String(16), nullable=False)  # customer | project | expense | allocation | all
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String(8), nullable=False)  # upsert | delete | reset
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+if PARTITION_EXPENSES:
+    for remainder in range(EXPENSE_PARTITIONS):
+        event.listen(
+            Expense.__table__,
+            "after_create",
+            DDL(
+                f"CREATE TABLE IF NOT EXISTS expenses_p{remainder} PARTITION OF expenses "
+                f"FOR VALUES WITH (MODULUS {EXPENSE_PARTITIONS}, REMAINDER {remainder})"
+            ).execute_if(dialect="postgresql"),
+        )
@@ -0,0 +1,50 @@
+"""
+Exact money arithmetic.
+
+Amounts are stored as integer øre and cost shares as integer basis points
+(1% = 100 bp), so sums never drift and "allocations add up to 100%" is an
+exact integer comparison. The API keeps NOK and percent; schemas.py converts
+at the boundary with the helpers below.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+ORE_PER_NOK = 100
+BASIS_POINTS_PER_PERCENT = 100
+FULL_ALLOCATION_BP = 100 * BASIS_POINTS_PER_PERCENT
+
+
+def to_ore(amount: float) -> int:
+    """NOK -> øre, rounding half up on the second decimal"""
+    return int((Decimal(str(amount)) * ORE_PER_NOK).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_ore(ore: int) -> float:
+    return int(ore or 0) / ORE_PER_NOK
+
+
+def to_basis_points(percentage: float) -> int:
+    """Percent -> basis points, rounding half up on the second decimal"""
+    return int((Decimal(str(percentage)) * BASIS_POINTS_PER_PERCENT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_basis_points(basis_points: int) -> float:
+    return int(basis_points or 0) / BASIS_POINTS_PER_PERCENT
+
+
+def allocate(total_ore: int, shares_bp: list) -> list:
+    """
+    Split total_ore by basis-point shares using the largest remainder method.
+
+    Each share gets the floor of its exact amount; the øre left over go one
+    by one to the largest fractional remainders (ties to the earlier share).
+    With shares summing to 100% the parts add up to exactly total_ore; with
+    less, the uncovered part stays unallocated.
+    """
+    exact = [total_ore * bp for bp in shares_bp]
+    parts = [e // FULL_ALLOCATION_BP for e in exact]
+    target = total_ore * min(sum(shares_bp), FULL_ALLOCATION_BP) // FULL_ALLOCATION_BP
+
+    by_remainder = sorted(range(len(parts)), key=lambda i: (-(exact[i] % FULL_ALLOCATION_BP), i))
+    for i in by_remainder[:max(target - sum(parts), 0)]:
+        parts[i] += 1
+    return parts
@@ -0,0 +1,232 @@
+"""Content negotiation: compressed responses and an opt-in MessagePack representation.
+
+CompressionMiddleware picks zstd, br or gzip from Accept-Encoding (zstd and
+brotli only when their packages are installed), leaves small responses
+alone and compresses large streamed responses chunk by chunk instead of
+buffering them. NegotiatedResponse renders route results as MessagePack
+when the client sent Accept: application/msgpack, and as JSON otherwise.
+"""
+import os
+import zlib
+from contextvars import ContextVar
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # dynamic responses: favour speed over ratio
+ZSTD_LEVEL = 3
+
+# Server preference when the client rates encodings equally
+SUPPORTED_ENCODINGS = [
+    encoding for encoding, available in (("zstd", zstandard), ("br", brotli), ("gzip", zlib)) if available
+]
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/x-ndjson", "text/plain", "text/csv", "text/html")
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+_wants_msgpack = ContextVar("wants_msgpack", default=False)
+
+
+def parse_quality(header: str) -> dict:
+    """Accept-style header -> {token: q}, e.g. "gzip;q=0.5, br" -> {"gzip": 0.5, "br": 1.0}"""
+    qualities = {}
+    for item in header.split(","):
+        token, *params = [part.strip() for part in item.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[token.lower()] = q
+    return qualities
+
+
+def negotiate_encoding(accept_encoding: str):
+    """Best supported content-coding for an Accept-Encoding header, or None"""
+    qualities = parse_quality(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = qualities.get(encoding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """Incremental compressor; compress() output is flushed so streamed chunks reach the client"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.flush()
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush()
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.finish()
+        return self._obj.compress(data) + self._obj.flush()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses of at least minimum_size bytes"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await _CompressingResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.buffer = b""
+        self.compressor = None  # set once the response is being compressed
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _compressible(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return media_type in COMPRESSIBLE_TYPES or media_type.endswith("+json")
+
+    def _start_compressed(self, content_length: int = None):
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if content_length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(content_length)
+        self.compressor = self.compressor or _Compressor(self.encoding)
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.passthrough = not self._compressible(Headers(raw=message["headers"]))
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is not None:
+            # Already streaming compressed output
+            if more_body:
+                await self.send({"type": "http.response.body", "body": self.compressor.compress(body), "more_body": True})
+            else:
+                await self.send({"type": "http.response.body", "body": self.compressor.finish(body)})
+            return
+
+        self.buffer += body
+        if not more_body:
+            if len(self.buffer) < self.minimum_size:
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": self.buffer})
+                return
+            compressed = _Compressor(self.encoding).finish(self.buffer)
+            self._start_compressed(content_length=len(compressed))
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": compressed})
+            return
+
+        if len(self.buffer) >= self.minimum_size:
+            # Large streamed response: compress each chunk as it arrives
+            self._start_compressed()
+            await self.send(self.start_message)
+            await self.send({"type": "http.response.body", "body": self.compressor.compress(self.buffer), "more_body": True})
+            self.buffer = b""
+
+
+# ============ MessagePack ============
+
+class MsgPackNegotiationMiddleware:
+    """Records whether the client prefers MessagePack; NegotiatedResponse reads it"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or msgpack is None:
+            await self.app(scope, receive, send)
+            return
+
+        accept = parse_quality(Headers(scope=scope).get("accept", ""))
+        msgpack_q = max(accept.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+        token = _wants_msgpack.set(msgpack_q > 0 and msgpack_q >= accept.get("application/json", 0.0))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _wants_msgpack.reset(token)
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSON by default; MessagePack for clients sending Accept: application/msgpack"""
+
+    def __init__(self, content, *args, **kwargs):
+        self.use_msgpack = _wants_msgpack.get()
+        if self.use_msgpack:
+            self.media_type = "application/msgpack"
+        super().__init__(content, *args, **kwargs)
+        self.headers.add_vary_header("Accept")
+
+    def render(self, content) -> bytes:
+        if self.use_msgpack:
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
@@ -0,0 +1,401 @@
+"""
+Schema changes that do not block the API, for Alembic migrations on PostgreSQL.
+
+A plain CREATE INDEX, ADD CONSTRAINT or UPDATE of a whole table holds a
+lock that stops writes (and, for most ALTER TABLEs, reads) on expenses or
+project_customers until it finishes. Worse, while it waits for that lock,
+every request behind it waits too. The helpers here split each change
+into steps that only take such locks briefly:
+
+    with_lock_retries           one statement needing a strong lock, retried on lock_timeout
+    add_column / drop_column    catalog-only column changes, retried on lock_timeout
+    create_index_concurrently   CREATE INDEX CONCURRENTLY; on a partitioned
+                                table, per partition and then attached
+    drop_index_concurrently     DROP INDEX CONCURRENTLY
+    drop_constraint             DROP CONSTRAINT, retried on lock_timeout
+    rename_constraint           swap in a replacement built next to the old constraint
+    add_check_constraint        ADD ... NOT VALID, then VALIDATE separately
+    add_foreign_key             the same; per partition on a partitioned table
+    validate_constraint         VALIDATE CONSTRAINT, which lets reads and writes go on
+    set_not_null                SET NOT NULL proven by a validated CHECK
+    backfill                    UPDATE in committed key-range batches, throttled
+    copy_rows                   INSERT ... SELECT into another table in the same batches
+
+Each helper commits Alembic's transaction and runs in autocommit, so
+nothing stays locked until the end of the migration, and each is safe to
+re-run after a failure. Statements that need a strong lock wait at most
+lock_timeout (MIGRATION_LOCK_TIMEOUT, set in alembic/env.py) and are
+retried MIGRATION_LOCK_RETRIES times, so a long-running query delays the
+migration instead of the API.
+
+Usage (lints migrations after ONLINE_SINCE for blocking operations):
+    python online_migrations.py check
+"""
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+from alembic import op
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+MIGRATION_LOCK_RETRIES = int(os.getenv("MIGRATION_LOCK_RETRIES", "10"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "5000"))
+# Seconds between backfill batches, leaving room for API traffic and replication
+BACKFILL_PAUSE = float(os.getenv("BACKFILL_PAUSE", "0.1"))
+PROGRESS_INTERVAL = 10  # seconds between backfill progress lines
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+# ============ Execution ============
+
+def _execute(statement: str, params: dict = None):
+    return op.get_bind().execute(text(statement), params or {})
+
+
+def _scalar(statement: str, params: dict = None):
+    return _execute(statement, params).scalar()
+
+
+def with_lock_retries(statement: str, params: dict = None):
+    """Run a statement needing a strong lock, retrying when lock_timeout gives up"""
+    for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+        try:
+            return _execute(statement, params)
+        except OperationalError as e:
+            if getattr(e.orig, "pgcode", None) != LOCK_NOT_AVAILABLE or attempt == MIGRATION_LOCK_RETRIES:
+                raise
+            print(f"Lock not available, retry {attempt}/{MIGRATION_LOCK_RETRIES - 1}: {' '.join(statement.split())[:80]}")
+            time.sleep(min(attempt, 10))
+
+
+@contextmanager
+def _no_lock_timeout():
+    """
+    For statements that only take SHARE UPDATE EXCLUSIVE, which reads and
+    writes do not queue behind; CONCURRENTLY also waits on older
+    transactions, which lock_timeout would count against it.
+    """
+    previous = _scalar("SHOW lock_timeout")
+    _execute("SELECT set_config('lock_timeout', '0', false)")
+    try:
+        yield
+    finally:
+        _execute("SELECT set_config('lock_timeout', :value, false)", {"value": previous})
+
+
+def _is_partitioned(table: str) -> bool:
+    return bool(_scalar("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)", {"t": table}))
+
+
+def _partitions(table: str) -> list:
+    return list(_execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:t) ORDER BY c.relname", {"t": table}
+    ).scalars())
+
+
+def _partition_object_name(name: str, table: str, partition: str) -> str:
+    """ix_x on expenses -> ix_x_p3 on expenses_p3"""
+    suffix = partition[len(table) + 1:] if partition.startswith(f"{table}_") else partition
+    return f"{name}_{suffix}"[:63]
+
+
+# ============ Columns ============
+
+def add_column(table: str, column: str, definition: str):
+    """
+    ADD COLUMN IF NOT EXISTS. Keep it nullable without a volatile default, so
+    only the catalog changes; fill it with backfill and then set_not_null.
+    """
+    with op.get_context().autocommit_block():
+        with_lock_retries(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}")
+
+
+def drop_column(table: str, column: str):
+    """DROP COLUMN IF EXISTS; the space is reclaimed by later writes, not by a rewrite"""
+    with op.get_context().autocommit_block():
+        with_lock_retries(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {column}")
+
+
+# ============ Indexes ============
+
+def _index_valid(name: str):
+    """True/False for an existing index, None if there is none"""
+    return _scalar(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)", {"name": name}
+    )
+
+
+def create_index_concurrently(name: str, table: str, columns: str, unique: bool = False,
+                              include: str = None, where: str = None):
+    """
+    Build an index while reads and writes go on. columns, include and where
+    are SQL, e.g. create_index_concurrently("ix_x", "expenses", "project_id, created_at").
+
+    An invalid index left by an interrupted build is dropped and built again.
+    Partitioned tables cannot build concurrently, so the parent index is
+    created empty ON ONLY the parent, each partition's index is built
+    concurrently and attached, and the parent becomes valid with the last one.
+    """
+    definition = f"({columns})"
+    if include:
+        definition += f" INCLUDE ({include})"
+    if where:
+        definition += f" WHERE {where}"
+    create = f"CREATE {'UNIQUE ' if unique else ''}INDEX"
+
+    with op.get_context().autocommit_block():
+        if not _is_partitioned(table):
+            _build_index(name, f"{create} CONCURRENTLY {name} ON {table} {definition}")
+            return
+
+        if _index_valid(name) is None:
+            with_lock_retries(f"{create} {name} ON ONLY {table} {definition}")
+        for partition in _partitions(table):
+            child = _partition_object_name(name, table, partition)
+            _build_index(child, f"{create} CONCURRENTLY {child} ON {partition} {definition}")
+            attached = _scalar(
+                "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:child) AND inhparent = to_regclass(:name)",
+                {"child": child, "name": name},
+            )
+            if not attached:
+                with_lock_retries(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def _build_index(name: str, statement: str):
+    valid = _index_valid(name)
+    if valid:
+        return
+    started = time.monotonic()
+    with _no_lock_timeout():
+        if valid is False:
+            print(f"Dropping invalid index {name} left by an interrupted build")
+            _execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        _execute(statement)
+    print(f"Built index {name} in {time.monotonic() - started:.1f}s")
+
+
+def drop_index_concurrently(name: str):
+    """
+    Drop an index without blocking the table. An index on a partitioned
+    table cannot be dropped concurrently; it is dropped under lock_timeout.
+    """
+    with op.get_context().autocommit_block():
+        partitioned = _scalar("SELECT relkind = 'I' FROM pg_class WHERE oid = to_regclass(:name)", {"name": name})
+        if partitioned is None:
+            return
+        if partitioned:
+            with_lock_retries(f"DROP INDEX IF EXISTS {name}")
+        else:
+            with _no_lock_timeout():
+                _execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+# ============ Constraints ============
+
+def _constraint_validated(table: str, name: str):
+    """True/False for an existing constraint, None if there is none"""
+    return _scalar(
+        "SELECT convalidated FROM pg_constraint WHERE conrelid = to_regclass(:t) AND conname = :name",
+        {"t": table, "name": name},
+    )
+
+
+def validate_constraint(table: str, name: str):
+    """Check existing rows against a NOT VALID constraint; reads and writes continue meanwhile"""
+    with op.get_context().autocommit_block():
+        if _constraint_validated(table, name) is False:
+            started = time.monotonic()
+            with _no_lock_timeout():
+                _execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+            print(f"Validated {name} on {table} in {time.monotonic() - started:.1f}s")
+
+
+def drop_constraint(table: str, name: str):
+    with op.get_context().autocommit_block():
+        with_lock_retries(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+
+
+def rename_constraint(table: str, name: str, new_name: str):
+    """
+    Swap in a constraint built next to the one it replaces, e.g. a foreign key
+    gaining ON DELETE CASCADE, so the column is never left unchecked.
+    """
+    with op.get_context().autocommit_block():
+        if _constraint_validated(table, name) is not None:
+            with_lock_retries(f"ALTER TABLE {table} RENAME CONSTRAINT {name} TO {new_name}")
+
+
+def add_check_constraint(table: str, name: str, condition: str, validate: bool = True):
+    """
+    ADD CONSTRAINT ... CHECK (condition) NOT VALID, which holds its lock only
+    briefly and checks new rows from then on. Existing rows are checked by
+    validate_constraint, now or (validate=False) in a later deploy.
+    """
+    with op.get_context().autocommit_block():
+        if _constraint_validated(table, name) is None:
+            with_lock_retries(f"ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({condition}) NOT VALID")
+    if validate:
+        validate_constraint(table, name)
+
+
+def add_foreign_key(table: str, name: str, columns: str, referred_table: str, referred_columns: str = "id",
+                    ondelete: str = None, validate: bool = True):
+    """
+    Foreign key added NOT VALID and validated separately, like add_check_constraint.
+
+    PostgreSQL has no NOT VALID foreign keys on partitioned tables: each
+    partition gets its own, validated one by one, and the key added to the
+    parent afterwards takes them over instead of checking the rows again.
+    """
+    definition = f"FOREIGN KEY ({columns}) REFERENCES {referred_table} ({referred_columns})"
+    if ondelete:
+        definition += f" ON DELETE {ondelete}"
+
+    if not _is_partitioned(table):
+        with op.get_context().autocommit_block():
+            if _constraint_validated(table, name) is None:
+                with_lock_retries(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID")
+        if validate:
+            validate_constraint(table, name)
+        return
+
+    if _constraint_validated(table, name) is not None:
+        return
+    for partition in _partitions(table):
+        add_foreign_key(partition, _partition_object_name(name, table, partition), columns,
+                        referred_table, referred_columns, ondelete, validate=True)
+    with op.get_context().autocommit_block():
+        with_lock_retries(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def set_not_null(table: str, column: str):
+    """
+    SET NOT NULL without scanning under an exclusive lock: a validated
+    CHECK (column IS NOT NULL) proves it, and is dropped afterwards.
+    """
+    if _scalar(
+        "SELECT attnotnull FROM pg_attribute WHERE attrelid = to_regclass(:t) AND attname = :c",
+        {"t": table, "c": column},
+    ):
+        return
+    check = f"{table}_{column}_not_null"[:63]
+    add_check_constraint(table, check, f"{column} IS NOT NULL")
+    with op.get_context().autocommit_block():
+        with_lock_retries(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+        with_lock_retries(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check}")
+
+
+# ============ Backfills ============
+
+def backfill(table: str, assignments: str, where: str = None, key: str = "id",
+             batch_size: int = BACKFILL_BATCH_SIZE, pause: float = BACKFILL_PAUSE) -> int:
+    """
+    UPDATE table SET assignments [WHERE where] in batches of batch_size key
+    values, each committed on its own, with pause seconds between batches.
+
+    Key ranges keep each batch an index range scan and each row lock short.
+    Pass a where that excludes finished rows (e.g. "amount_ore IS NULL") so
+    a re-run after an interruption only does the rest. Progress is printed
+    every PROGRESS_INTERVAL seconds. Returns the number of rows updated.
+    """
+    condition = f" AND ({where})" if where else ""
+    statement = f"UPDATE {table} SET {assignments} WHERE {key} >= :low AND {key} < :high{condition}"
+    return _in_batches(f"Backfill {table}", table, key, statement, batch_size, pause)
+
+
+def copy_rows(source: str, target: str, columns: str, key: str = "id",
+              batch_size: int = BACKFILL_BATCH_SIZE, pause: float = BACKFILL_PAUSE) -> int:
+    """
+    INSERT INTO target SELECT columns FROM source in committed key-range
+    batches, like backfill, e.g. to move a table into a new layout.
+
+    Each batch share-locks the rows it reads, so a concurrent update or
+    delete of one waits for the batch instead of racing it; rows already in
+    target are skipped, so a re-run is safe. Writes to source while copying
+    must reach target another way, e.g. a trigger. Returns the rows copied.
+    """
+    statement = (
+        f"INSERT INTO {target} ({columns}) SELECT {columns} FROM {source} "
+        f"WHERE {key} >= :low AND {key} < :high FOR SHARE ON CONFLICT DO NOTHING"
+    )
+    return _in_batches(f"Copy {source} to {target}", source, key, statement, batch_size, pause)
+
+
+def _in_batches(label: str, table: str, key: str, statement: str, batch_size: int, pause: float) -> int:
+    """Run statement for each [:low, :high) range of table's key values; returns the rows affected"""
+    with op.get_context().autocommit_block():
+        low, high = _execute(f"SELECT min({key}), max({key}) FROM {table}").one()
+        if low is None:
+            return 0
+        started = reported = time.monotonic()
+        affected = 0
+        position = low
+        while position <= high:
+            affected += with_lock_retries(statement, {"low": position, "high": position + batch_size}).rowcount
+            position += batch_size
+            now = time.monotonic()
+            if now - reported >= PROGRESS_INTERVAL or position > high:
+                done = min(position, high + 1) - low
+                fraction = done / (high + 1 - low)
+                remaining = (now - started) * (1 - fraction) / fraction
+                print(f"{label}: {fraction:.0%} of {key} range, {affected} rows, about {remaining:.0f}s left")
+                reported = now
+            if pause and position <= high:
+                time.sleep(pause)
+    return affected
+
+
+# ============ Policy check ============
+
+# Migrations up to and including this one predate the policy
+ONLINE_SINCE = "0003_covering_indexes"
+LARGE_TABLES = ("expenses", "project_customers", "change_log", "expense_history", "allocation_history")
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic", "versions")
+
+# (pattern, advice); a line ending in "# online: ok" is exempt, e.g. for a table created in the same migration
+BLOCKING_PATTERNS = [
+    (r"op\.create_index\(", "use create_index_concurrently"),
+    (r"op\.drop_index\(", "use drop_index_concurrently"),
+    (r"op\.(add|drop)_column\(", "use add_column / drop_column"),
+    (r"op\.drop_constraint\(", "use drop_constraint"),
+    (r"op\.create_(foreign_key|check_constraint|unique_constraint)\(",
+     "use add_foreign_key / add_check_constraint, or a unique index built concurrently"),
+    (r"nullable\s*=\s*False", "use set_not_null after a backfill"),
+    (r"CREATE (UNIQUE )?INDEX (?!CONCURRENTLY)", "use create_index_concurrently"),
+    (r"ADD CONSTRAINT (?!.*NOT VALID)", "use add_check_constraint / add_foreign_key"),
+    (r"\bUPDATE \w+ SET\b", "use backfill"),
+]
+
+
+def check_migrations(versions_dir: str = VERSIONS_DIR) -> list:
+    """(file, line number, line, advice) for blocking operations on large tables in new migrations"""
+    problems = []
+    for filename in sorted(os.listdir(versions_dir)):
+        if not filename.endswith(".py") or filename.split("_")[0] <= ONLINE_SINCE.split("_")[0]:
+            continue
+        with open(os.path.join(versions_dir, filename)) as f:
+            for number, line in enumerate(f, start=1):
+                if line.rstrip().endswith("# online: ok"):
+                    continue
+                if not any(re.search(rf"\b{table}\b", line) for table in LARGE_TABLES):
+                    continue
+                for pattern, advice in BLOCKING_PATTERNS:
+                    if re.search(pattern, line, re.IGNORECASE):
+                        problems.append((filename, number, line.strip(), advice))
+    return problems
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["check"]:
+        print(__doc__)
+        sys.exit(2)
+    found = check_migrations()
+    for filename, number, line, advice in found:
+        print(f"{filename}:{number}: {line}\n    blocks {', '.join(LARGE_TABLES)} traffic: {advice}")
+    print(f"{len(found)} blocking operation(s) on large tables" if found else "No blocking operations on large tables")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,255 @@
+"""On-demand profiling of single requests.
+
+Disabled unless PROFILE_TOKEN is set. A request carrying that token in the
+X-Profile-Token header runs under a wall-clock sampling profiler; every
+other request passes straight through.
+
+The sampler reads the stacks of all interpreter threads, so the threadpool
+thread running a sync route is profiled along with the event loop. SQL
+statements executed for the request are timed through engine events. The
+result is stored as a speedscope file (https://www.speedscope.app) in
+PROFILE_DIR, named by the X-Profile-Id response header, and can be
+downloaded from GET /admin/profiles/{profile_id}.
+"""
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+import fastapi
+import pydantic
+import sqlalchemy
+import starlette
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/case-profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "1")) / 1000
+PROFILE_HEADER = "x-profile-token"
+ADMIN_PREFIX = "/admin/"  # admin routes take the token as their credential and are never profiled
+MAX_SQL_STATEMENT = 2000
+
+# Stacks without a frame from these are idle threads (pool workers waiting for work, the loop in select)
+_INTERESTING_PATHS = tuple(
+    os.path.dirname(os.path.abspath(module.__file__))
+    for module in (sys.modules[__name__], fastapi, pydantic, sqlalchemy, starlette)
+)
+
+_active_profile = ContextVar("active_profile", default=None)
+_listener_lock = threading.Lock()
+_listener_users = 0
+
+
+def is_authorized(token) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def profile_path(profile_id: str):
+    """Path of a stored profile, or None for ids that are not ours"""
+    try:
+        uuid.UUID(profile_id)
+    except ValueError:
+        return None
+    return os.path.join(PROFILE_DIR, f"{profile_id}.speedscope.json")
+
+
+class _Sampler(threading.Thread):
+    """Samples the Python stack of every busy thread each interval"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.ticks = []  # (elapsed since previous tick, {thread ident: stack})
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        previous = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            stacks = {}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if any(filename.startswith(_INTERESTING_PATHS) for _, filename, _ in stack):
+                    stack.reverse()
+                    stacks[ident] = tuple(stack)
+            self.ticks.append((now - previous, stacks))
+            previous = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class _Profile:
+    def __init__(self, method: str, path: str):
+        self.id = str(uuid.uuid4())
+        self.name = f"{method} {path}"
+        self.started = time.perf_counter()
+        self.request_threads = {threading.get_ident()}
+        self.sql = []
+
+    def record_sql(self, statement: str, duration: float):
+        self.request_threads.add(threading.get_ident())
+        self.sql.append({
+            "statement": statement[:MAX_SQL_STATEMENT],
+            "duration_ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        })
+
+    @property
+    def sql_ms(self) -> float:
+        return sum(query["duration_ms"] for query in self.sql)
+
+    def to_speedscope(self, ticks: list, status: int) -> dict:
+        """One sampled profile per thread; threads that ran this request's SQL are marked"""
+        frames, frame_index = [], {}
+        samples_by_thread = {}
+        for weight, stacks in ticks:
+            for ident, stack in stacks.items():
+                indices = []
+                for frame in stack:
+                    if frame not in frame_index:
+                        frame_index[frame] = len(frames)
+                        name, filename, line = frame
+                        frames.append({"name": name, "file": filename, "line": line})
+                    indices.append(frame_index[frame])
+                samples, weights = samples_by_thread.setdefault(ident, ([], []))
+                samples.append(indices)
+                weights.append(round(weight * 1000, 3))
+
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        profiles = []
+        for ident, (samples, weights) in samples_by_thread.items():
+            name = thread_names.get(ident, str(ident))
+            if ident in self.request_threads:
+                name += " (this request)"
+            profiles.append({
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            })
+        profiles.sort(key=lambda profile: "(this request)" not in profile["name"])
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "case-api profiling",
+            "name": self.name,
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            # Not part of the speedscope format; the viewer ignores it
+            "request": {
+                "status": status,
+                "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "sql_ms": round(self.sql_ms, 3),
+                "sql": self.sql,
+            },
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active_profile.get()
+    if profile is not None and conn.info.get("profile_started"):
+        profile.record_sql(statement, time.perf_counter() - conn.info["profile_started"].pop())
+
+
+def _listen_sql():
+    """SQL hooks are only attached while a profiled request is running"""
+    global _listener_users
+    with _listener_lock:
+        if _listener_users == 0:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _listener_users += 1
+
+
+def _unlisten_sql():
+    global _listener_users
+    with _listener_lock:
+        _listener_users -= 1
+        if _listener_users == 0:
+            event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class ProfilingMiddleware:
+    """Profiles requests that carry the admin profile token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILE_TOKEN or scope["path"].startswith(ADMIN_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        # Header only: a token in the URL would end up in access logs and browser history
+        token = Headers(scope=scope).get(PROFILE_HEADER)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not is_authorized(token):
+            await JSONResponse({"detail": "Invalid profile token"}, status_code=403)(scope, receive, send)
+            return
+
+        await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        profile = _Profile(scope["method"], scope["path"])
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Id"] = profile.id
+                elapsed_ms = (time.perf_counter() - profile.started) * 1000
+                headers.append("Server-Timing", f"app;dur={elapsed_ms:.1f}, sql;dur={profile.sql_ms:.1f}")
+            await send(message)
+
+        context_token = _active_profile.set(profile)
+        _listen_sql()
+        sampler = _Sampler(PROFILE_INTERVAL)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Joining the sampler waits up to one interval: not on the event loop
+            await run_in_threadpool(sampler.stop)
+            _unlisten_sql()
+            _active_profile.reset(context_token)
+            await run_in_threadpool(self._store, profile, sampler.ticks, status["code"])
+
+    def _store(self, profile: _Profile, ticks: list, status: int):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(profile_path(profile.id), "w") as f:
+                json.dump(profile.to_speedscope(ticks, status), f)
+            print(f"Profile {profile.id}: {profile.name} -> {status}, {len(profile.sql)} queries")
+        except Exception as e:
+            print(f"Warning: Could not store profile {profile.id}: {e}")
@@ -0,0 +1,496 @@
+"""
+Optional in-process read model of the cost graph.
+
+Each worker can hold customers, projects, cost shares and per-project
+expense totals in memory and answer the cost overviews, allocation
+validation and the dashboard summary without a database round trip. The
+graph is small next to the expense table: one __slots__ record per project
+and customer, one (project, customer) pair per share, and per expense only
+its project and amount in two typed arrays indexed by expense id. Those
+arrays keep updates exact without ever re-summing a project's expenses.
+
+The model is warmed at startup from one consistent snapshot and then kept
+fresh by a background thread that polls change_log (see changelog.py) from
+the position it has applied up to, so a refresh costs time proportional to
+the writes since the last one. A reset in the log reloads everything.
+Routes only use the model while its last refresh is at most
+READ_MODEL_MAX_STALENESS seconds old, and never for requests sent with
+X-Read-Your-Writes; otherwise they query the database as before.
+
+Memory is bounded by READ_MODEL_MAX_EXPENSE_ID: with expense ids beyond it
+the model turns itself off and every read goes to the database.
+"""
+import heapq
+import os
+import sys
+import threading
+import time
+from array import array
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import changelog
+import dialect
+from database import wants_read_your_writes
+from crud import _build_project_cost_overview, _ranked
+from models import Customer, Expense, Project, ProjectCustomer
+from money import FULL_ALLOCATION_BP, allocate, from_basis_points, from_ore
+from schemas import DASHBOARD_TOP_SIZE, CustomerCostDetail, CustomerCostOverview, DashboardSummary
+
+READ_MODEL_ENABLED = os.getenv("READ_MODEL_ENABLED", "false").lower() == "true"
+# Seconds between polls of change_log
+READ_MODEL_REFRESH_INTERVAL = float(os.getenv("READ_MODEL_REFRESH_INTERVAL", "0.5"))
+# Older than this, the model is not used and reads fall back to the database
+READ_MODEL_MAX_STALENESS = float(os.getenv("READ_MODEL_MAX_STALENESS", "5"))
+# Two typed arrays of this length (12 bytes per id) are the bulk of the footprint
+READ_MODEL_MAX_EXPENSE_ID = int(os.getenv("READ_MODEL_MAX_EXPENSE_ID", "20000000"))
+CHANGES_PER_PAGE = 5000
+FETCH_BATCH_SIZE = 1000  # ids per IN (...) when reading the state of changed rows
+
+
+class CapacityExceeded(Exception):
+    """An expense id is beyond READ_MODEL_MAX_EXPENSE_ID"""
+
+
+class ProjectNode:
+    __slots__ = ("name", "total_ore", "expense_count", "shares", "parts")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.total_ore = 0
+        self.expense_count = 0
+        self.shares = {}  # customer_id -> basis points
+        self.parts = ()   # (customer_id, basis points, allocated øre) ordered by customer id
+
+    def allocated_ore(self) -> int:
+        return sum(part for _, _, part in self.parts)
+
+    def is_invalid(self) -> bool:
+        """Shares that do not add up to 100%; projects without customers count as valid"""
+        return bool(self.shares) and sum(self.shares.values()) != FULL_ALLOCATION_BP
+
+
+class CustomerNode:
+    __slots__ = ("name", "project_ids")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.project_ids = set()
+
+
+def _in_batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), FETCH_BATCH_SIZE):
+        yield ids[start:start + FETCH_BATCH_SIZE]
+
+
+class CostGraph:
+    """Customers, projects and shares with per-project totals, plus the dashboard sums over them"""
+
+    def __init__(self, max_expense_id: int = READ_MODEL_MAX_EXPENSE_ID):
+        self.max_expense_id = max_expense_id
+        self.lock = threading.RLock()
+        self.projects = {}
+        self.customers = {}
+        self.allocations = {}  # allocation id -> (project_id, customer_id)
+        # Indexed by expense id; project 0 marks an id without a live expense
+        self.expense_project = array("i")
+        self.expense_amount = array("q")
+        self.expense_count = 0
+        self.total_ore = 0
+        self.allocated_ore = 0
+        self.invalid_count = 0
+        self._detached = set()
+
+    # ---- Maintenance ----
+
+    def _detach(self, project_id: int):
+        """Take a project out of the sums before changing it; _reattach puts it back"""
+        if project_id in self._detached or project_id not in self.projects:
+            return
+        node = self.projects[project_id]
+        self.expense_count -= node.expense_count
+        self.total_ore -= node.total_ore
+        self.allocated_ore -= node.allocated_ore()
+        self.invalid_count -= node.is_invalid()
+        self._detached.add(project_id)
+
+    def _reattach(self):
+        for project_id in self._detached:
+            node = self.projects.get(project_id)
+            if node is None:
+                continue
+            shares = sorted(node.shares.items())
+            parts = allocate(node.total_ore, [bp for _, bp in shares])
+            node.parts = tuple((customer_id, bp, part) for (customer_id, bp), part in zip(shares, parts))
+            self.expense_count += node.expense_count
+            self.total_ore += node.total_ore
+            self.allocated_ore += node.allocated_ore()
+            self.invalid_count += node.is_invalid()
+        self._detached.clear()
+
+    def _put_project(self, project_id: int, name: str):
+        if project_id in self.projects:
+            self.projects[project_id].name = name
+        else:
+            self.projects[project_id] = ProjectNode(name)
+
+    def _remove_project(self, project_id: int):
+        self._detach(project_id)
+        node = self.projects.pop(project_id, None)
+        if node is None or not node.shares:
+            return
+        for customer_id in node.shares:
+            if customer_id in self.customers:
+                self.customers[customer_id].project_ids.discard(project_id)
+        self.allocations = {
+            allocation_id: pair for allocation_id, pair in self.allocations.items() if pair[0] != project_id
+        }
+
+    def _put_customer(self, customer_id: int, name: str):
+        if customer_id in self.customers:
+            self.customers[customer_id].name = name
+        else:
+            self.customers[customer_id] = CustomerNode(name)
+
+    def _remove_customer(self, customer_id: int):
+        node = self.customers.pop(customer_id, None)
+        if node is None or not node.project_ids:
+            return
+        for project_id in node.project_ids:
+            self._detach(project_id)
+            self.projects[project_id].shares.pop(customer_id, None)
+        self.allocations = {
+            allocation_id: pair for allocation_id, pair in self.allocations.items() if pair[1] != customer_id
+        }
+
+    def _put_allocation(self, allocation_id: int, project_id: int, customer_id: int, basis_points: int):
+        self._remove_allocation(allocation_id)
+        if project_id not in self.projects or customer_id not in self.customers:
+            return
+        self._detach(project_id)
+        self.projects[project_id].shares[customer_id] = basis_points
+        self.customers[customer_id].project_ids.add(project_id)
+        self.allocations[allocation_id] = (project_id, customer_id)
+
+    def _remove_allocation(self, allocation_id: int):
+        pair = self.allocations.pop(allocation_id, None)
+        if pair is None:
+            return
+        project_id, customer_id = pair
+        if project_id in self.projects:
+            self._detach(project_id)
+            self.projects[project_id].shares.pop(customer_id, None)
+        if customer_id in self.customers:
+            self.customers[customer_id].project_ids.discard(project_id)
+
+    def _put_expense(self, expense_id: int, project_id: int, amount_ore: int):
+        if expense_id > self.max_expense_id:
+            raise CapacityExceeded(f"expense id {expense_id} is above READ_MODEL_MAX_EXPENSE_ID")
+        if expense_id >= len(self.expense_project):
+            # Doubling keeps appends amortized O(1), but never past the configured capacity
+            size = min(max(expense_id + 1, 2 * len(self.expense_project)), self.max_expense_id + 1)
+            grow = size - len(self.expense_project)
+            self.expense_project.extend(array("i", bytes(4 * grow)))
+            self.expense_amount.extend(array("q", bytes(8 * grow)))
+        self._remove_expense(expense_id)
+        if project_id not in self.projects:
+            return
+        self._detach(project_id)
+        node = self.projects[project_id]
+        node.total_ore += amount_ore
+        node.expense_count += 1
+        self.expense_project[expense_id] = project_id
+        self.expense_amount[expense_id] = amount_ore
+
+    def _remove_expense(self, expense_id: int):
+        if expense_id >= len(self.expense_project) or not self.expense_project[expense_id]:
+            return
+        project_id = self.expense_project[expense_id]
+        if project_id in self.projects:
+            self._detach(project_id)
+            node = self.projects[project_id]
+            node.total_ore -= self.expense_amount[expense_id]
+            node.expense_count -= 1
+        self.expense_project[expense_id] = 0
+        self.expense_amount[expense_id] = 0
+
+    def load(self, db: Session):
+        """Fill an empty graph with every row visible to db's transaction"""
+        with self.lock:
+            for customer_id, name in db.execute(select(Customer.id, Customer.name)):
+                self._put_customer(customer_id, name)
+            for project_id, name in db.execute(select(Project.id, Project.name)):
+                self._put_project(project_id, name)
+            for row in db.execute(select(
+                ProjectCustomer.id, ProjectCustomer.project_id, ProjectCustomer.customer_id,
+                ProjectCustomer.cost_basis_points,
+            )):
+                self._put_allocation(*row)
+            expenses = db.execute(
+                select(Expense.id, Expense.project_id, Expense.amount_ore).execution_options(yield_per=10000)
+            )
+            for row in expenses:
+                self._put_expense(*row)
+            self._reattach()
+
+    def apply(self, db: Session, changed: dict):
+        """Bring the entities in changed ({(entity, id): action}) to their state in db's transaction"""
+        ids = {entity: set() for entity in changelog.ENTITIES}
+        for (entity, entity_id) in changed:
+            ids[entity].add(entity_id)
+
+        # Read everything first, so the lock is only held while applying
+        allocations = [
+            row for batch in _in_batches(ids["allocation"]) for row in db.execute(select(
+                ProjectCustomer.id, ProjectCustomer.project_id, ProjectCustomer.customer_id,
+                ProjectCustomer.cost_basis_points,
+            ).where(ProjectCustomer.id.in_(batch)))
+        ]
+        expenses = [
+            row for batch in _in_batches(ids["expense"]) for row in db.execute(
+                select(Expense.id, Expense.project_id, Expense.amount_ore).where(Expense.id.in_(batch))
+            )
+        ]
+        # Rows can point at a project or customer created in a transaction past the horizon
+        project_ids = ids["project"] | {
+            row.project_id for row in allocations + expenses if row.project_id not in self.projects
+        }
+        customer_ids = ids["customer"] | {
+            row.customer_id for row in allocations if row.customer_id not in self.customers
+        }
+        projects = dict(row for batch in _in_batches(project_ids)
+                        for row in db.execute(select(Project.id, Project.name).where(Project.id.in_(batch))))
+        customers = dict(row for batch in _in_batches(customer_ids)
+                         for row in db.execute(select(Customer.id, Customer.name).where(Customer.id.in_(batch))))
+
+        with self.lock:
+            for project_id, name in projects.items():
+                self._put_project(project_id, name)
+            for customer_id, name in customers.items():
+                self._put_customer(customer_id, name)
+            for row in allocations:
+                self._put_allocation(*row)
+            for row in expenses:
+                self._put_expense(*row)
+            for allocation_id in ids["allocation"] - {row.id for row in allocations}:
+                self._remove_allocation(allocation_id)
+            for expense_id in ids["expense"] - {row.id for row in expenses}:
+                self._remove_expense(expense_id)
+            for project_id in ids["project"] - set(projects):
+                self._remove_project(project_id)
+            for customer_id in ids["customer"] - set(customers):
+                self._remove_customer(customer_id)
+            self._reattach()
+
+    # ---- Reads, shaped like the crud.py answers ----
+
+    def project_cost_overview(self, project_id: int):
+        with self.lock:
+            node = self.projects.get(project_id)
+            if node is None:
+                raise HTTPException(status_code=404, detail="Project not found")
+            rows = [(customer_id, self.customers[customer_id].name, bp) for customer_id, bp, _ in node.parts]
+            total_ore = node.total_ore
+            name = node.name
+        return _build_project_cost_overview(project_id, name, total_ore, rows)
+
+    def customer_cost_overview(self, customer_id: int) -> CustomerCostOverview:
+        with self.lock:
+            customer = self.customers.get(customer_id)
+            if customer is None:
+                raise HTTPException(status_code=404, detail="Customer not found")
+            total_cost = 0
+            details = []
+            for project_id in sorted(customer.project_ids):
+                node = self.projects[project_id]
+                basis_points, allocated_cost = next(
+                    (bp, part) for share_customer_id, bp, part in node.parts if share_customer_id == customer_id
+                )
+                total_cost += allocated_cost
+                details.append(CustomerCostDetail(
+                    project_id=project_id,
+                    project_name=node.name,
+                    cost_percentage=from_basis_points(basis_points),
+                    total_expenses=from_ore(node.total_ore),
+                    allocated_cost=from_ore(allocated_cost)
+                ))
+            name = customer.name
+        return CustomerCostOverview(
+            customer_id=customer_id,
+            customer_name=name,
+            total_cost=from_ore(total_cost),
+            projects=details
+        )
+
+    def validate_project_cost_allocation(self, project_id: int) -> dict:
+        with self.lock:
+            node = self.projects.get(project_id)
+            if node is None:
+                raise HTTPException(status_code=404, detail="Project not found")
+            shares = sorted(node.shares.items())
+        total_basis_points = sum(bp for _, bp in shares)
+        return {
+            "project_id": project_id,
+            "total_percentage": from_basis_points(total_basis_points),
+            "is_valid": total_basis_points == FULL_ALLOCATION_BP if shares else True,
+            "customer_count": len(shares),
+            "allocation_details": [
+                {"customer_id": customer_id, "cost_percentage": from_basis_points(bp)} for customer_id, bp in shares
+            ]
+        }
+
+    def dashboard_summary(self) -> DashboardSummary:
+        with self.lock:
+            customers, projects, expenses = len(self.customers), len(self.projects), self.expense_count
+            total, allocated, invalid = self.total_ore, self.allocated_ore, self.invalid_count
+            # Same order and zero rows skipped as the aggregate tables behind crud's leaderboards
+            customer_costs = {}
+            for node in self.projects.values():
+                for customer_id, _, part in node.parts:
+                    customer_costs[customer_id] = customer_costs.get(customer_id, 0) + part
+            top_customers = heapq.nsmallest(DASHBOARD_TOP_SIZE, (
+                (-cost, customer_id, self.customers[customer_id].name)
+                for customer_id, cost in customer_costs.items() if cost
+            ))
+            top_projects = heapq.nsmallest(DASHBOARD_TOP_SIZE, (
+                (-node.total_ore, project_id, node.name)
+                for project_id, node in self.projects.items() if node.total_ore
+            ))
+        return DashboardSummary(
+            customer_count=customers,
+            project_count=projects,
+            expense_count=expenses,
+            total_expenses=from_ore(total),
+            average_project_expenses=from_ore(round(total / projects)) if projects else 0.0,
+            average_expense=from_ore(round(total / expenses)) if expenses else 0.0,
+            allocated_cost=from_ore(allocated),
+            unallocated_cost=from_ore(total - allocated),
+            invalid_allocation_count=invalid,
+            top_customers=_ranked((entity_id, name, -cost) for cost, entity_id, name in top_customers),
+            top_projects=_ranked((entity_id, name, -cost) for cost, entity_id, name in top_projects),
+        )
+
+    def memory_bytes(self) -> int:
+        """Rough footprint: the expense arrays plus the records and the dicts holding them"""
+        with self.lock:
+            records = sum(
+                sys.getsizeof(node) + sys.getsizeof(node.shares) + sys.getsizeof(node.parts)
+                for node in self.projects.values()
+            ) + sum(sys.getsizeof(node) + sys.getsizeof(node.project_ids) for node in self.customers.values())
+            return (
+                self.expense_project.itemsize * len(self.expense_project)
+                + self.expense_amount.itemsize * len(self.expense_amount)
+                + records
+                + sys.getsizeof(self.projects) + sys.getsizeof(self.customers) + sys.getsizeof(self.allocations)
+                + 64 * len(self.allocations)
+            )
+
+
+class ReadModel:
+    """The current graph and the change_log position it reflects"""
+
+    def __init__(self, max_staleness: float = READ_MODEL_MAX_STALENESS):
+        self.max_staleness = max_staleness
+        self.graph = None
+        self.position = (0, 0)
+        self.refreshed_at = 0.0  # time.monotonic() of the last successful refresh
+        self.disabled = False
+        self._refresh_lock = threading.Lock()
+        self.stats = {"loads": 0, "refreshes": 0, "changes_applied": 0}
+
+    def current(self):
+        """The graph if it is fresh enough to answer from, else None"""
+        if self.graph is None or self.disabled:
+            return None
+        if time.monotonic() - self.refreshed_at > self.max_staleness:
+            return None
+        return self.graph
+
+    def refresh(self, db: Session):
+        """Apply the changes since the last refresh, or load the graph if there is none yet"""
+        with self._refresh_lock:
+            if self.disabled:
+                return
+            dialect.begin_snapshot(db)
+            horizon = changelog.horizon(db)
+            try:
+                if self.graph is None:
+                    self._load(db, horizon)
+                else:
+                    self._catch_up(db, horizon)
+            except CapacityExceeded as e:
+                self.graph, self.disabled = None, True
+                print(f"Warning: Read model disabled, reads go to the database: {e}")
+                return
+            finally:
+                db.rollback()
+            self.refreshed_at = time.monotonic()
+
+    def _load(self, db: Session, horizon: int):
+        graph = CostGraph()
+        graph.load(db)
+        # Transactions from the horizon on may be in the load already; applying them again is harmless
+        self.graph, self.position = graph, (horizon, 0)
+        self.stats["loads"] += 1
+
+    def _catch_up(self, db: Session, horizon: int):
+        if horizon < self.position[0]:
+            # The log is behind what was applied, e.g. a database restored from a backup
+            self._load(db, horizon)
+            return
+        has_more = True
+        while has_more:
+            changed, position, has_more = changelog.changed_entities(db, self.position, horizon, CHANGES_PER_PAGE)
+            if ("all", 0) in changed:
+                # Everything before the reset was dropped; reload from this snapshot
+                self._load(db, horizon)
+                return
+            if changed:
+                self.graph.apply(db, changed)
+                self.stats["changes_applied"] += len(changed)
+            self.position = position
+        self.stats["refreshes"] += 1
+
+    def snapshot(self) -> dict:
+        graph = self.graph
+        age = time.monotonic() - self.refreshed_at if self.refreshed_at else None
+        return {
+            "enabled": READ_MODEL_ENABLED and not self.disabled,
+            "serving": self.current() is not None,
+            "position": changelog.format_token(*self.position),
+            "age_seconds": round(age, 3) if age is not None else None,
+            "customers": len(graph.customers) if graph else 0,
+            "projects": len(graph.projects) if graph else 0,
+            "allocations": len(graph.allocations) if graph else 0,
+            "expenses": graph.expense_count if graph else 0,
+            "memory_bytes": graph.memory_bytes() if graph else 0,
+            **self.stats,
+        }
+
+
+read_model = ReadModel()
+
+
+def serving(request) -> CostGraph:
+    """The graph to answer this request from, or None to query the database"""
+    if not READ_MODEL_ENABLED:
+        return None
+    if wants_read_your_writes(request):
+        return None
+    return read_model.current()
+
+
+def run_refresh(session_factory, interval: float = READ_MODEL_REFRESH_INTERVAL):
+    """Background loop: warm the model, then poll change_log every interval seconds"""
+    while not read_model.disabled:
+        db = session_factory()
+        try:
+            read_model.refresh(db)
+        except Exception as e:
+            print(f"Warning: Could not refresh read model: {e}")
+        finally:
+            db.close()
+        time.sleep(interval)
@@ -1,32 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 import crud
 import schemas
-from database import get_db
+from database import get_db, get_read_db, wants_read_your_writes
+from events import listener
+from expense_types import expense_type_cache
+from negotiation import NegotiatedResponse
+import admission
+import changelog
+import history
+import profiling
+import read_model
+from singleflight import SingleFlight
 
 router = APIRouter()
 
+# Concurrent identical expensive reads share one computation
+expensive_reads = SingleFlight()
+
+# Seconds a client may reuse /dashboard/summary before revalidating it
+DASHBOARD_MAX_AGE = int(os.getenv("DASHBOARD_MAX_AGE", "30"))
+
+
+def coalesce(request: Request, db: Session, key: tuple, fn):
+    """Run fn once for all concurrent requests with the same key on the same database"""
+    if wants_read_your_writes(request):
+        # A flight that started before this client's write would hand it stale data
+        return fn()
+    try:
+        return expensive_reads.do((str(db.get_bind().engine.url),) + key, fn)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out waiting for a shared computation")
+
 
 # ============ Customer Endpoints ============
 
 @router.post("/customers", response_model=schemas.CustomerResponse, tags=["Customers"])
 def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db)):
-    """Create a new customer"""
-    # Check if customer already exists
-    existing = db.query(crud.Customer).filter(crud.Customer.name == customer.name).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Customer with this name already exists")
+    """Create a new customer; 409 if the name is taken"""
     return crud.create_customer(db, customer)
 
 
-@router.get("/customers", response_model=list[schemas.CustomerResponse], tags=["Customers"])
-def get_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/customers", response_model=list[schemas.CustomerResponse],
+            response_class=NegotiatedResponse, tags=["Customers"])
+def get_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get all customers"""
     return crud.get_customers(db, skip=skip, limit=limit)
 
 
 @router.get("/customers/{customer_id}", response_model=schemas.CustomerResponse, tags=["Customers"])
-def get_customer(customer_id: int, db: Session = Depends(get_db)):
+def get_customer(customer_id: int, db: Session = Depends(get_read_db)):
     """Get customer by ID"""
     customer = crud.get_customer(db, customer_id)
     if not customer:
@@ -45,11 +74,11 @@ def update_customer(customer_id: int, customer: schemas.CustomerUpdate, db: Sess
 
 @router.delete("/customers/{customer_id}", tags=["Customers"])
 def delete_customer(customer_id: int, db: Session = Depends(get_db)):
-    """Delete a customer"""
-    db_customer = crud.delete_customer(db, customer_id)
-    if not db_customer:
+    """Delete a customer and, in the database, its project shares"""
+    removed = crud.delete_customer(db, customer_id)
+    if removed is None:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return {"status": "deleted", "customer_id": customer_id}
+    return {"status": "deleted", "customer_id": customer_id, "allocations_deleted": removed["allocations"]}
 
 
 # ============ Project Endpoints ============
@@ -60,14 +89,15 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)
     return crud.create_project(db, project)
 
 
-@router.get("/projects", response_model=list[schemas.ProjectResponse], tags=["Projects"])
-def get_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/projects", response_model=list[schemas.ProjectResponse],
+            response_class=NegotiatedResponse, tags=["Projects"])
+def get_projects(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get all projects"""
     return crud.get_projects(db, skip=skip, limit=limit)
 
 
 @router.get("/projects/{project_id}", response_model=schemas.ProjectResponse, tags=["Projects"])
-def get_project(project_id: int, db: Session = Depends(get_db)):
+def get_project(project_id: int, db: Session = Depends(get_read_db)):
     """Get project by ID"""
     project = crud.get_project(db, project_id)
     if not project:
@@ -86,11 +116,20 @@ def update_project(project_id: int, project: schemas.ProjectUpdate, db: Session
 
 @router.delete("/projects/{project_id}", tags=["Projects"])
 def delete_project(project_id: int, db: Session = Depends(get_db)):
-    """Delete a project"""
-    db_project = crud.delete_project(db, project_id)
-    if not db_project:
+    """Delete a project and, in the database, its expenses and customer shares"""
+    removed = crud.delete_project(db, project_id)
+    if removed is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    return {"status": "deleted", "project_id": project_id}
+    return {"status": "deleted", "project_id": project_id,
+            "expenses_deleted": removed["expenses"], "allocations_deleted": removed["allocations"]}
+
+
+@router.post("/projects/bulk-delete", tags=["Projects"])
+def bulk_delete_projects(request: schemas.BulkProjectDelete, db: Session = Depends(get_db)):
+    """Delete many projects in one statement; unknown ids are reported in not_found"""
+    removed = crud.delete_projects(db, request.project_ids)
+    return {"status": "deleted", "project_ids": removed["project_ids"], "not_found": removed["not_found"],
+            "expenses_deleted": removed["expenses"], "allocations_deleted": removed["allocations"]}
 
 
 # ============ Expense Endpoints ============
@@ -101,14 +140,15 @@ def create_expense(expense: schemas.ExpenseCreate, db: Session = Depends(get_db)
     return crud.create_expense(db, expense)
 
 
-@router.get("/expenses", response_model=list[schemas.ExpenseResponse], tags=["Expenses"])
-def get_expenses(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/expenses", response_model=list[schemas.ExpenseResponse],
+            response_class=NegotiatedResponse, tags=["Expenses"])
+def get_expenses(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Get all expenses"""
     return crud.get_expenses(db, skip=skip, limit=limit)
 
 
 @router.get("/expenses/{expense_id}", response_model=schemas.ExpenseResponse, tags=["Expenses"])
-def get_expense(expense_id: int, db: Session = Depends(get_db)):
+def get_expense(expense_id: int, db: Session = Depends(get_read_db)):
     """Get expense by ID"""
     expense = crud.get_expense(db, expense_id)
     if not expense:
@@ -116,8 +156,9 @@ def get_expense(expense_id: int, db: Session = Depends(get_db)):
     return expense
 
 
-@router.get("/projects/{project_id}/expenses", response_model=list[schemas.ExpenseResponse], tags=["Expenses"])
-def get_project_expenses(project_id: int, db: Session = Depends(get_db)):
+@router.get("/projects/{project_id}/expenses", response_model=list[schemas.ExpenseResponse],
+            response_class=NegotiatedResponse, tags=["Expenses"])
+def get_project_expenses(project_id: int, db: Session = Depends(get_read_db)):
     """Get all expenses for a project"""
     project = crud.get_project(db, project_id)
     if not project:
@@ -149,6 +190,13 @@ def bulk_create_expenses(request: schemas.BulkExpenseImport, db: Session = Depen
     return crud.bulk_create_expenses(db, request.expenses)
 
 
+@router.get("/expense-types", response_model=list[schemas.ExpenseTypeTotal],
+            response_class=NegotiatedResponse, tags=["Expenses"])
+def get_expense_type_totals(project_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    """Expense count and total per expense type, optionally for one project"""
+    return crud.get_expense_type_totals(db, project_id)
+
+
 # ============ Cost Sharing / Project Customer Endpoints ============
 
 @router.post("/projects/{project_id}/customers", response_model=schemas.ProjectCustomerResponse, 
@@ -165,8 +213,8 @@ def add_customer_to_project(
 
 
 @router.get("/projects/{project_id}/customers", response_model=list[schemas.ProjectCustomerResponse],
-            tags=["Cost Sharing"])
-def get_project_customers(project_id: int, db: Session = Depends(get_db)):
+            response_class=NegotiatedResponse, tags=["Cost Sharing"])
+def get_project_customers(project_id: int, db: Session = Depends(get_read_db)):
     """Get all customers assigned to a project"""
     project = crud.get_project(db, project_id)
     if not project:
@@ -176,7 +224,7 @@ def get_project_customers(project_id: int, db: Session = Depends(get_db)):
 
 @router.get("/projects/{project_id}/customers/{customer_id}", response_model=schemas.ProjectCustomerResponse,
             tags=["Cost Sharing"])
-def get_project_customer(project_id: int, customer_id: int, db: Session = Depends(get_db)):
+def get_project_customer(project_id: int, customer_id: int, db: Session = Depends(get_read_db)):
     """Get a specific customer in a project"""
     pc = crud.get_project_customer(db, project_id, customer_id)
     if not pc:
@@ -208,55 +256,114 @@ def remove_customer_from_project(project_id: int, customer_id: int, db: Session
     return {"status": "removed", "project_id": project_id, "customer_id": customer_id}
 
 
-@router.get("/projects/{project_id}/validation", tags=["Cost Sharing"])
-def validate_project_allocation(project_id: int, db: Session = Depends(get_db)):
+@router.get("/projects/{project_id}/validation", response_class=NegotiatedResponse, tags=["Cost Sharing"])
+def validate_project_allocation(project_id: int, request: Request, db: Session = Depends(get_read_db)):
     """Validate cost allocation for a project (should sum to 100%)"""
+    graph = read_model.serving(request)
+    if graph is not None:
+        return graph.validate_project_cost_allocation(project_id)
     project = crud.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     return crud.validate_project_cost_allocation(db, project_id)
 
 
+# ============ Dashboard Endpoints ============
+
+@router.get("/dashboard/summary", response_model=schemas.DashboardSummary,
+            response_class=NegotiatedResponse, tags=["Dashboard"])
+def get_dashboard_summary(request: Request, response: Response, db: Session = Depends(get_read_db)):
+    """Counts, totals and allocation health for the landing page; cacheable with ETag revalidation"""
+    graph = read_model.serving(request)
+    if graph is not None:
+        summary = graph.dashboard_summary()
+    else:
+        summary = coalesce(request, db, ("dashboard-summary",), lambda: crud.get_dashboard_summary(db))
+    # Weak: the compression middleware may change the bytes, not the content
+    etag = 'W/"%s"' % hashlib.sha256(summary.model_dump_json().encode()).hexdigest()[:32]
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={DASHBOARD_MAX_AGE}"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={**headers, "Vary": "Accept"})
+    response.headers.update(headers)
+    return summary
+
+
 # ============ Cost Overview Endpoints ============
 
 @router.get("/customers/{customer_id}/cost-overview", response_model=schemas.CustomerCostOverview,
-            tags=["Cost Overview"])
-def get_customer_cost_overview(customer_id: int, db: Session = Depends(get_db)):
-    """Get total costs for a customer across all their projects"""
-    return crud.get_customer_cost_overview(db, customer_id)
+            response_class=NegotiatedResponse, tags=["Cost Overview"])
+def get_customer_cost_overview(customer_id: int, request: Request, as_of: Optional[datetime] = None,
+                               db: Session = Depends(get_read_db)):
+    """Get total costs for a customer across all their projects, optionally as of a past time"""
+    graph = read_model.serving(request)
+    if graph is not None and as_of is None:
+        return graph.customer_cost_overview(customer_id)
+    return coalesce(request, db, ("customer-cost-overview", customer_id, as_of),
+                    lambda: crud.get_customer_cost_overview(db, customer_id, as_of))
 
 
 @router.get("/projects/{project_id}/cost-overview", response_model=schemas.ProjectCostOverview,
-            tags=["Cost Overview"])
-def get_project_cost_overview(project_id: int, db: Session = Depends(get_db)):
-    """Get cost breakdown by customer for a project"""
-    return crud.get_project_cost_overview(db, project_id)
+            response_class=NegotiatedResponse, tags=["Cost Overview"])
+def get_project_cost_overview(project_id: int, request: Request, as_of: Optional[datetime] = None,
+                              db: Session = Depends(get_read_db)):
+    """Get cost breakdown by customer for a project, optionally as of a past time"""
+    graph = read_model.serving(request)
+    if graph is not None and as_of is None:
+        return graph.project_cost_overview(project_id)
+    return coalesce(request, db, ("project-cost-overview", project_id, as_of),
+                    lambda: crud.get_project_cost_overview(db, project_id, as_of))
+
+
+@router.post("/scenarios/evaluate", response_model=schemas.ScenarioComparison,
+             response_class=NegotiatedResponse, tags=["Cost Overview"])
+def evaluate_scenarios(request: schemas.ScenarioRequest, db: Session = Depends(get_read_db)):
+    """Compare hypothetical allocation changes against the current split; writes nothing"""
+    return crud.evaluate_scenarios(db, request)
+
+
+@router.get("/leaderboards/projects", response_model=list[schemas.LeaderboardEntry],
+            response_class=NegotiatedResponse, tags=["Cost Overview"])
+def get_top_projects(limit: int = Query(10, ge=1, le=schemas.MAX_LEADERBOARD_SIZE),
+                     customer_id: Optional[int] = None, expense_type: Optional[str] = None,
+                     db: Session = Depends(get_read_db)):
+    """Most expensive projects overall, by one customer's allocated cost, or by one expense type"""
+    return crud.get_top_projects(db, limit, customer_id=customer_id, expense_type=expense_type)
+
+
+@router.get("/leaderboards/customers", response_model=list[schemas.LeaderboardEntry],
+            response_class=NegotiatedResponse, tags=["Cost Overview"])
+def get_top_customers(limit: int = Query(10, ge=1, le=schemas.MAX_LEADERBOARD_SIZE),
+                      db: Session = Depends(get_read_db)):
+    """Customers with the highest allocated cost"""
+    return crud.get_top_customers(db, limit)
 
 
 # ============ Comprehensive Data Endpoints ============
 
-@router.get("/projects/{project_id}/full", tags=["Data Export"])
-def get_project_full_data(project_id: int, db: Session = Depends(get_db)):
-    """Get complete project data including expenses, customers, and cost overview"""
-    project = crud.get_project(db, project_id)
-    if not project:
+@router.get("/projects/{project_id}/full", response_class=NegotiatedResponse, tags=["Data Export"])
+def get_project_full_data(project_id: int, request: Request, include: Optional[str] = None,
+                          fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """
+    Get project data with selected relations and fields.
+
+    include: comma-separated subset of expenses, customers, cost_overview (default: all)
+    fields: comma-separated section.field entries, e.g. project.name,expenses.amount (default: all fields)
+    """
+    includes, selected_fields = crud.parse_project_detail_params(include, fields)
+    detail = coalesce(request, db, ("project-full", project_id, include, fields),
+                      lambda: crud.get_project_detail(db, project_id, includes, selected_fields))
+    if detail is None:
         raise HTTPException(status_code=404, detail="Project not found")
-    
-    expenses = crud.get_expenses_by_project(db, project_id)
-    customers = crud.get_project_customers(db, project_id)
-    cost_overview = crud.get_project_cost_overview(db, project_id)
-    
-    return {
-        "project": project,
-        "expenses": expenses,
-        "customers": customers,
-        "cost_overview": cost_overview
-    }
+    return detail
 
 
-@router.get("/all-data", tags=["Data Export"])
-def get_all_data(db: Session = Depends(get_db)):
+@router.get("/all-data", response_class=NegotiatedResponse, tags=["Data Export"])
+def get_all_data(request: Request, db: Session = Depends(get_read_db)):
     """Get all customers, projects, expenses, and cost overviews"""
+    return coalesce(request, db, ("all-data",), lambda: _build_all_data(db))
+
+
+def _build_all_data(db: Session):
     customers = crud.get_customers(db, skip=0, limit=1000)
     projects = crud.get_projects(db, skip=0, limit=1000)
     expenses = crud.get_expenses(db, skip=0, limit=10000)
@@ -280,45 +387,86 @@ def get_all_data(db: Session = Depends(get_db)):
             pass
     
     return {
-        "customers": customers,
-        "projects": projects,
-        "expenses": expenses,
+        "customers": [schemas.CustomerResponse.model_validate(c) for c in customers],
+        "projects": [schemas.ProjectResponse.model_validate(p) for p in projects],
+        "expenses": [schemas.ExpenseResponse.model_validate(e) for e in expenses],
         "customer_cost_overviews": customer_overviews,
         "project_cost_overviews": project_overviews
     }
 
 
+# ============ Live Change Feed ============
+
+@router.get("/events", tags=["Events"])
+async def stream_changes(request: Request, last_event_id: Optional[str] = None):
+    """
+    Server-Sent Events stream of change deltas with updated project/customer totals.
+
+    A reconnecting client sends the id of the last event it saw (the
+    Last-Event-ID header, or last_event_id for a new EventSource) and gets
+    the deltas it missed, or a resync event if they are gone.
+    """
+    queue = listener.subscribe(request.headers.get("last-event-id") or last_event_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event_id, payload = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: change\ndata: {payload}\n\n"
+        finally:
+            listener.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/changes", response_model=schemas.ChangeFeed, response_class=NegotiatedResponse, tags=["Events"])
+def get_changes(since: Optional[str] = None,
+                limit: int = Query(1000, ge=1, le=schemas.MAX_CHANGES_PAGE),
+                db: Session = Depends(get_read_db)):
+    """Customers, projects, expenses and allocations changed after the since token (omit it to start over)"""
+    return changelog.read_changes(db, since, limit)
+
+
 # ============ System / Admin Endpoints ============
 
 @router.post("/admin/reset-db", tags=["Admin"])
 def reset_database(db: Session = Depends(get_db)):
     """Reset database to initial state and reseed from dataset.csv"""
     from models import Base
-    from database import engine
-    from seed import seed_expenses_from_csv, seed_default_customers, seed_default_project_allocations
-    from sqlalchemy import text
+    from seed import seed_expenses_from_csv, seed_default_customers, seed_default_project_allocations, reset_sequences
     
     try:
-        # Delete all tables
-        Base.metadata.drop_all(bind=engine)
-        
-        # Recreate all tables
-        Base.metadata.create_all(bind=engine)
+        # The feed continues after the dropped log; end this read before the tables go
+        last_txid = changelog.last_txid(db)
+        db.commit()
+
+        # Drop and recreate the tables of the database this session is bound to
+        bind = db.get_bind()
+        Base.metadata.drop_all(bind=bind)
+        Base.metadata.create_all(bind=bind)
+        expense_type_cache.clear()
+        changelog.record_reset(db, last_txid)
         
         # Reseed data
         seed_default_customers(db)
         seed_expenses_from_csv(db)
         seed_default_project_allocations(db)
         
-        # Reset sequences
-        try:
-            db.execute(text("SELECT setval('projects_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM projects))"))
-            db.execute(text("SELECT setval('customers_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM customers))"))
-            db.execute(text("SELECT setval('expenses_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM expenses))"))
-            db.execute(text("SELECT setval('project_customers_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM project_customers))"))
-            db.commit()
-        except Exception as seq_err:
-            print(f"Warning: Could not reset sequences: {seq_err}")
+        # Reset sequences (PostgreSQL only)
+        reset_sequences(db)
+
+        # History was dropped with the tables: start it again from the reseeded data
+        history.take_snapshot(db)
         
         return {
             "status": "success",
@@ -329,3 +477,30 @@ def reset_database(db: Session = Depends(get_db)):
             "status": "error",
             "message": str(e)
         }
+
+
+def require_admin_token(x_profile_token: Optional[str] = Header(None)):
+    """Admin diagnostics need the admin token (PROFILE_TOKEN) in X-Profile-Token"""
+    if not profiling.is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+@router.get("/admin/admission", tags=["Admin"], dependencies=[Depends(require_admin_token)])
+def get_admission_stats():
+    """Concurrency lanes: limits, occupancy, rejections and queue-time percentiles"""
+    return admission.snapshot()
+
+
+@router.get("/admin/read-model", tags=["Admin"], dependencies=[Depends(require_admin_token)])
+def get_read_model_stats():
+    """In-memory cost graph: whether it is serving, its change_log position, size and refresh counters"""
+    return read_model.read_model.snapshot()
+
+
+@router.get("/admin/profiles/{profile_id}", tags=["Admin"], dependencies=[Depends(require_admin_token)])
+def get_profile(profile_id: str):
+    """Download a stored request profile (speedscope JSON); needs the profile token"""
+    path = profiling.profile_path(profile_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=os.path.basename(path))
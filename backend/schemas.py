@@ -1,6 +1,17 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, validator, model_validator
 from typing import Optional, List
 from datetime import datetime
+import hashlib
+from sqlalchemy.orm import object_session
+from expense_types import expense_type_cache
+from money import to_ore, from_ore, to_basis_points, from_basis_points
+
+
+def _from_storage(model_cls, obj, **converted) -> dict:
+    """Read an ORM row into a dict, replacing storage-unit columns with API values"""
+    data = {name: getattr(obj, name, None) for name in model_cls.model_fields}
+    data.update(converted)
+    return data
 
 
 # Customer Schemas
@@ -57,16 +68,69 @@ class ExpenseBase(BaseModel):
     amount: float = Field(..., gt=0)
     description: Optional[str] = None
 
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v is not None and to_ore(v) < 1:
+            raise ValueError('Amount must be at least 0.01')
+        return v
+
 
 class ExpenseCreate(ExpenseBase):
     project_id: int
 
+    @property
+    def amount_ore(self) -> int:
+        return to_ore(self.amount)
+
+
+class ExpenseImportRow(ExpenseCreate):
+    """Expense from an external export; source_key is the row ID in that export"""
+    source_key: Optional[str] = Field(None, max_length=64)
+
+    @validator('source_key', pre=True)
+    def normalize_source_key(cls, v):
+        if v is None:
+            return None
+        v = str(v).strip()
+        return v or None
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash used to tell changed rows from unchanged ones"""
+        content = f"{self.project_id}|{self.expense_type}|{self.amount_ore}|{self.description or ''}"
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def import_key(self, occurrence: int = 1) -> str:
+        """
+        Rows without a source ID are keyed by their content. Identical keyless
+        rows are separate expenses, so the nth copy in an export (occurrence n)
+        gets a key of its own.
+        """
+        if self.source_key:
+            return self.source_key
+        if occurrence == 1:
+            return self.fingerprint
+        return hashlib.sha256(f"{self.fingerprint}#{occurrence}".encode('utf-8')).hexdigest()
+
 
 class ExpenseUpdate(BaseModel):
     expense_type: Optional[str] = Field(None, min_length=1, max_length=255)
     amount: Optional[float] = Field(None, gt=0)
     description: Optional[str] = None
 
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v is not None and to_ore(v) < 1:
+            raise ValueError('Amount must be at least 0.01')
+        return v
+
+    def column_values(self) -> dict:
+        """Fields that were set, keyed by model column (amount in øre)"""
+        values = self.model_dump(exclude_unset=True)
+        if 'amount' in values:
+            values['amount_ore'] = to_ore(values.pop('amount'))
+        return values
+
 
 class ExpenseResponse(ExpenseBase):
     id: int
@@ -77,8 +141,34 @@ class ExpenseResponse(ExpenseBase):
     class Config:
         from_attributes = True
 
+    @model_validator(mode='before')
+    @classmethod
+    def from_orm_units(cls, data):
+        if hasattr(data, 'amount_ore'):
+            return _from_storage(
+                cls, data, amount=from_ore(data.amount_ore),
+                expense_type=expense_type_cache.name_for(data.expense_type_id, object_session(data)),
+            )
+        return data
+
+
+class ExpenseTypeTotal(BaseModel):
+    expense_type_id: int
+    expense_type: str
+    expense_count: int
+    total_expenses: float
+
 
 # ProjectCustomer (Cost Sharing) Schemas
+def _validate_cost_percentage(v: float) -> float:
+    """A share must be stored as at least 1 basis point after rounding"""
+    if v <= 0 or v > 100:
+        raise ValueError('Cost percentage must be greater than 0 and at most 100')
+    if to_basis_points(v) < 1:
+        raise ValueError('Cost percentage must be at least 0.01')
+    return v
+
+
 class ProjectCustomerBase(BaseModel):
     project_id: int
     customer_id: int
@@ -86,13 +176,14 @@ class ProjectCustomerBase(BaseModel):
 
     @validator('cost_percentage')
     def validate_percentage(cls, v):
-        if v <= 0 or v > 100:
-            raise ValueError('Cost percentage must be greater than 0 and at most 100')
-        return v
+        return _validate_cost_percentage(v)
 
 
 class ProjectCustomerCreate(ProjectCustomerBase):
-    pass
+
+    @property
+    def cost_basis_points(self) -> int:
+        return to_basis_points(self.cost_percentage)
 
 
 class ProjectCustomerUpdate(BaseModel):
@@ -100,9 +191,11 @@ class ProjectCustomerUpdate(BaseModel):
 
     @validator('cost_percentage')
     def validate_percentage(cls, v):
-        if v <= 0 or v > 100:
-            raise ValueError('Cost percentage must be greater than 0 and at most 100')
-        return v
+        return _validate_cost_percentage(v)
+
+    @property
+    def cost_basis_points(self) -> int:
+        return to_basis_points(self.cost_percentage)
 
 
 class ProjectCustomerResponse(ProjectCustomerBase):
@@ -113,6 +206,13 @@ class ProjectCustomerResponse(ProjectCustomerBase):
     class Config:
         from_attributes = True
 
+    @model_validator(mode='before')
+    @classmethod
+    def from_orm_units(cls, data):
+        if hasattr(data, 'cost_basis_points'):
+            return _from_storage(cls, data, cost_percentage=from_basis_points(data.cost_basis_points))
+        return data
+
 
 # Cost Overview Schemas
 class CustomerCostDetail(BaseModel):
@@ -144,6 +244,110 @@ class ProjectCostOverview(BaseModel):
     customers: List[ProjectCostDetail]
 
 
+# Leaderboard Schemas
+MAX_LEADERBOARD_SIZE = 100
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    id: int
+    name: str
+    total_cost: float
+
+
+# Dashboard Schemas
+DASHBOARD_TOP_SIZE = 5
+
+
+class DashboardSummary(BaseModel):
+    customer_count: int
+    project_count: int
+    expense_count: int
+    total_expenses: float
+    average_project_expenses: float
+    average_expense: float
+    allocated_cost: float
+    unallocated_cost: float
+    invalid_allocation_count: int  # projects whose shares do not add up to exactly 100%
+    top_customers: List[LeaderboardEntry]  # the first DASHBOARD_TOP_SIZE of each leaderboard
+    top_projects: List[LeaderboardEntry]
+
+
+# Change Feed Schemas
+MAX_CHANGES_PAGE = 5000
+
+
+class ChangeEntry(BaseModel):
+    entity: str  # customer | project | expense | allocation | all
+    id: int
+    action: str  # upsert (data is the current row) | delete | reset
+    data: Optional[dict] = None
+
+
+class ChangeFeed(BaseModel):
+    changes: List[ChangeEntry]
+    next: str  # token for the next request
+    has_more: bool
+
+
+# What-if Scenario Schemas
+MAX_SCENARIOS = 100
+MAX_SCENARIO_CHANGES = 1000
+
+
+class AllocationChange(BaseModel):
+    """Hypothetical allocation: sets (adds or updates) a share, or removes it with cost_percentage 0"""
+    project_id: int
+    customer_id: int
+    cost_percentage: float = Field(..., ge=0, le=100)
+
+    @property
+    def cost_basis_points(self) -> int:
+        return to_basis_points(self.cost_percentage)
+
+
+class Scenario(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255)
+    changes: List[AllocationChange] = Field(..., max_length=MAX_SCENARIO_CHANGES)
+
+
+class ScenarioRequest(BaseModel):
+    scenarios: List[Scenario] = Field(..., min_length=1, max_length=MAX_SCENARIOS)
+
+
+class ScenarioProjectResult(ProjectCostOverview):
+    total_percentage: float
+    is_valid: bool  # allocations sum to exactly 100% (or the project has none)
+
+
+class ScenarioCustomerResult(BaseModel):
+    customer_id: int
+    customer_name: str
+    baseline_cost: float
+    total_cost: float
+    delta: float
+
+
+class ScenarioResult(BaseModel):
+    name: str
+    is_valid: bool  # every affected project is fully allocated and none exceeds 100%
+    errors: List[str]
+    projects: List[ScenarioProjectResult]
+    customers: List[ScenarioCustomerResult]
+
+
+class ScenarioComparison(BaseModel):
+    baseline: List[ScenarioProjectResult]
+    scenarios: List[ScenarioResult]
+
+
 # Bulk Import Schema
 class BulkExpenseImport(BaseModel):
     expenses: List[ExpenseCreate]
+
+
+MAX_BULK_DELETE = 500
+
+
+class BulkProjectDelete(BaseModel):
+    project_ids: List[int] = Field(..., min_length=1, max_length=MAX_BULK_DELETE)
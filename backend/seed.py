@@ -5,6 +5,11 @@ from sqlalchemy import text
 from models import Project, Expense, Customer, ProjectCustomer
 from database import SessionLocal, engine
 from models import Base
+from money import to_basis_points
+from schemas import ExpenseImportRow
+import crud
+import dialect
+import history
 
 
 def seed_default_customers(db: Session):
@@ -27,7 +32,7 @@ def seed_default_customers(db: Session):
     
     # Reset customer sequence
     try:
-        db.execute(text("SELECT setval('customers_id_seq', (SELECT MAX(id) FROM customers) + 1)"))
+        dialect.reset_sequences(db, ["customers"])
         db.commit()
     except Exception as seq_err:
         print(f"Warning: Could not reset customer sequence: {seq_err}")
@@ -38,9 +43,8 @@ def seed_default_customers(db: Session):
 def seed_expenses_from_csv(db: Session):
     """Load and seed expenses from dataset.csv"""
     
-    # Check if expenses already exist to avoid duplicate imports
-    existing_expenses = db.query(Expense).first()
-    if existing_expenses:
+    # Rows seeded before imports were keyed cannot be matched; leave them alone
+    if db.query(Expense).first() and not db.query(Expense).filter(Expense.source_key.isnot(None)).first():
         print("Database already seeded with expenses. Skipping import.")
         return
     
@@ -85,7 +89,8 @@ def seed_expenses_from_csv(db: Session):
                             db.flush()
                         projects_seen.add(project_id)
 
-                    expense = Expense(
+                    expense = ExpenseImportRow(
+                        source_key=row.get('ID'),
                         project_id=project_id,
                         expense_type=row['ExpenseType'],
                         amount=float(row['Amount']),
@@ -97,16 +102,19 @@ def seed_expenses_from_csv(db: Session):
                     print(f"Warning: CSV at {csv_file} has no data rows. Trying next path...")
                     continue
 
-                db.add_all(expenses)
-                db.commit()
+                # Idempotent: re-running only writes rows that are new or changed
+                summary = crud.import_expenses(db, expenses)
 
                 try:
-                    db.execute(text("SELECT setval('projects_id_seq', (SELECT MAX(id) FROM projects) + 1)"))
+                    dialect.reset_sequences(db, ["projects"])
                     db.commit()
                 except Exception as seq_err:
                     print(f"Warning: Could not reset sequence: {seq_err}")
 
-                print(f"Successfully imported {len(expenses)} expenses and {len(projects_seen)} projects")
+                print(
+                    f"Successfully imported {summary['new']} new and {summary['changed']} changed expenses "
+                    f"({summary['unchanged']} unchanged) across {len(projects_seen)} projects"
+                )
                 imported = True
                 break
 
@@ -148,7 +156,7 @@ def seed_default_project_allocations(db: Session):
                 ProjectCustomer(
                     project_id=project.id,
                     customer_id=customers[customer_idx].id,
-                    cost_percentage=percentage,
+                    cost_basis_points=to_basis_points(percentage),
                 )
             )
 
@@ -157,33 +165,77 @@ def seed_default_project_allocations(db: Session):
     print(f"Successfully created {len(allocations_to_add)} project-customer allocations")
 
 
-def init_db():
-    """Initialize database and seed with data"""
+SEED_LOCK_KEY = 727_001  # pg advisory lock key shared by every worker
+
+
+def reset_sequences(db: Session):
+    """Move id sequences past seeded rows so auto-increment does not collide"""
     try:
-        # Create all tables
+        dialect.reset_sequences(db)
+        db.commit()
+    except Exception as seq_err:
+        db.rollback()
+        print(f"Warning: Could not reset sequences: {seq_err}")
+
+
+def seed_database(create_schema: bool = True):
+    """Create schema (unless Alembic owns it) and seed demo data"""
+    if create_schema:
         Base.metadata.create_all(bind=engine)
-        
-        # Seed data
-        db = SessionLocal()
+
+    db = SessionLocal()
+    try:
+        seed_default_customers(db)
+        seed_expenses_from_csv(db)
+        seed_default_project_allocations(db)
+
+        # After seeding, reset all sequences to ensure auto-increment works correctly
+        reset_sequences(db)
+
+        # Baseline for point-in-time cost queries (no-op once snapshots exist)
+        history.take_snapshot(db)
+    finally:
+        db.close()
+
+
+def seed_as_leader(create_schema: bool = True) -> bool:
+    """
+    Seed once across all workers.
+
+    The first worker to take the session-level advisory lock seeds; every
+    other worker returns immediately instead of racing on the same inserts.
+    Returns True if this process did the seeding.
+    """
+    if not dialect.is_postgres(engine):
+        seed_database(create_schema)
+        return True
+
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SEED_LOCK_KEY}).scalar()
+        conn.commit()
+        if not acquired:
+            print("Another worker is seeding the database. Skipping.")
+            return False
         try:
-            seed_default_customers(db)
-            seed_expenses_from_csv(db)
-            seed_default_project_allocations(db)
-            
-            # After seeding, reset all sequences to ensure auto-increment works correctly
-            try:
-                db.execute(text("SELECT setval('projects_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM projects))"))
-                db.execute(text("SELECT setval('customers_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM customers))"))
-                db.execute(text("SELECT setval('expenses_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM expenses))"))
-                db.execute(text("SELECT setval('project_customers_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM project_customers))"))
-                db.commit()
-            except Exception as seq_err:
-                print(f"Warning: Could not reset sequences: {seq_err}")
+            seed_database(create_schema)
         finally:
-            db.close()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SEED_LOCK_KEY})
+            conn.commit()
+    return True
+
+
+def init_db(create_schema: bool = True):
+    """Initialize database and seed with data"""
+    try:
+        seed_as_leader(create_schema)
     except Exception as e:
         print(f"Warning: Could not initialize database: {e}")
         print("Make sure PostgreSQL is running and DATABASE_URL is correct.")
         print("For local development without Docker, you can:")
         print("  1. Start PostgreSQL: docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=password postgres:16-alpine")
         print("  2. Or use Docker Compose: docker-compose up")
+
+
+if __name__ == "__main__":
+    # Run after `alembic upgrade head`, e.g. from the docker-compose migrate service
+    init_db(create_schema=False)
@@ -0,0 +1,73 @@
+"""Request coalescing: concurrent callers with the same key share one computation.
+
+The first caller for a key (the leader) runs the function; callers that
+arrive while it is still running wait for the same result or exception
+instead of recomputing it. Nothing is cached: the key is forgotten as soon
+as the call finishes, so the next request computes fresh data.
+
+Used from sync route handlers in the threadpool. A waiter that times out
+only stops waiting: the computation still finishes for everyone else.
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "30"))
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key"""
+
+    def __init__(self, timeout: float = SINGLEFLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"leaders": 0, "shared": 0, "timeouts": 0}
+
+    def _join(self, key):
+        """Return (future, is_leader) for key, registering a new flight if none is running"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.stats["leaders"] += 1
+            return future, True
+
+    def _forget(self, key, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def _complete(self, key, future: Future, fn):
+        """Run fn and publish its outcome; never raises"""
+        try:
+            result = fn()
+        except Exception as e:
+            self._forget(key, future)
+            future.set_exception(e)
+        else:
+            self._forget(key, future)
+            future.set_result(result)
+
+    def _timed_out(self, key, future: Future, timeout: float):
+        # Let the next caller start a fresh flight instead of queueing behind a stuck one
+        self._forget(key, future)
+        with self._lock:
+            self.stats["timeouts"] += 1
+        return TimeoutError(f"Shared computation for {key!r} did not finish within {timeout}s")
+
+    def do(self, key, fn, timeout: float = None):
+        """Blocking: run fn() once for all concurrent callers with this key"""
+        timeout = self.timeout if timeout is None else timeout
+        future, leader = self._join(key)
+        if leader:
+            self._complete(key, future, fn)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.done():  # fn itself raised TimeoutError
+                raise
+            raise self._timed_out(key, future, timeout) from None
@@ -0,0 +1,194 @@
+"""Test support: the whole API on in-memory SQLite, one rolled-back transaction per test.
+
+Enable the fixtures from a conftest.py next to the tests:
+
+    pytest_plugins = ["testing"]
+
+    def test_add_allocation(client):
+        assert client.post("/customers", json={"name": "Test kommune"}).status_code == 200
+
+Fixtures:
+    engine     in-memory SQLite with the schema, shared by the test session
+    db         Session inside a transaction that is rolled back after the test;
+               commits in crud.py only release a SAVEPOINT
+    client     TestClient for main.app with get_db / get_read_db bound to db
+    pg_engine  PostgreSQL engine from POSTGRES_TEST_URL
+    pg_database  URL of a new, empty database on that server, dropped after the test;
+               migrate(url) runs the Alembic migrations into it (downgrade=True back)
+    pg_migrated  engine on a database migrated to head, shared by the test session
+    pg_db, pg_client  db and client on pg_migrated, rolled back like their SQLite twins
+
+Tests that need PostgreSQL itself (partitions, triggers, LISTEN/NOTIFY,
+advisory locks across connections) are marked @pytest.mark.postgres and are
+skipped unless POSTGRES_TEST_URL is set.
+"""
+import os
+import uuid
+from contextlib import contextmanager
+
+# Before the app modules read them: no PostgreSQL partitioning, no seeding on startup
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("INIT_DB_ON_START", "false")
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from expense_types import expense_type_cache
+from models import Base
+
+POSTGRES_TEST_URL = os.getenv("POSTGRES_TEST_URL")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_test_engine(url: str = "sqlite://"):
+    """In-memory SQLite engine with the schema created; one connection shared across threads"""
+    engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+    # Let SQLAlchemy issue BEGIN itself so SAVEPOINTs work with pysqlite
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@contextmanager
+def rolled_back_session(engine):
+    """Session whose commits end in a SAVEPOINT of an outer transaction that is always rolled back"""
+    connection = engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+@contextmanager
+def api_client(session: Session):
+    """TestClient whose database dependencies all use session"""
+    from fastapi.testclient import TestClient
+
+    from database import get_db, get_read_db
+    from main import app
+
+    def override():
+        yield session
+
+    app.dependency_overrides[get_db] = override
+    app.dependency_overrides[get_read_db] = override
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_read_db, None)
+
+
+@contextmanager
+def scratch_database(server_engine):
+    """URL of a new, empty UTF8 database on server_engine's server, dropped afterwards"""
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    server = server_engine.execution_options(isolation_level="AUTOCOMMIT")
+    with server.connect() as connection:
+        connection.execute(text(f"CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0"))
+    try:
+        yield server_engine.url.set(database=name).render_as_string(hide_password=False)
+    finally:
+        with server.connect() as connection:
+            connection.execute(text(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)"))
+
+
+def migrate(url: str, revision: str = "head", downgrade: bool = False):
+    """Upgrade (or downgrade) the database at url with the Alembic migrations, as the migrate service does"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    # alembic/env.py prefers DATABASE_URL over the ini file
+    previous = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = url
+    try:
+        (command.downgrade if downgrade else command.upgrade)(config, revision)
+    finally:
+        if previous is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = previous
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    def pytest_configure(config):
+        config.addinivalue_line("markers", "postgres: needs a PostgreSQL database (POSTGRES_TEST_URL)")
+
+    def pytest_collection_modifyitems(config, items):
+        if POSTGRES_TEST_URL:
+            return
+        skip = pytest.mark.skip(reason="POSTGRES_TEST_URL not set")
+        for item in items:
+            if "postgres" in item.keywords:
+                item.add_marker(skip)
+
+    @pytest.fixture(scope="session")
+    def engine():
+        engine = create_test_engine()
+        yield engine
+        engine.dispose()
+
+    @pytest.fixture
+    def db(engine):
+        with rolled_back_session(engine) as session:
+            yield session
+        # Expense type ids created in the test were rolled back with it
+        expense_type_cache.clear()
+
+    @pytest.fixture
+    def client(db):
+        with api_client(db) as client:
+            yield client
+
+    @pytest.fixture(scope="session")
+    def pg_engine():
+        if not POSTGRES_TEST_URL:
+            pytest.skip("POSTGRES_TEST_URL not set")
+        engine = create_engine(POSTGRES_TEST_URL)
+        yield engine
+        engine.dispose()
+
+    @pytest.fixture
+    def pg_database(pg_engine):
+        with scratch_database(pg_engine) as url:
+            yield url
+
+    @pytest.fixture(scope="session")
+    def pg_migrated(pg_engine):
+        with scratch_database(pg_engine) as url:
+            migrate(url)
+            engine = create_engine(url)
+            yield engine
+            engine.dispose()
+
+    @pytest.fixture
+    def pg_db(pg_migrated):
+        with rolled_back_session(pg_migrated) as session:
+            yield session
+        expense_type_cache.clear()
+
+    @pytest.fixture
+    def pg_client(pg_db):
+        with api_client(pg_db) as client:
+            yield client
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import AdmissionMiddleware, Lane, lane_for
+
+
+@pytest.mark.parametrize("method, path, lane", [
+    ("GET", "/customers", "cheap"),
+    ("POST", "/expenses", "cheap"),
+    ("GET", "/all-data", "heavy"),
+    ("GET", "/projects/7/cost-overview", "heavy"),
+    ("POST", "/import/expenses-csv", "import"),
+    ("POST", "/projects/bulk-delete", "import"),
+    ("POST", "/admin/reset-db", "admin"),
+    ("GET", "/health", None),
+    ("GET", "/events", None),
+])
+def test_lane_for(method, path, lane):
+    assert lane_for(method, path) == lane
+
+
+# ============ Lane ============
+
+def test_a_saturated_lane_queues_then_rejects():
+    lane = Lane("heavy", concurrency=1, queue_size=1)
+
+    async def scenario():
+        assert await lane.acquire(1) == 0.0
+        queued = asyncio.create_task(lane.acquire(1))
+        await asyncio.sleep(0.01)
+        # The slot is taken and the one queue place too
+        assert await lane.acquire(1) is None
+        lane.release(0.5)
+        return await queued
+
+    assert asyncio.run(scenario()) >= 0.01
+    assert lane.snapshot()["active"] == 1
+    assert {k: lane.stats[k] for k in ("admitted", "queued", "rejected", "timed_out")} == {
+        "admitted": 2, "queued": 1, "rejected": 1, "timed_out": 0,
+    }
+    lane.release(0.5)
+    assert (lane.snapshot()["active"], lane.snapshot()["waiting"]) == (0, 0)
+
+
+def test_a_waiter_gives_up_after_the_timeout():
+    lane = Lane("import", concurrency=1, queue_size=4)
+
+    async def scenario():
+        await lane.acquire(1)
+        return await lane.acquire(0.01)
+
+    assert asyncio.run(scenario()) is None
+    assert (lane.stats["timed_out"], lane.snapshot()["waiting"]) == (1, 0)
+    # Its place is not handed a slot on release
+    lane.release(0.1)
+    assert lane.snapshot()["active"] == 0
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    lane = Lane("heavy", concurrency=1, queue_size=3)
+    order = []
+
+    async def request(number):
+        await lane.acquire(1)
+        order.append(number)
+        await asyncio.sleep(0.001)
+        lane.release(0.001)
+
+    async def scenario():
+        await lane.acquire(1)
+        tasks = []
+        for number in range(3):
+            tasks.append(asyncio.create_task(request(number)))
+            await asyncio.sleep(0.001)
+        lane.release(0.001)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == [0, 1, 2]
+
+
+def test_concurrency_zero_is_unlimited():
+    lane = Lane("cheap", concurrency=0, queue_size=0)
+
+    async def scenario():
+        return [await lane.acquire(1) for _ in range(100)]
+
+    assert asyncio.run(scenario()) == [0.0] * 100
+
+
+def test_retry_after_follows_the_service_time():
+    lane = Lane("heavy", concurrency=2, queue_size=8)
+    assert lane.retry_after() == 1
+    asyncio.run(lane.acquire(1))
+    lane.release(3.0)
+    # One waiter-to-be over two slots, three seconds each
+    assert lane.retry_after() == 2
+
+
+# ============ Middleware ============
+
+def run_requests(middleware, paths):
+    """(status, headers) per path, all sent at once to middleware"""
+    async def request(path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware({"type": "http", "method": "GET", "path": path, "headers": []}, None, send)
+        return messages[0]["status"], {k.decode().lower(): v.decode() for k, v in messages[0]["headers"]}
+
+    async def scenario():
+        return await asyncio.gather(*(request(path) for path in paths))
+
+    return asyncio.run(scenario())
+
+
+async def slow_app(scope, receive, send):
+    await asyncio.sleep(0.05)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_middleware_answers_429_with_retry_after_when_the_lane_is_full():
+    lanes = {"heavy": Lane("heavy", 1, 1), "cheap": Lane("cheap", 1, 0)}
+    middleware = AdmissionMiddleware(slow_app, lanes=lanes, queue_timeout=5, enabled=True)
+
+    responses = run_requests(middleware, ["/all-data"] * 3 + ["/customers"])
+    statuses = [status for status, _ in responses]
+    assert statuses == [200, 200, 429, 200]
+
+    first, queued, rejected, cheap = (headers for _, headers in responses)
+    assert first["server-timing"] == 'queue;dur=0.0;desc="heavy"'
+    assert float(queued["server-timing"].split("dur=")[1].split(";")[0]) >= 40
+    assert int(rejected["retry-after"]) >= 1
+    assert "server-timing" not in rejected
+    # The other lane is not held up by the heavy one
+    assert cheap["server-timing"] == 'queue;dur=0.0;desc="cheap"'
+    assert lanes["heavy"].snapshot()["active"] == 0
+
+
+def test_queue_timeout_is_a_429():
+    middleware = AdmissionMiddleware(slow_app, lanes={"heavy": Lane("heavy", 1, 4)}, queue_timeout=0.01, enabled=True)
+    assert [status for status, _ in run_requests(middleware, ["/all-data"] * 2)] == [200, 429]
+
+
+def test_app_requests_carry_the_queue_time(client):
+    assert client.get("/customers").headers["server-timing"].startswith('queue;dur=')
+    assert "server-timing" not in client.get("/health").headers
+
+
+def test_app_rejects_when_its_lane_is_saturated(client, monkeypatch):
+    lane = Lane("heavy", concurrency=1, queue_size=0)
+    monkeypatch.setitem(admission.default_lanes, "heavy", lane)
+    asyncio.run(lane.acquire(1))
+
+    response = client.get("/all-data")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/customers").status_code == 200
+
+    lane.release(0.0)
+    assert client.get("/all-data").status_code == 200
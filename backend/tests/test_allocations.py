@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def project(client):
+    customers = [client.post("/customers", json={"name": name}).json()["id"] for name in ("Oslo", "Bergen")]
+    project_id = client.post("/projects", json={"name": "Felles"}).json()["id"]
+    return project_id, customers
+
+
+def allocate(client, project_id, customer_id, percentage):
+    return client.post(
+        f"/projects/{project_id}/customers",
+        json={"project_id": project_id, "customer_id": customer_id, "cost_percentage": percentage},
+    )
+
+
+def test_allocations_may_not_exceed_100(client, project):
+    project_id, (oslo, bergen) = project
+    assert allocate(client, project_id, oslo, 60).status_code == 200
+    assert allocate(client, project_id, bergen, 50).status_code == 400
+
+    assert client.put(f"/projects/{project_id}/customers/{oslo}", json={"cost_percentage": 40}).status_code == 200
+    assert allocate(client, project_id, bergen, 60).status_code == 200
+    assert client.put(f"/projects/{project_id}/customers/{oslo}", json={"cost_percentage": 41}).status_code == 400
+
+
+def test_customer_can_only_be_added_once(client, project):
+    project_id, (oslo, _) = project
+    assert allocate(client, project_id, oslo, 50).status_code == 200
+    assert allocate(client, project_id, oslo, 10).status_code == 400
+
+
+def test_validation_reports_the_total(client, project):
+    project_id, (oslo, bergen) = project
+    allocate(client, project_id, oslo, 33.33)
+    validation = client.get(f"/projects/{project_id}/validation").json()
+    assert validation["total_percentage"] == 33.33
+    assert not validation["is_valid"]
+
+    allocate(client, project_id, bergen, 66.67)
+    assert client.get(f"/projects/{project_id}/validation").json()["is_valid"]
+
+    assert client.delete(f"/projects/{project_id}/customers/{bergen}").status_code == 200
+    assert not client.get(f"/projects/{project_id}/validation").json()["is_valid"]
+
+
+@pytest.mark.parametrize("percentage", [0, -1, 100.01, 0.004])
+def test_out_of_range_shares_are_rejected(client, project, percentage):
+    project_id, (oslo, bergen) = project
+    assert allocate(client, project_id, oslo, percentage).status_code == 422
+    allocate(client, project_id, bergen, 10)
+    response = client.put(f"/projects/{project_id}/customers/{bergen}", json={"cost_percentage": percentage})
+    assert response.status_code == 422
@@ -0,0 +1,96 @@
+import time
+from datetime import datetime
+
+import history
+from schemas import MAX_BULK_DELETE
+
+
+def add_project(client, name, amounts, percentages):
+    """A project with one expense per amount, split over one new customer per percentage"""
+    project_id = client.post("/projects", json={"name": name}).json()["id"]
+    for amount in amounts:
+        client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": amount})
+    customer_ids = []
+    for number, percentage in enumerate(percentages):
+        customer_id = client.post("/customers", json={"name": f"{name} kunde {number}"}).json()["id"]
+        client.post(f"/projects/{project_id}/customers",
+                    json={"project_id": project_id, "customer_id": customer_id, "cost_percentage": percentage})
+        customer_ids.append(customer_id)
+    return project_id, customer_ids
+
+
+def bulk_delete(client, project_ids):
+    return client.post("/projects/bulk-delete", json={"project_ids": project_ids})
+
+
+def test_cascade_counts_and_not_found(client):
+    first, _ = add_project(client, "Først", [10, 20, 30], [50, 50])
+    second, _ = add_project(client, "Andre", [5], [100])
+    kept, _ = add_project(client, "Beholdt", [7], [100])
+
+    result = bulk_delete(client, [second, 999999, first, first]).json()
+    assert result == {"status": "deleted", "project_ids": [first, second], "not_found": [999999],
+                      "expenses_deleted": 4, "allocations_deleted": 3}
+    assert [p["id"] for p in client.get("/projects").json()] == [kept]
+    assert [e["project_id"] for e in client.get("/expenses").json()] == [kept]
+
+
+def test_only_unknown_ids(client):
+    kept, _ = add_project(client, "Beholdt", [7], [100])
+    result = bulk_delete(client, [424242]).json()
+    assert (result["project_ids"], result["not_found"], result["expenses_deleted"]) == ([], [424242], 0)
+    assert [p["id"] for p in client.get("/projects").json()] == [kept]
+
+
+def test_request_limits(client):
+    assert bulk_delete(client, []).status_code == 422
+    assert bulk_delete(client, list(range(1, MAX_BULK_DELETE + 2))).status_code == 422
+
+
+def test_leaderboards_and_summary_drop_the_projects(client):
+    deleted, (shared,) = add_project(client, "Borte", [100], [100])
+    kept, _ = add_project(client, "Igjen", [40], [50])
+    client.post(f"/projects/{kept}/customers", json={"project_id": kept, "customer_id": shared, "cost_percentage": 50})
+    assert client.get(f"/customers/{shared}/cost-overview").json()["total_cost"] == 120
+
+    bulk_delete(client, [deleted])
+
+    assert [entry["id"] for entry in client.get("/leaderboards/projects").json()] == [kept]
+    assert [entry["id"] for entry in client.get(f"/leaderboards/projects?customer_id={shared}").json()] == [kept]
+    assert {e["id"]: e["total_cost"] for e in client.get("/leaderboards/customers").json()}[shared] == 20
+    assert client.get(f"/customers/{shared}/cost-overview").json()["total_cost"] == 20
+    summary = client.get("/dashboard/summary").json()
+    assert (summary["project_count"], summary["total_expenses"]) == (1, 40)
+
+
+def test_history_keeps_the_deleted_projects(client, db):
+    project_id, (customer_id,) = add_project(client, "Arkiv", [10, 20], [100])
+    history.take_snapshot(db)
+    time.sleep(0.002)
+    before = datetime.utcnow()
+
+    bulk_delete(client, [project_id])
+
+    overview = client.get(f"/customers/{customer_id}/cost-overview", params={"as_of": before.isoformat()}).json()
+    assert overview["total_cost"] == 30
+    snapshot = history.snapshot_for(db, datetime.utcnow())
+    assert history.project_totals_as_of(db, snapshot, datetime.utcnow(), [project_id]) == {project_id: 0}
+    assert history.allocations_as_of(db, snapshot, datetime.utcnow(), project_ids=[project_id]) == {}
+
+
+def test_change_log_has_tombstones_for_the_cascade(client):
+    project_id, (customer_id,) = add_project(client, "Logg", [10, 20], [100])
+    expense_ids = {e["id"] for e in client.get(f"/projects/{project_id}/expenses").json()}
+    allocation_id = client.get(f"/projects/{project_id}/customers").json()[0]["id"]
+    token = client.get("/changes").json()["next"]
+
+    bulk_delete(client, [project_id])
+
+    page = client.get("/changes", params={"since": token}).json()
+    changes = {(c["entity"], c["id"]): c["action"] for c in page["changes"]}
+    assert changes == {
+        **{("expense", expense_id): "delete" for expense_id in expense_ids},
+        ("allocation", allocation_id): "delete",
+        ("project", project_id): "delete",
+    }
+    assert client.get(f"/customers/{customer_id}").status_code == 200
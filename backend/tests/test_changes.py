@@ -0,0 +1,58 @@
+def read_all(client, since=None, limit=100):
+    """Follow the feed from since until has_more is false; (changes, final token, pages)"""
+    changes, pages = [], 0
+    while True:
+        page = client.get("/changes", params={"limit": limit, **({"since": since} if since else {})}).json()
+        changes += page["changes"]
+        since, pages = page["next"], pages + 1
+        if not page["has_more"]:
+            return changes, since, pages
+
+
+def test_pages_follow_the_token(client):
+    ids = [client.post("/customers", json={"name": f"Kommune {n}"}).json()["id"] for n in range(5)]
+
+    first = client.get("/changes", params={"limit": 2}).json()
+    assert [c["id"] for c in first["changes"]] == ids[:2]
+    assert first["has_more"]
+
+    changes, token, pages = read_all(client, first["next"], limit=2)
+    assert [c["id"] for c in changes] == ids[2:]
+    assert pages == 2
+    assert client.get("/changes", params={"since": token}).json() == {"changes": [], "next": token, "has_more": False}
+
+
+def test_each_entity_once_with_its_current_state(client):
+    customer_id = client.post("/customers", json={"name": "Gammel"}).json()["id"]
+    doomed_id = client.post("/customers", json={"name": "Borte"}).json()["id"]
+    client.put(f"/customers/{customer_id}", json={"name": "Ny"})
+    client.delete(f"/customers/{doomed_id}")
+
+    changes, _, _ = read_all(client)
+    assert [(c["id"], c["action"]) for c in changes] == [(customer_id, "upsert"), (doomed_id, "delete")]
+    assert changes[0]["data"]["name"] == "Ny"
+    assert changes[1]["data"] is None
+
+
+def test_token_never_moves_backwards(client):
+    client.post("/customers", json={"name": "Senere"})
+    # e.g. a token from the primary, read on a replica that is behind
+    page = client.get("/changes", params={"since": "999999-0"}).json()
+    assert page == {"changes": [], "next": "999999-0", "has_more": False}
+
+
+def test_invalid_token(client):
+    assert client.get("/changes", params={"since": "abc"}).status_code == 400
+
+
+def test_reset_reaches_tokens_from_before_it(client):
+    for n in range(3):
+        client.post("/customers", json={"name": f"Før {n}"})
+    _, token, _ = read_all(client)
+
+    assert client.post("/admin/reset-db").json()["status"] == "success"
+
+    changes, _, _ = read_all(client, token, limit=1000)
+    assert (changes[0]["entity"], changes[0]["action"]) == ("all", "reset")
+    reseeded = {c["id"] for c in changes if c["entity"] == "customer"}
+    assert reseeded == {c["id"] for c in client.get("/customers").json()}
@@ -0,0 +1,64 @@
+def setup_split(client, amount, percentages, name="Delt"):
+    """One project with one expense, split over one new customer per percentage"""
+    project_id = client.post("/projects", json={"name": name}).json()["id"]
+    client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": amount})
+    customer_ids = []
+    for number, percentage in enumerate(percentages):
+        customer_id = client.post("/customers", json={"name": f"{name} kunde {number}"}).json()["id"]
+        client.post(
+            f"/projects/{project_id}/customers",
+            json={"project_id": project_id, "customer_id": customer_id, "cost_percentage": percentage},
+        )
+        customer_ids.append(customer_id)
+    return project_id, customer_ids
+
+
+def test_project_overview_adds_up_to_the_ore(client):
+    project_id, _ = setup_split(client, 100.01, [33.33, 33.33, 33.34])
+    overview = client.get(f"/projects/{project_id}/cost-overview").json()
+    assert overview["total_expenses"] == 100.01
+    # Floors of 3333, 3333 and 3334 øre; the øre left over goes to the largest remainder
+    assert [customer["allocated_cost"] for customer in overview["customers"]] == [33.33, 33.33, 33.35]
+
+
+def test_customer_overview(client):
+    project_id, (first, second) = setup_split(client, 1000, [60, 40])
+    overview = client.get(f"/customers/{first}/cost-overview").json()
+    assert overview["total_cost"] == 600
+    assert [(p["project_id"], p["cost_percentage"], p["allocated_cost"]) for p in overview["projects"]] == [
+        (project_id, 60, 600)
+    ]
+    assert client.get(f"/customers/{second}/cost-overview").json()["total_cost"] == 400
+    assert client.get("/customers/999999/cost-overview").status_code == 404
+
+
+def test_overviews_follow_writes(client):
+    project_id, (customer_id,) = setup_split(client, 100, [100])
+    expense_id = client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": 50}).json()["id"]
+    assert client.get(f"/customers/{customer_id}/cost-overview").json()["total_cost"] == 150
+
+    client.delete(f"/expenses/{expense_id}")
+    client.put(f"/projects/{project_id}/customers/{customer_id}", json={"cost_percentage": 25})
+    assert client.get(f"/customers/{customer_id}/cost-overview").json()["total_cost"] == 25
+
+
+def test_dashboard_summary(client):
+    project_id, customer_ids = setup_split(client, 1000, [50])
+    client.post("/projects", json={"name": "Tom"})
+    summary = client.get("/dashboard/summary").json()
+    assert summary["customer_count"] == 1
+    assert summary["project_count"] == 2
+    assert summary["total_expenses"] == 1000
+    assert summary["allocated_cost"] == 500
+    assert summary["unallocated_cost"] == 500
+    assert summary["invalid_allocation_count"] == 1
+    assert [entry["id"] for entry in summary["top_projects"]] == [project_id]
+    assert [entry["id"] for entry in summary["top_customers"]] == customer_ids
+
+
+def test_leaderboards(client):
+    small, _ = setup_split(client, 10, [100], name="Liten")
+    large, (customer_id,) = setup_split(client, 20, [50], name="Stor")
+    assert [entry["id"] for entry in client.get("/leaderboards/projects").json()] == [large, small]
+    assert [entry["id"] for entry in client.get(f"/leaderboards/projects?customer_id={customer_id}").json()] == [large]
+    assert client.get("/leaderboards/customers?limit=1").json()[0]["total_cost"] == 10
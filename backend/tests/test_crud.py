@@ -0,0 +1,70 @@
+from expense_types import expense_type_cache
+
+
+def test_customer_crud(client):
+    response = client.post("/customers", json={"name": "Bergen kommune", "description": "Vest"})
+    assert response.status_code == 200
+    customer = response.json()
+    assert customer["name"] == "Bergen kommune"
+
+    assert client.get(f"/customers/{customer['id']}").json()["description"] == "Vest"
+    assert client.post("/customers", json={"name": "Bergen kommune"}).status_code == 409
+
+    updated = client.put(f"/customers/{customer['id']}", json={"description": "Vestland"}).json()
+    assert updated["name"] == "Bergen kommune"
+    assert updated["description"] == "Vestland"
+    assert client.put("/customers/999999", json={"name": "Ukjent"}).status_code == 404
+
+    assert client.delete(f"/customers/{customer['id']}").status_code == 200
+    assert client.get(f"/customers/{customer['id']}").status_code == 404
+
+
+def test_each_test_starts_empty(client):
+    assert client.get("/customers").json() == []
+    assert client.get("/projects").json() == []
+
+
+def test_project_crud(client):
+    project = client.post("/projects", json={"name": "Skole"}).json()
+    assert client.put(f"/projects/{project['id']}", json={"name": "Ny skole"}).json()["name"] == "Ny skole"
+    assert client.put("/projects/999999", json={"name": "Ukjent"}).status_code == 404
+    assert [p["name"] for p in client.get("/projects").json()] == ["Ny skole"]
+
+    assert client.delete(f"/projects/{project['id']}").status_code == 200
+    assert client.get(f"/projects/{project['id']}").status_code == 404
+
+
+def test_expense_crud(client):
+    project_id = client.post("/projects", json={"name": "Vei"}).json()["id"]
+    expense = client.post(
+        "/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": 10.5}
+    ).json()
+    assert expense["expense_type"] == "Reise"
+    assert expense["amount"] == 10.5
+
+    updated = client.put(f"/expenses/{expense['id']}", json={"amount": 25, "expense_type": "Materiell"}).json()
+    assert updated["amount"] == 25
+    assert updated["expense_type"] == "Materiell"
+    assert client.get(f"/expenses/{expense['id']}").json()["amount"] == 25
+    assert [e["id"] for e in client.get(f"/projects/{project_id}/expenses").json()] == [expense["id"]]
+
+    assert client.post("/expenses", json={"project_id": 999999, "expense_type": "Reise", "amount": 1}).status_code == 404
+    assert client.delete(f"/expenses/{expense['id']}").status_code == 200
+    assert client.delete(f"/expenses/{expense['id']}").status_code == 404
+
+
+def test_expense_update_after_type_cache_miss(client):
+    project_id = client.post("/projects", json={"name": "Bro"}).json()["id"]
+    expense = client.post("/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": 5}).json()
+    expense_type_cache.clear()
+
+    response = client.put(f"/expenses/{expense['id']}", json={"amount": 6})
+    assert response.status_code == 200
+    assert response.json()["expense_type"] == "Reise"
+
+
+def test_invalid_amounts_are_rejected(client):
+    project_id = client.post("/projects", json={"name": "Tunnel"}).json()["id"]
+    for amount in (0, -5, 0.001):
+        response = client.post("/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": amount})
+        assert response.status_code == 422
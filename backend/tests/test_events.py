@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from events import RESYNC, ChangeListener
+
+
+@pytest.fixture
+def listener(monkeypatch):
+    # No LISTEN connection: events are dispatched by the test
+    monkeypatch.setattr(ChangeListener, "_run", lambda self: None)
+    return ChangeListener(replay_size=3)
+
+
+def drain(queue: asyncio.Queue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_reconnect_replays_missed_events(listener):
+    async def scenario():
+        first = listener.subscribe()
+        listener._dispatch("a")
+        listener._dispatch("b")
+        await asyncio.sleep(0)
+        (last_seen, _), _ = drain(first)
+        listener.unsubscribe(first)
+
+        listener._dispatch("c")
+        return drain(listener.subscribe(last_seen))
+
+    assert [payload for _, payload in asyncio.run(scenario())] == ["b", "c"]
+
+
+def test_reconnect_is_told_to_resync_when_events_are_gone(listener):
+    async def scenario():
+        queue = listener.subscribe()
+        listener._dispatch("a")
+        await asyncio.sleep(0)
+        (last_seen, _), = drain(queue)
+        for payload in "bcde":
+            listener._dispatch(payload)
+        too_old = drain(listener.subscribe(last_seen))
+        other_worker = drain(listener.subscribe("0123456789ab-4"))
+        up_to_date = drain(listener.subscribe(f"{listener.instance}-5"))
+        return too_old, other_worker, up_to_date
+
+    too_old, other_worker, up_to_date = asyncio.run(scenario())
+    assert [payload for _, payload in too_old] == [RESYNC]
+    assert [payload for _, payload in other_worker] == [RESYNC]
+    assert up_to_date == []
+
+
+def test_slow_subscriber_is_told_to_resync(listener, monkeypatch):
+    monkeypatch.setattr("events.SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def scenario():
+        queue = listener.subscribe()
+        for payload in "abc":
+            listener._dispatch(payload)
+        await asyncio.sleep(0)
+        return drain(queue)
+
+    assert [payload for _, payload in asyncio.run(scenario())] == [RESYNC]
@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import text
+
+import explain_check
+
+# Small enough for a test run; enable_seqscan off keeps the plans index-driven at this size
+SIZE = {"projects": 100, "customers": 20, "expenses_per_project": 10, "seqscan": False}
+
+
+@pytest.mark.postgres
+def test_hot_queries_use_indexes_on_the_migrated_schema(pg_database):
+    assert explain_check.check(pg_database, **SIZE) == []
+
+
+@pytest.mark.postgres
+def test_a_missing_index_is_reported(pg_database, monkeypatch):
+    load_dataset = explain_check.load_dataset
+
+    def load_without_index(engine, *args):
+        load_dataset(engine, *args)
+        with engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_change_log_position"))
+
+    monkeypatch.setattr(explain_check, "load_dataset", load_without_index)
+
+    regressions = explain_check.check(pg_database, **SIZE)
+    assert {(name, relation) for name, relation, _ in regressions} == {("read_changes", "change_log")}
@@ -0,0 +1,103 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import history
+
+
+def moment() -> datetime:
+    """A timestamp strictly between the writes before and after it"""
+    time.sleep(0.002)
+    now = datetime.utcnow()
+    time.sleep(0.002)
+    return now
+
+
+def as_of(db, when: datetime, project_id: int) -> tuple:
+    """(shares, total in øre) of one project at when"""
+    snapshot = history.snapshot_for(db, when)
+    shares = history.allocations_as_of(db, snapshot, when, project_ids=[project_id])
+    totals = history.project_totals_as_of(db, snapshot, when, [project_id])
+    return shares.get(project_id, {}), totals[project_id]
+
+
+@pytest.fixture
+def project(client):
+    """A project with 100 kr of expenses split 60/40, and the customers' ids"""
+    project_id = client.post("/projects", json={"name": "Historikk"}).json()["id"]
+    customer_ids = [client.post("/customers", json={"name": name}).json()["id"] for name in ("Alta", "Bodø")]
+    client.post("/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": 100})
+    for customer_id, percentage in zip(customer_ids, (60, 40)):
+        client.post(f"/projects/{project_id}/customers",
+                    json={"project_id": project_id, "customer_id": customer_id, "cost_percentage": percentage})
+    return project_id, customer_ids
+
+
+def test_as_of_before_the_first_snapshot_is_refused(db, project):
+    before = moment()
+    history.take_snapshot(db)
+
+    with pytest.raises(HTTPException) as refused:
+        history.snapshot_for(db, before)
+    assert refused.value.status_code == 400
+
+
+def test_changes_after_a_snapshot_are_replayed_from_history(client, db, project):
+    project_id, (alta, bodo) = project
+    history.take_snapshot(db)
+    at_snapshot = moment()
+
+    client.put(f"/projects/{project_id}/customers/{alta}", json={"cost_percentage": 30})
+    client.put(f"/projects/{project_id}/customers/{bodo}", json={"cost_percentage": 70})
+    client.post("/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": 50})
+    after_change = moment()
+
+    assert as_of(db, at_snapshot, project_id) == ({alta: 6000, bodo: 4000}, 10000)
+    assert as_of(db, after_change, project_id) == ({alta: 3000, bodo: 7000}, 15000)
+
+
+def test_a_later_snapshot_folds_in_the_history(client, db, project):
+    project_id, (alta, bodo) = project
+    first = history.take_snapshot(db)
+    at_first = moment()
+    client.put(f"/projects/{project_id}/customers/{alta}", json={"cost_percentage": 30})
+    client.put(f"/projects/{project_id}/customers/{bodo}", json={"cost_percentage": 70})
+    after_change = moment()
+
+    second = history.take_snapshot(db, now=after_change + timedelta(seconds=history.HISTORY_SNAPSHOT_LAG))
+    assert second.covers_until == after_change
+    # Too soon for another one
+    assert history.take_snapshot(db, now=after_change + timedelta(seconds=history.HISTORY_SNAPSHOT_LAG)) is None
+
+    assert history.snapshot_for(db, at_first).id == first.id
+    assert history.snapshot_for(db, after_change).id == second.id
+    assert as_of(db, at_first, project_id) == ({alta: 6000, bodo: 4000}, 10000)
+    assert as_of(db, after_change, project_id) == ({alta: 3000, bodo: 7000}, 10000)
+
+
+def test_cascaded_deletes_are_in_the_history(client, db, project):
+    project_id, (alta, bodo) = project
+    history.take_snapshot(db)
+    before_delete = moment()
+
+    client.delete(f"/customers/{bodo}")
+    after_customer = moment()
+    client.delete(f"/projects/{project_id}")
+    after_project = moment()
+
+    assert as_of(db, before_delete, project_id) == ({alta: 6000, bodo: 4000}, 10000)
+    assert as_of(db, after_customer, project_id) == ({alta: 6000}, 10000)
+    assert as_of(db, after_project, project_id) == ({}, 0)
+
+    # A snapshot taken after the deletes no longer carries the project
+    snapshot = history.take_snapshot(db, now=after_project + timedelta(seconds=history.HISTORY_SNAPSHOT_LAG))
+    assert history.allocations_as_of(db, snapshot, after_project) == {}
+    assert history.project_totals_as_of(db, snapshot, after_project, [project_id]) == {project_id: 0}
+
+
+def test_run_snapshots_once(db, capsys):
+    history.run_snapshots(lambda: db, once=True)
+    history.run_snapshots(lambda: db, once=True)
+    assert capsys.readouterr().out.splitlines()[-1] == "Latest history snapshot is recent enough"
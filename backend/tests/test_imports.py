@@ -0,0 +1,65 @@
+import json
+
+import main
+
+
+def csv_file(*rows):
+    content = "ID,ProjectID,ExpenseType,Amount,Description\n" + "".join(f"{row}\n" for row in rows)
+    return {"file": ("expenses.csv", content.encode("utf-8"), "text/csv")}
+
+
+def test_csv_import_is_idempotent(client):
+    project_id = client.post("/projects", json={"name": "Import"}).json()["id"]
+    rows = [f"A-1,{project_id},Reise,100,Fly", f"A-2,{project_id},Reise,50,Tog"]
+
+    first = client.post("/import/expenses-csv", files=csv_file(*rows)).json()
+    assert (first["new"], first["changed"], first["unchanged"]) == (2, 0, 0)
+    again = client.post("/import/expenses-csv", files=csv_file(*rows)).json()
+    assert (again["new"], again["changed"], again["unchanged"]) == (0, 0, 2)
+
+    changed = client.post("/import/expenses-csv", files=csv_file(rows[0], f"A-2,{project_id},Reise,75,Tog")).json()
+    assert (changed["new"], changed["changed"], changed["unchanged"]) == (0, 1, 1)
+    assert sorted(e["amount"] for e in client.get(f"/projects/{project_id}/expenses").json()) == [75, 100]
+
+
+def test_csv_import_creates_missing_projects(client):
+    result = client.post("/import/expenses-csv", files=csv_file("B-1,424242,Reise,10,")).json()
+    assert result["created_projects"] == 1
+    assert client.get("/projects/424242").json()["name"] == "Project 424242"
+
+
+def test_identical_rows_without_id_are_all_kept(client):
+    project_id = client.post("/projects", json={"name": "Kopier"}).json()["id"]
+    rows = [f",{project_id},Reise,100,Taxi"] * 3
+
+    assert client.post("/import/expenses-csv", files=csv_file(*rows)).json()["new"] == 3
+    assert client.post("/import/expenses-csv", files=csv_file(*rows)).json()["unchanged"] == 3
+    assert len(client.get(f"/projects/{project_id}/expenses").json()) == 3
+
+
+def test_ndjson_import(client, monkeypatch):
+    monkeypatch.setattr(main, "NDJSON_BATCH_SIZE", 2)
+    project_id = client.post("/projects", json={"name": "Strøm"}).json()["id"]
+    lines = [
+        json.dumps({"project_id": project_id, "expense_type": "Drift", "amount": amount, "source_key": f"N-{amount}"})
+        for amount in (1, 2, 3)
+    ]
+    lines.insert(1, json.dumps({"project_id": project_id, "amount": 5}))
+    result = client.post("/import/expenses-ndjson", content="\n".join(lines) + "\n").json()
+    assert result["status"] == "partial_import"
+    assert (result["received"], result["new"], result["rejected"], result["batches"]) == (4, 3, 1, 2)
+    assert result["errors"][0].startswith("Line 2:")
+
+
+def test_ndjson_oversized_line_reports_committed_rows(client, monkeypatch):
+    monkeypatch.setattr(main, "NDJSON_BATCH_SIZE", 1)
+    project_id = client.post("/projects", json={"name": "Stor"}).json()["id"]
+    line = json.dumps({"project_id": project_id, "expense_type": "Drift", "amount": 1, "source_key": "S-1"})
+    oversized = json.dumps({"project_id": project_id, "expense_type": "Drift", "amount": 1,
+                            "description": "x" * (main.NDJSON_MAX_LINE_BYTES + 1)})
+    result = client.post("/import/expenses-ndjson", content=f"{line}\n{oversized}\n").json()
+    assert result["status"] == "aborted"
+    assert result["new"] == 1
+    assert result["errors"] == [
+        f"Line 2: line longer than {main.NDJSON_MAX_LINE_BYTES} bytes; import stopped, resend from this line"
+    ]
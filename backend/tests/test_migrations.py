@@ -0,0 +1,157 @@
+import pytest
+from sqlalchemy import (
+    CheckConstraint, Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text, create_engine,
+    inspect, text,
+)
+
+import dialect
+import main
+from models import EXPENSE_PARTITIONS, Base
+from testing import BACKEND_DIR, migrate
+
+# The schema the app's create_all built before Alembic managed it
+baseline = MetaData()
+Table(
+    "customers", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(255), unique=True, nullable=False, index=True),
+    Column("description", Text),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+Table(
+    "projects", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(255), nullable=False, index=True),
+    Column("description", Text),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+Table(
+    "project_customers", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), nullable=False, index=True),
+    Column("customer_id", Integer, ForeignKey("customers.id"), nullable=False, index=True),
+    Column("cost_percentage", Float, nullable=False),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+    CheckConstraint("cost_percentage >= 0 AND cost_percentage <= 100", name="valid_cost_percentage"),
+)
+Table(
+    "expenses", baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), nullable=False, index=True),
+    Column("expense_type", String(255), nullable=False),
+    Column("amount", Float, nullable=False),
+    Column("description", Text),
+    Column("created_at", DateTime),
+    Column("updated_at", DateTime),
+)
+
+
+def head_revision() -> str:
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config()
+    config.set_main_option("script_location", f"{BACKEND_DIR}/alembic")
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+@pytest.fixture
+def pg_db_engine(pg_database):
+    engine = create_engine(pg_database)
+    yield engine
+    engine.dispose()
+
+
+def version(engine) -> str:
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+
+@pytest.mark.postgres
+def test_baseline_create_all_schema_is_stamped_and_upgraded(pg_database, pg_db_engine):
+    baseline.create_all(pg_db_engine)
+    with pg_db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO customers (id, name) VALUES (1, 'Alta kommune'), (2, 'Bodø kommune')"))
+        connection.execute(text("INSERT INTO projects (id, name) VALUES (1, 'Fiber')"))
+        connection.execute(text(
+            "INSERT INTO project_customers (project_id, customer_id, cost_percentage) VALUES (1, 1, 62.5), (1, 2, 37.5)"
+        ))
+        connection.execute(text(
+            "INSERT INTO expenses (id, project_id, expense_type, amount) VALUES (1, 1, 'Reise', 1234.5), (2, 1, 'Lønn', 100)"
+        ))
+
+    # 0001 would fail on the existing project_customers; it is stamped and the rest run
+    migrate(pg_database)
+
+    assert version(pg_db_engine) == head_revision()
+    with pg_db_engine.connect() as connection:
+        assert connection.execute(text(
+            "SELECT e.amount_ore, t.name FROM expenses e JOIN expense_types t ON t.id = e.expense_type_id ORDER BY e.id"
+        )).all() == [(123450, "Reise"), (10000, "Lønn")]
+        assert connection.execute(text(
+            "SELECT customer_id, cost_basis_points FROM project_customers ORDER BY customer_id"
+        )).all() == [(1, 6250), (2, 3750)]
+        assert connection.execute(text("SELECT total_ore FROM project_totals WHERE project_id = 1")).scalar() == 133450
+    assert inspect(pg_db_engine).has_table("change_log")
+
+
+@pytest.mark.postgres
+def test_current_create_all_schema_is_stamped_at_head(pg_database, pg_db_engine):
+    Base.metadata.create_all(pg_db_engine)
+
+    migrate(pg_database)
+
+    assert version(pg_db_engine) == head_revision()
+
+
+@pytest.mark.postgres
+def test_empty_database_runs_every_revision(pg_database, pg_db_engine):
+    migrate(pg_database)
+
+    assert version(pg_db_engine) == head_revision()
+    tables = set(inspect(pg_db_engine).get_table_names())
+    assert set(Base.metadata.tables) <= tables
+
+
+@pytest.mark.postgres
+def test_partitioning_copies_rows_both_ways(pg_database, pg_db_engine):
+    baseline.create_all(pg_db_engine)
+    with pg_db_engine.begin() as connection:
+        connection.execute(text("INSERT INTO projects (id, name) VALUES (1, 'Fiber'), (2, 'Vei')"))
+        connection.execute(text(
+            "INSERT INTO expenses (project_id, expense_type, amount) "
+            "SELECT 1 + i % 2, 'Reise', i FROM generate_series(1, 50) i"
+        ))
+    rows = "SELECT id, project_id, amount FROM expenses ORDER BY id"
+    with pg_db_engine.connect() as connection:
+        before = connection.execute(text(rows)).all()
+
+    migrate(pg_database, "0002_partition_expenses")
+    assert dialect.expense_partitions(pg_db_engine) == EXPENSE_PARTITIONS
+    with pg_db_engine.begin() as connection:
+        assert connection.execute(text(rows)).all() == before
+        # The id sequence moved with the table
+        assert connection.execute(text(
+            "INSERT INTO expenses (project_id, expense_type, amount) VALUES (2, 'Reise', 1) RETURNING id"
+        )).scalar() == 51
+        assert connection.execute(text("SELECT count(*) FROM pg_trigger WHERE tgname LIKE '%_sync'")).scalar() == 0
+
+    migrate(pg_database, "0001_create_project_customers", downgrade=True)
+    assert dialect.expense_partitions(pg_db_engine) == 0
+    with pg_db_engine.connect() as connection:
+        assert len(connection.execute(text(rows)).all()) == 51
+
+
+@pytest.mark.postgres
+def test_startup_refuses_a_partition_count_the_schema_does_not_have(pg_database, pg_db_engine, monkeypatch):
+    migrate(pg_database)
+    monkeypatch.setattr(main, "engine", pg_db_engine)
+    monkeypatch.setattr(main, "PARTITION_EXPENSES", True)
+
+    main.check_expense_partitions()
+    monkeypatch.setattr(main, "EXPENSE_PARTITIONS", EXPENSE_PARTITIONS + 1)
+    with pytest.raises(RuntimeError, match="EXPENSE_PARTITIONS"):
+        main.check_expense_partitions()
@@ -0,0 +1,127 @@
+import asyncio
+import gzip
+
+import brotli
+import msgpack
+import pytest
+import zstandard
+
+from negotiation import CompressionMiddleware, negotiate_encoding, parse_quality
+
+BODY = b'{"name": "Tromso kommune"}' * 100
+
+
+def decompress(encoding: str, data: bytes) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+def send_through(chunks, accept_encoding: str, content_type: str = "application/json", minimum_size: int = 1024):
+    """Messages CompressionMiddleware sends for a response of chunks (the last one ends it)"""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", content_type.encode()), (b"content-length", str(sum(map(len, chunks))).encode()),
+        ]})
+        for number, chunk in enumerate(chunks, 1):
+            await send({"type": "http.response.body", "body": chunk, "more_body": number < len(chunks)})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, minimum_size)(scope, None, send))
+    start, *bodies = sent
+    return {k.decode(): v.decode() for k, v in start["headers"]}, bodies
+
+
+@pytest.fixture
+def customers(client):
+    """Enough customers for a /customers response above COMPRESSION_MIN_BYTES"""
+    return [client.post("/customers", json={"name": f"Kommune nummer {n}"}).json() for n in range(40)]
+
+
+# ============ Accept-Encoding ============
+
+def test_parse_quality():
+    assert parse_quality("gzip;q=0.5, BR, zstd;q=x,") == {"gzip": 0.5, "br": 1.0, "zstd": 0.0}
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("gzip, br, zstd", "zstd"),
+    ("gzip, br", "br"),
+    ("gzip;q=1, br;q=0.5", "gzip"),
+    ("*", "zstd"),
+    ("*, zstd;q=0", "br"),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiate_encoding(header, encoding):
+    assert negotiate_encoding(header) == encoding
+
+
+@pytest.mark.parametrize("encoding", ["zstd", "br", "gzip"])
+def test_large_responses_are_compressed(encoding):
+    headers, (body,) = send_through([BODY], encoding)
+    assert (headers["content-encoding"], headers["vary"]) == (encoding, "Accept-Encoding")
+    assert headers["content-length"] == str(len(body["body"]))
+    assert decompress(encoding, body["body"]) == BODY
+
+
+@pytest.mark.parametrize("encoding", ["zstd", "br", "gzip"])
+def test_streamed_responses_are_compressed_chunk_by_chunk(encoding):
+    chunks = [BODY[:600], BODY[600:1200], BODY[1200:], b""]
+    headers, bodies = send_through(chunks, encoding)
+    assert headers["content-encoding"] == encoding
+    assert "content-length" not in headers
+    # Nothing is held back once the first kilobyte is through
+    assert len(bodies) == 3 and all(body["body"] for body in bodies[:2])
+    assert decompress(encoding, b"".join(body["body"] for body in bodies)) == BODY
+
+
+def test_small_and_binary_responses_are_left_alone():
+    headers, (body,) = send_through([BODY[:100]], "gzip")
+    assert "content-encoding" not in headers and body["body"] == BODY[:100]
+    headers, (body,) = send_through([BODY], "gzip", content_type="image/png")
+    assert "content-encoding" not in headers and body["body"] == BODY
+
+
+def test_api_responses_decode_to_the_same_json(client, customers):
+    plain = client.get("/customers", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    for encoding in ("zstd", "br", "gzip"):
+        response = client.get("/customers", headers={"Accept-Encoding": encoding})
+        assert response.headers["content-encoding"] == encoding
+        assert response.json() == plain.json() == customers
+
+
+# ============ MessagePack ============
+
+def test_msgpack_when_asked_for(client, customers):
+    response = client.get("/customers", headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert "Accept" in response.headers["vary"]
+    assert msgpack.unpackb(response.content) == customers
+
+
+@pytest.mark.parametrize("accept", ["application/json", "*/*", "application/json, application/msgpack;q=0.5", ""])
+def test_json_otherwise(client, customers, accept):
+    response = client.get("/customers", headers={"Accept": accept})
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == customers
+
+
+def test_msgpack_is_compressed_too(client, customers):
+    response = client.get("/customers", headers={"Accept": "application/x-msgpack", "Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert msgpack.unpackb(response.content) == customers
+
+
+def test_errors_stay_json(client):
+    response = client.get("/customers/999999/cost-overview", headers={"Accept": "application/msgpack"})
+    assert response.status_code == 404
+    assert response.headers["content-type"] == "application/json"
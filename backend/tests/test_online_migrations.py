@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import text
+
+from online_migrations import add_check_constraint, backfill, check_migrations, copy_rows, set_not_null
+
+TABLE = "online_migrations_test"
+
+
+@pytest.fixture
+def scratch(pg_engine):
+    """Run SQL on a scratch table, committed outside the migration's connection"""
+    def run(statement):
+        with pg_engine.begin() as connection:
+            result = connection.execute(text(statement))
+            return result.all() if result.returns_rows else None
+
+    run(f"DROP TABLE IF EXISTS {TABLE}")
+    run(f"CREATE TABLE {TABLE} (id integer PRIMARY KEY, n integer NOT NULL, doubled integer)")
+    yield run
+    run(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+@contextmanager
+def migration(pg_engine):
+    """An Alembic op context in its own transaction, as inside a migration"""
+    with pg_engine.connect() as connection:
+        context = MigrationContext.configure(connection)
+        with Operations.context(context), context.begin_transaction():
+            yield
+
+
+def test_repository_migrations_pass_the_check():
+    assert check_migrations() == []
+
+
+def test_check_flags_blocking_operations_on_large_tables(tmp_path):
+    (tmp_path / "0002_before_policy.py").write_text("op.create_index('ix_a', 'expenses', ['a'])\n")
+    (tmp_path / "0011_new.py").write_text(
+        "op.create_index('ix_a', 'expenses', ['a'])\n"
+        "op.execute('UPDATE project_customers SET cost_basis_points = 0')\n"
+        "op.execute('ALTER TABLE expenses ADD CONSTRAINT ck_x CHECK (amount_ore > 0)')\n"
+        "op.execute('ALTER TABLE expenses ADD CONSTRAINT ck_y CHECK (amount_ore > 0) NOT VALID')\n"
+        "op.create_index('ix_b', 'change_log', ['b'])  # online: ok\n"
+        "op.create_index('ix_c', 'projects', ['c'])\n"
+        "create_index_concurrently('ix_d', 'expenses', 'd')\n"
+    )
+    problems = check_migrations(str(tmp_path))
+    assert [(filename, number) for filename, number, _, _ in problems] == [
+        ("0011_new.py", 1), ("0011_new.py", 2), ("0011_new.py", 3),
+    ]
+    assert problems[1][3] == "use backfill"
+
+
+@pytest.mark.postgres
+def test_backfill_updates_in_batches_and_resumes(pg_engine, scratch):
+    # A gap in the keys: batches cover key ranges, not row counts
+    scratch(f"INSERT INTO {TABLE} (id, n) SELECT i, i FROM generate_series(1, 25) i")
+    scratch(f"INSERT INTO {TABLE} (id, n) SELECT i, i FROM generate_series(1000, 1004) i")
+    scratch(f"UPDATE {TABLE} SET doubled = 0 WHERE id = 3")
+
+    with migration(pg_engine):
+        assert backfill(TABLE, "doubled = n * 2", where="doubled IS NULL", batch_size=10, pause=0) == 29
+    rows = dict(scratch(f"SELECT id, doubled FROM {TABLE}"))
+    assert rows[3] == 0
+    assert all(doubled == id_ * 2 for id_, doubled in rows.items() if id_ != 3)
+
+    # Finished rows are excluded, so a re-run after an interruption only does the rest
+    with migration(pg_engine):
+        assert backfill(TABLE, "doubled = n * 2", where="doubled IS NULL", batch_size=10, pause=0) == 0
+
+
+@pytest.mark.postgres
+def test_backfill_of_empty_table(pg_engine, scratch):
+    with migration(pg_engine):
+        assert backfill(TABLE, "doubled = n * 2", pause=0) == 0
+
+
+@pytest.mark.postgres
+def test_copy_rows_in_batches_skips_rows_already_copied(pg_engine, scratch):
+    scratch(f"INSERT INTO {TABLE} (id, n) SELECT i, i FROM generate_series(1, 25) i")
+    scratch(f"DROP TABLE IF EXISTS {TABLE}_copy")
+    scratch(f"CREATE TABLE {TABLE}_copy (LIKE {TABLE} INCLUDING ALL)")
+    # As a sync trigger would have written it during the copy
+    scratch(f"INSERT INTO {TABLE}_copy (id, n, doubled) VALUES (7, 7, 14)")
+
+    try:
+        with migration(pg_engine):
+            assert copy_rows(TABLE, f"{TABLE}_copy", "id, n, doubled", batch_size=10, pause=0) == 24
+        assert scratch(f"SELECT count(*), sum(n) FROM {TABLE}_copy") == [(25, 325)]
+        assert scratch(f"SELECT doubled FROM {TABLE}_copy WHERE id = 7") == [(14,)]
+    finally:
+        scratch(f"DROP TABLE IF EXISTS {TABLE}_copy")
+
+
+@pytest.mark.postgres
+def test_set_not_null_via_validated_check(pg_engine, scratch):
+    scratch(f"INSERT INTO {TABLE} (id, n, doubled) VALUES (1, 1, 2)")
+
+    with migration(pg_engine):
+        set_not_null(TABLE, "doubled")
+    assert scratch(f"SELECT conname FROM pg_constraint WHERE conrelid = '{TABLE}'::regclass AND contype = 'c'") == []
+    assert scratch(
+        f"SELECT attnotnull FROM pg_attribute WHERE attrelid = '{TABLE}'::regclass AND attname = 'doubled'"
+    ) == [(True,)]
+
+
+@pytest.mark.postgres
+def test_set_not_null_fails_while_rows_are_missing(pg_engine, scratch):
+    scratch(f"INSERT INTO {TABLE} (id, n) VALUES (1, 1)")
+
+    with pytest.raises(Exception, match="violated"), migration(pg_engine):
+        set_not_null(TABLE, "doubled")
+
+
+@pytest.mark.postgres
+def test_check_constraint_is_added_not_valid_then_validated(pg_engine, scratch):
+    scratch(f"INSERT INTO {TABLE} (id, n) VALUES (1, 1)")
+    validated = "SELECT convalidated FROM pg_constraint WHERE conname = 'ck_n_positive'"
+
+    with migration(pg_engine):
+        add_check_constraint(TABLE, "ck_n_positive", "n > 0", validate=False)
+    assert scratch(validated) == [(False,)]
+    with migration(pg_engine):
+        add_check_constraint(TABLE, "ck_n_positive", "n > 0")
+    assert scratch(validated) == [(True,)]
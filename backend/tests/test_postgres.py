@@ -0,0 +1,221 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import changelog
+import crud
+import dialect
+import events
+from expense_types import expense_type_cache
+from models import EXPENSE_PARTITIONS, Base
+from schemas import CustomerCreate, ProjectCreate, ProjectCustomerCreate
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def pg_sessions(pg_migrated):
+    """Sessions that really commit, for what happens between transactions; the tables are emptied afterwards"""
+    yield sessionmaker(bind=pg_migrated)
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with pg_migrated.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    expense_type_cache.clear()
+
+
+def csv_file(*rows):
+    content = "ID,ProjectID,ExpenseType,Amount,Description\n" + "".join(f"{row}\n" for row in rows)
+    return {"file": ("expenses.csv", content.encode("utf-8"), "text/csv")}
+
+
+# ============ Advisory locks ============
+
+def test_advisory_lock_is_held_until_the_transaction_ends(pg_sessions):
+    holder, other = pg_sessions(), pg_sessions()
+    try_lock = text("SELECT pg_try_advisory_xact_lock(4242)")
+    try:
+        dialect.advisory_xact_lock(holder, 4242)
+        assert other.execute(try_lock).scalar() is False
+        holder.rollback()
+        assert other.execute(try_lock).scalar() is True
+    finally:
+        holder.close()
+        other.close()
+
+
+def test_concurrent_allocations_cannot_exceed_100_percent(pg_sessions):
+    with pg_sessions() as db:
+        project_id = crud.create_project(db, ProjectCreate(name="Bredbånd")).id
+        customer_ids = [crud.create_customer(db, CustomerCreate(name=f"Kommune {n}")).id for n in (1, 2)]
+
+    # Without the per-project lock both would read 0% allocated and insert 60%
+    start = threading.Barrier(2)
+    outcomes = []
+
+    def allocate(customer_id):
+        with pg_sessions() as db:
+            start.wait()
+            try:
+                crud.add_customer_to_project(db, ProjectCustomerCreate(
+                    project_id=project_id, customer_id=customer_id, cost_percentage=60
+                ))
+                outcomes.append("added")
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+
+    threads = [threading.Thread(target=allocate, args=(customer_id,)) for customer_id in customer_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes, key=str) == [400, "added"]
+    with pg_sessions() as db:
+        assert [pc.cost_basis_points for pc in crud.get_project_customers(db, project_id)] == [6000]
+
+
+# ============ RETURNING / ON CONFLICT ============
+
+def test_duplicate_customer_name_is_a_conflict(pg_client):
+    assert pg_client.post("/customers", json={"name": "Tromsø kommune"}).status_code == 200
+    assert pg_client.post("/customers", json={"name": "Tromsø kommune"}).status_code == 409
+    assert [c["name"] for c in pg_client.get("/customers").json()] == ["Tromsø kommune"]
+
+
+def test_expense_update_records_the_amount_it_replaced(pg_client, pg_db):
+    project_id = pg_client.post("/projects", json={"name": "Kai"}).json()["id"]
+    expense_id = pg_client.post(
+        "/expenses", json={"project_id": project_id, "expense_type": "Reise", "amount": 100}
+    ).json()["id"]
+
+    assert pg_client.put(f"/expenses/{expense_id}", json={"amount": 130.5}).json()["amount"] == 130.5
+    assert pg_db.execute(text(
+        "SELECT amount_ore, amount_delta_ore FROM expense_history WHERE expense_id = :id ORDER BY id"
+    ), {"id": expense_id}).all() == [(10000, 10000), (13050, 3050)]
+
+
+def test_reimport_upserts_on_the_source_key(pg_client):
+    project_id = pg_client.post("/projects", json={"name": "Import"}).json()["id"]
+    rows = [f"A-1,{project_id},Reise,100,Fly", f"A-2,{project_id},Reise,50,Tog"]
+    assert pg_client.post("/import/expenses-csv", files=csv_file(*rows)).json()["new"] == 2
+    ids = {e["amount"]: e["id"] for e in pg_client.get(f"/projects/{project_id}/expenses").json()}
+
+    changed = pg_client.post("/import/expenses-csv", files=csv_file(rows[0], f"A-2,{project_id},Reise,75,Tog")).json()
+    assert (changed["new"], changed["changed"], changed["unchanged"]) == (0, 1, 1)
+    expenses = {e["amount"]: e["id"] for e in pg_client.get(f"/projects/{project_id}/expenses").json()}
+    assert expenses == {100: ids[100], 75: ids[50]}
+
+
+# ============ Partitions ============
+
+def test_expenses_are_partitioned_by_project(pg_client, pg_db):
+    assert dialect.expense_partitions(pg_db.get_bind().engine) == EXPENSE_PARTITIONS
+    project_ids = [pg_client.post("/projects", json={"name": f"Del {n}"}).json()["id"] for n in range(8)]
+    for project_id in project_ids:
+        pg_client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": 10})
+
+    partitions = dict(pg_db.execute(text("SELECT project_id, tableoid::regclass::text FROM expenses")).all())
+    assert len(set(partitions.values())) > 1
+    plan = pg_db.execute(text(
+        "EXPLAIN (FORMAT JSON) SELECT sum(amount_ore) FROM expenses WHERE project_id = :id"
+    ), {"id": project_ids[0]}).scalar()
+    scanned = {node for node in json.dumps(plan).split('"') if node.startswith("expenses_p")}
+    assert scanned == {partitions[project_ids[0]]}
+    assert pg_client.get(f"/projects/{project_ids[0]}/cost-overview").json()["total_expenses"] == 10
+
+
+def test_bulk_delete_cascades_across_partitions(pg_client, pg_db):
+    project_ids = [pg_client.post("/projects", json={"name": f"Slett {n}"}).json()["id"] for n in range(4)]
+    for project_id in project_ids:
+        pg_client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": 10})
+
+    result = pg_client.post("/projects/bulk-delete", json={"project_ids": project_ids[:3] + [999999]}).json()
+    assert (result["project_ids"], result["not_found"], result["expenses_deleted"]) == (project_ids[:3], [999999], 3)
+    assert pg_db.execute(text("SELECT project_id FROM expenses")).scalars().all() == [project_ids[3]]
+    assert pg_db.execute(text(
+        "SELECT count(*) FROM expense_history WHERE amount_ore IS NULL AND amount_delta_ore = -1000"
+    )).scalar() == 3
+
+
+# ============ Change log txids ============
+
+def test_feed_waits_for_a_transaction_that_commits_after_a_newer_one(pg_sessions):
+    slow = pg_sessions()
+    try:
+        changelog.record(slow, "customer", [999])
+        slow_txid = slow.execute(text("SELECT pg_current_xact_id()::text::bigint")).scalar()
+        with pg_sessions() as db:
+            fast_id = crud.create_customer(db, CustomerCreate(name="Rask kommune")).id
+
+        with pg_sessions() as reader:
+            page = changelog.read_changes(reader, "", 100)
+        # The later transaction's change is held back while the older one is open
+        assert page["changes"] == [] and not page["has_more"]
+        assert changelog.parse_token(page["next"])[0] <= slow_txid
+
+        slow.commit()
+        with pg_sessions() as reader:
+            page = changelog.read_changes(reader, page["next"], 100)
+        assert [(c["entity"], c["id"], c["action"]) for c in page["changes"]] == [
+            ("customer", 999, "delete"), ("customer", fast_id, "upsert"),
+        ]
+    finally:
+        slow.close()
+
+
+def test_rows_of_one_transaction_share_its_txid(pg_sessions):
+    with pg_sessions() as db:
+        project_id = crud.create_project(db, ProjectCreate(name="Samlet")).id
+        txid = db.execute(text("SELECT txid FROM change_log WHERE entity = 'project'")).scalar()
+        with pg_sessions() as other:
+            crud.create_customer(other, CustomerCreate(name="Senere"))
+        rows = db.execute(text("SELECT entity, entity_id, txid FROM change_log ORDER BY id")).all()
+    assert rows[0] == ("project", project_id, txid)
+    assert rows[1].txid > txid
+
+
+# ============ LISTEN / NOTIFY ============
+
+def test_committed_changes_reach_subscribers(pg_sessions, pg_migrated, monkeypatch):
+    channel = f"test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(events, "CHANGE_CHANNEL", channel)
+    monkeypatch.setattr(events, "engine", pg_migrated)
+    listener = events.ChangeListener(channel=channel)
+
+    def wait_for_listen():
+        deadline = time.monotonic() + 10
+        with pg_migrated.connect() as connection:
+            while not connection.execute(text(
+                "SELECT 1 FROM pg_stat_activity WHERE query = :query"
+            ), {"query": f'LISTEN "{channel}"'}).scalar():
+                assert time.monotonic() < deadline, "listener did not connect"
+                time.sleep(0.05)
+                connection.rollback()
+
+    def write():
+        with pg_sessions() as db:
+            events.publish_change(db, {"entity": "customer", "action": "rolled back"})
+            db.rollback()
+        with pg_sessions() as db:
+            return crud.create_customer(db, CustomerCreate(name="Varslet kommune")).id
+
+    async def scenario():
+        queue = listener.subscribe()
+        try:
+            await asyncio.to_thread(wait_for_listen)
+            customer_id = await asyncio.to_thread(write)
+            _, payload = await asyncio.wait_for(queue.get(), 10)
+            return customer_id, json.loads(payload), queue.empty()
+        finally:
+            listener.unsubscribe(queue)
+
+    customer_id, delta, nothing_else = asyncio.run(scenario())
+    assert (delta["entity"], delta["action"], delta["id"]) == ("customer", "created", customer_id)
+    assert nothing_else
@@ -0,0 +1,216 @@
+from functools import partial
+
+import pytest
+from fastapi import HTTPException
+
+import crud
+import read_model
+from read_model import CapacityExceeded, CostGraph, ReadModel
+
+
+@pytest.fixture
+def model(db):
+    """A ReadModel loaded from db"""
+    model = ReadModel()
+    model.refresh(db)
+    return model
+
+
+@pytest.fixture
+def serving(model, monkeypatch):
+    """Routes answer from model while it is fresh"""
+    monkeypatch.setattr(read_model, "READ_MODEL_ENABLED", True)
+    monkeypatch.setattr(read_model, "read_model", model)
+    return model
+
+
+def add_allocation(client, project_id, customer_id, percentage):
+    return client.post(f"/projects/{project_id}/customers",
+                       json={"project_id": project_id, "customer_id": customer_id, "cost_percentage": percentage})
+
+
+def add_expense(client, project_id, amount):
+    return client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": amount}).json()["id"]
+
+
+def assert_matches_crud(db, graph):
+    """Every overview, validation and the summary from graph equal crud's answers from db"""
+    project_ids = [p.id for p in crud.get_projects(db, limit=1000)]
+    customer_ids = [c.id for c in crud.get_customers(db, limit=1000)]
+    assert sorted(graph.projects) == sorted(project_ids)
+    assert sorted(graph.customers) == sorted(customer_ids)
+    for project_id in project_ids:
+        assert graph.project_cost_overview(project_id) == crud.get_project_cost_overview(db, project_id)
+        assert graph.validate_project_cost_allocation(project_id) == crud.validate_project_cost_allocation(db, project_id)
+    for customer_id in customer_ids:
+        assert graph.customer_cost_overview(customer_id) == crud.get_customer_cost_overview(db, customer_id)
+    assert graph.dashboard_summary() == crud.get_dashboard_summary(db)
+
+
+# ============ CostGraph ============
+
+def test_graph_sums_follow_shares_and_expenses():
+    graph = CostGraph(max_expense_id=100)
+    graph._put_project(1, "Fiber")
+    graph._put_project(2, "Kai")
+    graph._put_customer(1, "Alta")
+    graph._put_customer(2, "Bodø")
+    graph._put_allocation(1, 1, 1, 6000)
+    graph._put_allocation(2, 1, 2, 4000)
+    graph._put_allocation(3, 2, 1, 5000)
+    graph._put_expense(1, 1, 10001)
+    graph._put_expense(2, 2, 300)
+    graph._reattach()
+
+    assert (graph.expense_count, graph.total_ore, graph.invalid_count) == (2, 10301, 1)
+    assert graph.projects[1].parts == ((1, 6000, 6001), (2, 4000, 4000))
+    assert graph.allocated_ore == 10001 + 150
+
+    # Moving an expense takes it out of the old project's total
+    graph._put_expense(2, 1, 300)
+    graph._remove_customer(2)
+    graph._reattach()
+    assert (graph.projects[1].total_ore, graph.projects[2].total_ore) == (10301, 0)
+    assert graph.projects[1].parts == ((1, 6000, 6180),)
+    assert (graph.expense_count, graph.total_ore, graph.invalid_count) == (2, 10301, 2)
+    assert set(graph.allocations) == {1, 3}
+
+    graph._remove_project(1)
+    graph._reattach()
+    assert (graph.expense_count, graph.total_ore, graph.allocated_ore) == (0, 0, 0)
+    assert graph.customers[1].project_ids == {2}
+    assert graph.allocations == {3: (2, 1)}
+
+
+def test_graph_refuses_expense_ids_above_its_capacity():
+    graph = CostGraph(max_expense_id=10)
+    graph._put_project(1, "Fiber")
+    graph._put_expense(3, 1, 100)
+    graph._put_expense(10, 1, 100)
+    # Growth doubles, but never past the capacity
+    assert len(graph.expense_project) == len(graph.expense_amount) == 11
+    with pytest.raises(CapacityExceeded):
+        graph._put_expense(11, 1, 100)
+    graph._reattach()
+    assert (graph.expense_count, graph.total_ore) == (2, 200)
+
+
+def test_unknown_ids_are_not_found():
+    graph = CostGraph()
+    for read in (graph.project_cost_overview, graph.customer_cost_overview, graph.validate_project_cost_allocation):
+        with pytest.raises(HTTPException) as missing:
+            read(1)
+        assert missing.value.status_code == 404
+
+
+# ============ Polling change_log ============
+
+def test_matches_crud_after_inserts_updates_and_deletes(client, db, model, monkeypatch):
+    # Several pages per refresh
+    monkeypatch.setattr(read_model, "CHANGES_PER_PAGE", 2)
+    customer_ids = [client.post("/customers", json={"name": name}).json()["id"] for name in ("Alta", "Bodø", "Vadsø")]
+    project_ids = [client.post("/projects", json={"name": name}).json()["id"] for name in ("Fiber", "Kai", "Vei")]
+    expense_ids = [add_expense(client, project_ids[n % 3], amount) for n, amount in enumerate((100, 33.33, 250, 0.01))]
+    add_allocation(client, project_ids[0], customer_ids[0], 60)
+    add_allocation(client, project_ids[0], customer_ids[1], 40)
+    add_allocation(client, project_ids[1], customer_ids[1], 33.33)
+    add_allocation(client, project_ids[1], customer_ids[2], 33.33)
+    add_allocation(client, project_ids[2], customer_ids[2], 100)
+    model.refresh(db)
+    assert_matches_crud(db, model.graph)
+
+    client.put(f"/expenses/{expense_ids[0]}", json={"amount": 99.99})
+    client.put(f"/projects/{project_ids[1]}", json={"name": "Kai 2"})
+    client.put(f"/customers/{customer_ids[0]}", json={"name": "Alta kommune"})
+    client.put(f"/projects/{project_ids[1]}/customers/{customer_ids[2]}", json={"cost_percentage": 66.67})
+    model.refresh(db)
+    assert_matches_crud(db, model.graph)
+
+    client.delete(f"/expenses/{expense_ids[1]}")
+    client.delete(f"/customers/{customer_ids[1]}")
+    client.delete(f"/projects/{project_ids[2]}")
+    add_expense(client, project_ids[0], 12.5)
+    model.refresh(db)
+    assert_matches_crud(db, model.graph)
+    assert model.stats["loads"] == 1
+    assert model.stats["refreshes"] == 3
+
+
+def test_a_refresh_applies_only_the_changes_since_the_last(client, db, model):
+    project_id = client.post("/projects", json={"name": "Fiber"}).json()["id"]
+    add_expense(client, project_id, 10)
+    model.refresh(db)
+    applied = model.stats["changes_applied"]
+    position = model.position
+
+    model.refresh(db)
+    assert (model.stats["changes_applied"], model.position) == (applied, position)
+
+    add_expense(client, project_id, 20)
+    model.refresh(db)
+    assert model.stats["changes_applied"] == applied + 1
+    assert model.position > position
+
+
+def test_a_reset_reloads_the_graph(client, db, model):
+    client.post("/customers", json={"name": "Før"})
+    model.refresh(db)
+    assert client.post("/admin/reset-db").json()["status"] == "success"
+
+    model.refresh(db)
+    assert model.stats["loads"] == 2
+    assert_matches_crud(db, model.graph)
+
+
+def test_expense_ids_above_the_capacity_turn_the_model_off(client, db, monkeypatch, capsys):
+    monkeypatch.setattr(read_model, "CostGraph", partial(CostGraph, max_expense_id=2))
+    project_id = client.post("/projects", json={"name": "Fiber"}).json()["id"]
+    model = ReadModel()
+    model.refresh(db)
+    add_expense(client, project_id, 10)
+    model.refresh(db)
+    assert model.current() is model.graph is not None
+
+    add_expense(client, project_id, 20)
+    add_expense(client, project_id, 30)
+    model.refresh(db)
+    assert (model.graph, model.disabled, model.current()) == (None, True, None)
+    assert "Read model disabled" in capsys.readouterr().out
+    # Stays off, also for a fresh load
+    model.refresh(db)
+    assert model.graph is None
+
+    loaded = ReadModel()
+    loaded.refresh(db)
+    assert loaded.disabled
+
+
+# ============ Staleness gate ============
+
+def test_routes_use_the_model_only_while_it_is_fresh(client, db, serving):
+    project_id = client.post("/projects", json={"name": "Fiber"}).json()["id"]
+    add_expense(client, project_id, 10)
+    serving.refresh(db)
+    add_expense(client, project_id, 20)
+
+    def total(**headers):
+        return client.get(f"/projects/{project_id}/cost-overview", headers=headers).json()["total_expenses"]
+
+    # The model has not seen the second expense yet
+    assert total() == 10
+    assert total(**{"X-Read-Your-Writes": "true"}) == 30
+
+    serving.refreshed_at -= serving.max_staleness + 1
+    assert serving.current() is None
+    assert total() == 30
+
+    serving.refresh(db)
+    assert serving.current() is serving.graph
+    assert total() == 30
+
+
+def test_routes_query_the_database_when_the_model_is_off(client, db, model, monkeypatch):
+    monkeypatch.setattr(read_model, "read_model", model)
+    project_id = client.post("/projects", json={"name": "Fiber"}).json()["id"]
+    assert client.get(f"/projects/{project_id}/validation").json()["is_valid"] is True
+    assert read_model.serving(None) is None
@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+from starlette.requests import Request
+
+import routes
+from singleflight import SingleFlight
+
+
+def request(**headers):
+    return Request({"type": "http", "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+class SlowCall:
+    """fn for SingleFlight.do that blocks until release() and counts its calls"""
+
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.calls = 0
+        self.started = threading.Event()
+        self._released = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self._released.wait(10)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def release(self):
+        self._released.set()
+
+
+def in_threads(count, target):
+    """Start count threads running target() and collect each return value or exception"""
+    outcomes = []
+
+    def run():
+        try:
+            outcomes.append(target())
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flight, count):
+    deadline = time.monotonic() + 10
+    while flight.stats["shared"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+# ============ SingleFlight ============
+
+def test_concurrent_callers_share_one_result():
+    flight, call = SingleFlight(), SlowCall(result=object())
+    threads, outcomes = in_threads(5, lambda: flight.do("overview", call))
+    wait_for_waiters(flight, 4)
+    call.release()
+    for thread in threads:
+        thread.join()
+
+    assert call.calls == 1
+    assert outcomes == [call.result] * 5
+    assert flight.stats == {"leaders": 1, "shared": 4, "timeouts": 0}
+
+
+def test_nothing_is_cached_and_keys_do_not_share():
+    flight, calls = SingleFlight(), []
+    assert flight.do("a", lambda: calls.append("a") or 1) == 1
+    assert flight.do("a", lambda: calls.append("a") or 2) == 2
+    assert flight.do("b", lambda: calls.append("b") or 3) == 3
+    assert calls == ["a", "a", "b"]
+
+
+def test_the_leaders_exception_reaches_every_waiter():
+    flight, call = SingleFlight(), SlowCall(error=ValueError("database went away"))
+    threads, outcomes = in_threads(3, lambda: flight.do("overview", call))
+    wait_for_waiters(flight, 2)
+    call.release()
+    for thread in threads:
+        thread.join()
+
+    assert call.calls == 1
+    assert len(outcomes) == 3 and all(outcome is call.error for outcome in outcomes)
+    # The failed flight is forgotten
+    assert flight.do("overview", lambda: "fresh") == "fresh"
+
+
+def test_a_waiter_times_out_and_the_next_caller_starts_afresh():
+    flight, call = SingleFlight(), SlowCall(result="slow")
+    threads, outcomes = in_threads(1, lambda: flight.do("overview", call))
+    assert call.started.wait(10)
+
+    with pytest.raises(TimeoutError):
+        flight.do("overview", lambda: "unused", timeout=0.01)
+    assert flight.stats["timeouts"] == 1
+    assert flight.do("overview", lambda: "fresh") == "fresh"
+
+    # The stuck computation still finishes for its own caller
+    call.release()
+    threads[0].join()
+    assert outcomes == ["slow"]
+    assert flight.stats["leaders"] == 2
+
+
+def test_a_timeout_error_from_the_function_is_not_a_wait_timeout():
+    flight = SingleFlight()
+
+    def fail():
+        raise TimeoutError("statement timeout")
+
+    with pytest.raises(TimeoutError, match="statement timeout"):
+        flight.do("overview", fail)
+    assert flight.stats["timeouts"] == 0
+
+
+# ============ routes.coalesce ============
+
+@pytest.fixture
+def expensive_reads(monkeypatch):
+    flight = SingleFlight(timeout=0.05)
+    monkeypatch.setattr(routes, "expensive_reads", flight)
+    return flight
+
+
+def test_coalesce_shares_per_database_and_key(db, expensive_reads):
+    call = SlowCall(result={"total": 1})
+    threads, outcomes = in_threads(3, lambda: routes.coalesce(request(), db, ("summary",), call))
+    wait_for_waiters(expensive_reads, 2)
+    call.release()
+    for thread in threads:
+        thread.join()
+    assert (call.calls, outcomes) == (1, [{"total": 1}] * 3)
+
+
+def test_read_your_writes_bypasses_a_running_flight(db, expensive_reads):
+    call = SlowCall(result="before the write")
+    threads, outcomes = in_threads(1, lambda: routes.coalesce(request(), db, ("summary",), call))
+    assert call.started.wait(10)
+
+    fresh = routes.coalesce(request(**{"X-Read-Your-Writes": "true"}), db, ("summary",), lambda: "after the write")
+    assert fresh == "after the write"
+    assert expensive_reads.stats["shared"] == 0
+
+    call.release()
+    threads[0].join()
+    assert outcomes == ["before the write"]
+
+
+def test_a_waiter_that_times_out_gets_504(client, db, expensive_reads):
+    project_id = client.post("/projects", json={"name": "Treg"}).json()["id"]
+    client.post("/expenses", json={"project_id": project_id, "expense_type": "Drift", "amount": 10})
+    key = ("project-cost-overview", project_id, None)
+    call = SlowCall()
+    threads, _ = in_threads(1, lambda: routes.coalesce(request(), db, key, call))
+    assert call.started.wait(10)
+
+    try:
+        response = client.get(f"/projects/{project_id}/cost-overview")
+        assert response.status_code == 504
+        own = client.get(f"/projects/{project_id}/cost-overview", headers={"X-Read-Your-Writes": "true"})
+        assert own.json()["total_expenses"] == 10
+    finally:
+        call.release()
+        threads[0].join()
+
+    assert client.get(f"/projects/{project_id}/cost-overview").status_code == 200
+
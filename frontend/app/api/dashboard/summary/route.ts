@@ -0,0 +1,33 @@
+const API_BASE_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+export const dynamic = 'force-dynamic';
+
+// Passes the backend's ETag / Cache-Control through, so the browser revalidates with a 304
+export async function GET(request: Request) {
+  try {
+    const ifNoneMatch = request.headers.get('if-none-match');
+    const response = await fetch(`${API_BASE_URL}/dashboard/summary`, {
+      headers: ifNoneMatch ? { 'If-None-Match': ifNoneMatch } : {},
+      cache: 'no-store',
+    });
+    const headers = new Headers();
+    for (const name of ['etag', 'cache-control']) {
+      const value = response.headers.get(name);
+      if (value) headers.set(name, value);
+    }
+
+    if (response.status === 304) {
+      return new Response(null, { status: 304, headers });
+    }
+    if (!response.ok) {
+      throw new Error(`API error: ${response.statusText}`);
+    }
+    return Response.json(await response.json(), { headers });
+  } catch (error) {
+    console.error('API route error:', error);
+    return Response.json(
+      { error: 'Failed to fetch dashboard summary' },
+      { status: 500 }
+    );
+  }
+}
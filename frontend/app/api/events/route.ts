@@ -0,0 +1,32 @@
+const API_BASE_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+export const dynamic = 'force-dynamic';
+
+export async function GET(request: Request) {
+  try {
+    // Pass on where a reconnecting client left off, so the backend can replay what it missed
+    const { search } = new URL(request.url);
+    const lastEventId = request.headers.get('last-event-id');
+    const response = await fetch(`${API_BASE_URL}/events${search}`, {
+      signal: request.signal,
+      cache: 'no-store',
+      headers: lastEventId ? { 'Last-Event-ID': lastEventId } : undefined,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`API error: ${response.statusText}`);
+    }
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        Connection: 'keep-alive',
+      },
+    });
+  } catch (error) {
+    console.error('API route error:', error);
+    return Response.json(
+      { error: 'Failed to open change feed' },
+      { status: 500 }
+    );
+  }
+}
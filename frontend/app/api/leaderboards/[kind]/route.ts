@@ -0,0 +1,28 @@
+const API_BASE_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+const KINDS = ['projects', 'customers'];
+
+export async function GET(
+  request: Request,
+  { params }: { params: { kind: string } }
+) {
+  try {
+    const { kind } = await params;
+    if (!KINDS.includes(kind)) {
+      return Response.json({ error: 'Unknown leaderboard' }, { status: 404 });
+    }
+    const query = new URL(request.url).search;
+    const response = await fetch(`${API_BASE_URL}/leaderboards/${kind}${query}`);
+    if (!response.ok) {
+      throw new Error(`API error: ${response.statusText}`);
+    }
+    const data = await response.json();
+    return Response.json(data);
+  } catch (error) {
+    console.error('API route error:', error);
+    return Response.json(
+      { error: 'Failed to fetch leaderboard' },
+      { status: 500 }
+    );
+  }
+}
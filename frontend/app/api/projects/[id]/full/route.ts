@@ -0,0 +1,59 @@
+const API_BASE_URL = process.env.BACKEND_API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+
+// Exactly what the project detail page renders
+const DETAIL_INCLUDE = 'expenses,customers,cost_overview';
+const DETAIL_FIELDS = [
+  'project.name',
+  'project.description',
+  'expenses.expense_type',
+  'expenses.amount',
+  'expenses.description',
+  'customers.project_id',
+  'customers.customer_id',
+  'customers.cost_percentage',
+  'customers.customer_name',
+].join(',');
+
+export async function GET(
+  request: Request,
+  { params }: { params: { id: string } }
+) {
+  try {
+    const { id } = await params;
+    const query = new URLSearchParams({ include: DETAIL_INCLUDE, fields: DETAIL_FIELDS });
+    const response = await fetch(`${API_BASE_URL}/projects/${id}/full?${query}`);
+
+    if (response.status === 404) {
+      return Response.json({ error: 'Project not found' }, { status: 404 });
+    }
+    if (!response.ok) {
+      throw new Error(`API error: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+    const overview = data.cost_overview;
+    const allocated = new Map<number, number>();
+    for (const c of overview?.customers || []) {
+      allocated.set(c.customer_id, c.allocated_cost);
+    }
+
+    return Response.json({
+      project: {
+        ...data.project,
+        total_cost: overview?.total_expenses ?? 0,
+        customers: (data.customers || []).length,
+      },
+      expenses: data.expenses || [],
+      customers: (data.customers || []).map((pc: any) => ({
+        ...pc,
+        cost_share: allocated.get(pc.customer_id) ?? 0,
+      })),
+    });
+  } catch (error) {
+    console.error('API route error:', error);
+    return Response.json(
+      { error: 'Failed to fetch project details' },
+      { status: 500 }
+    );
+  }
+}
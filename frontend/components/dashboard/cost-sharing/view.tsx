@@ -5,6 +5,7 @@ import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Plus, Trash2, DollarSign } from 'lucide-react';
 import { getProjects, getCustomers } from '@/lib/api-client';
+import { useChangeFeed } from '@/hooks/use-change-feed';
 import { LinkCustomerModal } from './link-customer-modal';
 
 interface Project {
@@ -33,16 +34,19 @@ export function CostSharingView() {
     Map<number, ProjectCustomer[]>
   >(new Map());
   const [isLoading, setIsLoading] = useState(true);
-  const [selectedProject, setSelectedProject] = useState<Project | null>(null);
+  const [selectedProjectId, setSelectedProjectId] = useState<number | null>(null);
   const [showLinkModal, setShowLinkModal] = useState(false);
 
+  const selectedProject =
+    projects.find((project) => project.id === selectedProjectId) || projects[0] || null;
+
   useEffect(() => {
     fetchAllData();
   }, []);
 
-  const fetchAllData = async () => {
+  const fetchAllData = async (showSpinner = true) => {
     try {
-      setIsLoading(true);
+      if (showSpinner) setIsLoading(true);
       const [projectsList, customersList] = await Promise.all([
         getProjects(),
         getCustomers(),
@@ -53,7 +57,6 @@ export function CostSharingView() {
 
       setProjects(projects);
       setCustomers(customers);
-      setSelectedProject(projects[0] || null);
 
       // Fetch project-customer relationships
       for (const project of projects) {
@@ -70,6 +73,54 @@ export function CostSharingView() {
     }
   };
 
+  // Live updates: apply the deltas to the lists; refetch only when told to resync
+  useChangeFeed(
+    (deltas) => {
+      let nextProjects = projects;
+      let nextCustomers = customers;
+      const nextShares = new Map(projectCustomers);
+
+      for (const delta of deltas) {
+        if (delta.action === 'deleted' && delta.id !== null) {
+          const deletedId = delta.id;
+          if (delta.entity === 'project') {
+            nextProjects = nextProjects.filter((project) => project.id !== deletedId);
+            nextShares.delete(deletedId);
+          } else if (delta.entity === 'customer') {
+            nextCustomers = nextCustomers.filter((customer) => customer.id !== deletedId);
+            for (const [projectId, rows] of nextShares) {
+              nextShares.set(projectId, rows.filter((pc) => pc.customer_id !== deletedId));
+            }
+          }
+        }
+        for (const { id, name } of delta.customers ?? []) {
+          if (name === null) continue;
+          nextCustomers = nextCustomers.some((customer) => customer.id === id)
+            ? nextCustomers.map((customer) => (customer.id === id ? { ...customer, name } : customer))
+            : [...nextCustomers, { id, name }];
+          for (const [projectId, rows] of nextShares) {
+            if (rows.some((pc) => pc.customer_id === id)) {
+              nextShares.set(projectId, rows.map((pc) => (pc.customer_id === id ? { ...pc, customer_name: name } : pc)));
+            }
+          }
+        }
+        if (delta.project && delta.project.name !== null) {
+          const { id, name, total_expenses, shares } = delta.project;
+          const patched = { id, name, total_cost: total_expenses };
+          nextProjects = nextProjects.some((project) => project.id === id)
+            ? nextProjects.map((project) => (project.id === id ? { ...project, ...patched } : project))
+            : [...nextProjects, patched];
+          nextShares.set(id, shares.map((share) => ({ ...share, project_id: id })));
+        }
+      }
+
+      setProjects(nextProjects);
+      setCustomers(nextCustomers);
+      setProjectCustomers(nextShares);
+    },
+    () => fetchAllData(false)
+  );
+
   const formatMillion = (value: number | undefined) => {
     const n = Number(value ?? 0);
     if (!isFinite(n)) return '0.0';
@@ -151,7 +202,7 @@ export function CostSharingView() {
               {projects.map((project) => (
                 <button
                   key={project.id}
-                  onClick={() => setSelectedProject(project)}
+                  onClick={() => setSelectedProjectId(project.id)}
                   className={`w-full text-left px-4 py-3 transition-colors ${
                     selectedProject?.id === project.id
                       ? 'bg-primary text-primary-foreground'
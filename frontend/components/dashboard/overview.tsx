@@ -1,124 +1,174 @@
 'use client';
 
-import React, { useEffect, useState } from 'react';
+import React, { useCallback, useEffect, useState } from 'react';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import Link from 'next/link';
-import { getCustomers, getProjects } from '@/lib/api-client';
+import { getDashboardSummary } from '@/lib/api-client';
+import { ChangeDelta, patchTopList, useChangeFeed } from '@/hooks/use-change-feed';
 import {
   Building2,
   Briefcase,
   TrendingUp,
   Plus,
   ArrowRight,
-  Users,
   DollarSign,
 } from 'lucide-react';
 
 interface StatsCard {
   label: string;
   value: string;
+  detail?: string;
   icon: React.ReactNode;
   color: string;
 }
 
-interface Customer {
+interface LeaderboardEntry {
+  rank: number;
   id: number;
   name: string;
-  contact_person: string;
-  phone: string;
-  email: string;
+  total_cost: number;
 }
 
-interface Project {
-  id: number;
-  name: string;
-  description: string;
-  status: string;
-  total_cost: number;
-  customers: number;
+interface DashboardSummary {
+  customer_count: number;
+  project_count: number;
+  expense_count: number;
+  total_expenses: number;
+  average_project_expenses: number;
+  average_expense: number;
+  allocated_cost: number;
+  unallocated_cost: number;
+  invalid_allocation_count: number;
+  top_customers: LeaderboardEntry[];
+  top_projects: LeaderboardEntry[];
 }
 
-export function DashboardOverview() {
-  const [customers, setCustomers] = useState<Customer[]>([]);
-  const [projects, setProjects] = useState<Project[]>([]);
-  const [stats, setStats] = useState<StatsCard[]>([]);
-  const [isLoading, setIsLoading] = useState(true);
+// DASHBOARD_TOP_SIZE in the backend
+const TOP_SIZE = 5;
 
-  useEffect(() => {
-    const fetchData = async () => {
-      try {
-        setIsLoading(true);
+const formatMillions = (value: number) => `${(value / 1000000).toFixed(1)}M`;
+const roundOre = (value: number) => Math.round(value * 100) / 100;
 
-        // Fetch customers and projects
-        const [customersList, projectsList] = await Promise.all([
-          getCustomers(),
-          getProjects(),
-        ]);
+const buildStats = (summary: DashboardSummary): StatsCard[] => [
+  {
+    label: 'Totale Kunder',
+    value: summary.customer_count.toString(),
+    icon: <Building2 className="w-8 h-8" />,
+    color: 'bg-blue-500/20 text-blue-400',
+  },
+  {
+    label: 'Aktive Prosjekter',
+    value: summary.project_count.toString(),
+    detail: summary.invalid_allocation_count
+      ? `${summary.invalid_allocation_count} uten 100% fordeling`
+      : undefined,
+    icon: <Briefcase className="w-8 h-8" />,
+    color: 'bg-cyan-500/20 text-cyan-400',
+  },
+  {
+    label: 'Total Kostnad',
+    value: formatMillions(summary.total_expenses),
+    detail: summary.unallocated_cost
+      ? `${formatMillions(summary.unallocated_cost)} ikke fordelt`
+      : undefined,
+    icon: <DollarSign className="w-8 h-8" />,
+    color: 'bg-green-500/20 text-green-400',
+  },
+  {
+    label: 'Gjennomsnittlig Kostnad',
+    value: formatMillions(summary.average_project_expenses),
+    icon: <TrendingUp className="w-8 h-8" />,
+    color: 'bg-amber-500/20 text-amber-400',
+  },
+];
 
-        setCustomers(
-          Array.isArray(customersList)
-            ? customersList.slice(0, 5)
-            : customersList.data?.slice(0, 5) || []
-        );
-        setProjects(
-          Array.isArray(projectsList)
-            ? projectsList.slice(0, 5)
-            : projectsList.data?.slice(0, 5) || []
-        );
+/**
+ * The summary with the deltas applied, or null when a top list can no
+ * longer be told from what is shown and the summary has to be refetched.
+ */
+const applyDeltas = (summary: DashboardSummary, deltas: ChangeDelta[]): DashboardSummary | null => {
+  const next = { ...summary };
+  const projects = new Map<number, { id: number; name: string | null; total_cost: number }>();
+  const customers = new Map<number, { id: number; name: string | null; total_cost: number }>();
+  const removedProjects: number[] = [];
+  const removedCustomers: number[] = [];
 
-        // Calculate stats
-        const projects = Array.isArray(projectsList)
-          ? projectsList
-          : projectsList.data || [];
-        const customers = Array.isArray(customersList)
-          ? customersList
-          : customersList.data || [];
+  for (const delta of deltas) {
+    const step = delta.action === 'created' ? 1 : delta.action === 'deleted' ? -1 : 0;
+    if (delta.entity === 'customer') {
+      next.customer_count += step;
+      if (step < 0 && delta.id !== null) removedCustomers.push(delta.id);
+    } else if (delta.entity === 'project') {
+      next.project_count += step;
+      if (step < 0 && delta.id !== null) removedProjects.push(delta.id);
+    }
+    if (delta.project) {
+      const { id, name, total_expenses } = delta.project;
+      projects.set(id, { id, name, total_cost: total_expenses });
+    }
+    for (const customer of delta.customers ?? []) {
+      customers.set(customer.id, { id: customer.id, name: customer.name, total_cost: customer.total_cost });
+    }
+    if (delta.summary) {
+      next.total_expenses = roundOre(next.total_expenses + delta.summary.total_expenses_change);
+      next.allocated_cost = roundOre(next.allocated_cost + delta.summary.allocated_cost_change);
+      if (delta.summary.invalid_allocation_count !== undefined) {
+        next.invalid_allocation_count = delta.summary.invalid_allocation_count;
+      }
+    }
+  }
 
-        const totalCost = projects.reduce(
-          (sum: number, p: any) => sum + (p.total_cost || 0),
-          0
-        );
+  next.unallocated_cost = roundOre(next.total_expenses - next.allocated_cost);
+  next.average_project_expenses = next.project_count ? roundOre(next.total_expenses / next.project_count) : 0;
+  const topProjects = patchTopList(summary.top_projects, TOP_SIZE, [...projects.values()], removedProjects);
+  const topCustomers = patchTopList(summary.top_customers, TOP_SIZE, [...customers.values()], removedCustomers);
+  if (!topProjects || !topCustomers) return null;
+  next.top_projects = topProjects;
+  next.top_customers = topCustomers;
+  return next;
+};
 
-        const newStats: StatsCard[] = [
-          {
-            label: 'Totale Kunder',
-            value: customers.length.toString(),
-            icon: <Building2 className="w-8 h-8" />,
-            color: 'bg-blue-500/20 text-blue-400',
-          },
-          {
-            label: 'Aktive Prosjekter',
-            value: projects.length.toString(),
-            icon: <Briefcase className="w-8 h-8" />,
-            color: 'bg-cyan-500/20 text-cyan-400',
-          },
-          {
-            label: 'Total Kostnad',
-            value: `${(totalCost / 1000000).toFixed(1)}M`,
-            icon: <DollarSign className="w-8 h-8" />,
-            color: 'bg-green-500/20 text-green-400',
-          },
-          {
-            label: 'Gjennomsnittlig Kostnad',
-            value: projects.length
-              ? `${(totalCost / projects.length / 1000000).toFixed(1)}M`
-              : '0M',
-            icon: <TrendingUp className="w-8 h-8" />,
-            color: 'bg-amber-500/20 text-amber-400',
-          },
-        ];
-        setStats(newStats);
-      } catch (error) {
-        console.error('[Dashboard] Error fetching data:', error);
-      } finally {
-        setIsLoading(false);
-      }
-    };
+export function DashboardOverview() {
+  const [summary, setSummary] = useState<DashboardSummary | null>(null);
+  const [isLoading, setIsLoading] = useState(true);
+
+  const fetchData = useCallback(async (showSpinner: boolean) => {
+    try {
+      if (showSpinner) setIsLoading(true);
 
-    fetchData();
+      // One small request: the summary carries the top five of each leaderboard
+      const data = (await getDashboardSummary()) as DashboardSummary;
+      setSummary({ ...data, top_customers: data.top_customers || [], top_projects: data.top_projects || [] });
+    } catch (error) {
+      console.error('[Dashboard] Error fetching data:', error);
+    } finally {
+      setIsLoading(false);
+    }
   }, []);
 
+  useEffect(() => {
+    fetchData(true);
+  }, [fetchData]);
+
+  // Live updates: patch the figures from the deltas; refetch only when told to resync
+  useChangeFeed(
+    (deltas) => {
+      if (!summary) return;
+      const next = applyDeltas(summary, deltas);
+      if (next) {
+        setSummary(next);
+      } else {
+        fetchData(false);
+      }
+    },
+    () => fetchData(false)
+  );
+
+  const stats = summary ? buildStats(summary) : [];
+  const customers = summary?.top_customers ?? [];
+  const projects = summary?.top_projects ?? [];
+
   if (isLoading) {
     return (
       <div className="space-y-6">
@@ -147,6 +197,11 @@ export function DashboardOverview() {
                 <p className="text-3xl font-bold text-foreground mt-2">
                   {stat.value}
                 </p>
+                {stat.detail && (
+                  <p className="text-xs text-muted-foreground mt-1">
+                    {stat.detail}
+                  </p>
+                )}
               </div>
               <div className={`p-3 rounded-lg ${stat.color}`}>
                 {stat.icon}
@@ -156,7 +211,7 @@ export function DashboardOverview() {
         ))}
       </div>
 
-      {/* Recent Customers Section */}
+      {/* Top Customers Section */}
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
         <Card className="bg-card border border-border">
           <div className="p-6 border-b border-border flex items-center justify-between">
@@ -165,7 +220,7 @@ export function DashboardOverview() {
                 <Building2 className="w-5 h-5 text-blue-400" />
               </div>
               <h2 className="text-lg font-semibold text-foreground">
-                Nylige Kunder
+                Største Kunder
               </h2>
             </div>
             <Button asChild variant="ghost" size="sm">
@@ -187,11 +242,9 @@ export function DashboardOverview() {
                       <p className="font-medium text-foreground group-hover:text-primary transition-colors">
                         {customer.name}
                       </p>
-                      <p className="text-sm text-muted-foreground">
-                        {customer.contact_person}
-                      </p>
-                      <p className="text-xs text-muted-foreground mt-1">
-                        {customer.email}
+                      <p className="text-sm text-muted-foreground flex items-center gap-1">
+                        <DollarSign className="w-3 h-3" />
+                        {formatMillions(customer.total_cost)} fordelt
                       </p>
                     </div>
                     <div className="p-2 rounded-lg bg-secondary opacity-0 group-hover:opacity-100 transition-opacity">
@@ -217,7 +270,7 @@ export function DashboardOverview() {
           </div>
         </Card>
 
-        {/* Recent Projects Section */}
+        {/* Top Projects Section */}
         <Card className="bg-card border border-border">
           <div className="p-6 border-b border-border flex items-center justify-between">
             <div className="flex items-center gap-3">
@@ -225,7 +278,7 @@ export function DashboardOverview() {
                 <Briefcase className="w-5 h-5 text-cyan-400" />
               </div>
               <h2 className="text-lg font-semibold text-foreground">
-                Nylige Prosjekter
+                Største Prosjekter
               </h2>
             </div>
             <Button asChild variant="ghost" size="sm">
@@ -246,30 +299,15 @@ export function DashboardOverview() {
                     <p className="font-medium text-foreground group-hover:text-primary transition-colors">
                       {project.name}
                     </p>
-                    <span
-                      className={`text-xs font-semibold px-2 py-1 rounded-full ${
-                        project.status === 'active'
-                          ? 'bg-green-500/20 text-green-400'
-                          : project.status === 'pending'
-                            ? 'bg-amber-500/20 text-amber-400'
-                            : 'bg-gray-500/20 text-gray-400'
-                      }`}
-                    >
-                      {project.status}
+                    <span className="text-xs font-semibold px-2 py-1 rounded-full bg-cyan-500/20 text-cyan-400">
+                      #{project.rank}
                     </span>
                   </div>
-                  <p className="text-sm text-muted-foreground mb-2">
-                    {project.description}
-                  </p>
                   <div className="flex items-center justify-between">
                     <div className="flex items-center gap-4 text-xs text-muted-foreground">
-                      <span className="flex items-center gap-1">
-                        <Users className="w-3 h-3" />
-                        {project.customers} kunde(r)
-                      </span>
                       <span className="flex items-center gap-1">
                         <DollarSign className="w-3 h-3" />
-                        {(project.total_cost / 1000000).toFixed(1)}M
+                        {formatMillions(project.total_cost)}
                       </span>
                     </div>
                     <div className="p-2 rounded-lg bg-secondary opacity-0 group-hover:opacity-100 transition-opacity">
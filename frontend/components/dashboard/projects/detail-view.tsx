@@ -15,7 +15,8 @@ import {
   DialogTitle,
 } from '@/components/ui/dialog';
 import { ArrowLeft, DollarSign, Plus, ReceiptText, Trash2, Users } from 'lucide-react';
-import { getCustomers, getProjects } from '@/lib/api-client';
+import { getCustomers } from '@/lib/api-client';
+import { useChangeFeed } from '@/hooks/use-change-feed';
 import { LinkCustomerModal } from '@/components/dashboard/cost-sharing/link-customer-modal';
 
 interface Project {
@@ -67,31 +68,25 @@ export function ProjectDetailView({ projectId }: ProjectDetailViewProps) {
     description: '',
   });
 
-  const fetchData = async () => {
+  const fetchData = async (showSpinner = true) => {
     try {
-      setIsLoading(true);
-      const [projectsList, customersList, projectCustomersRes, expensesRes] = await Promise.all([
-        getProjects(),
+      if (showSpinner) setIsLoading(true);
+      // One backend round trip for the project, its expenses, shares and totals
+      const [customersList, detailRes] = await Promise.all([
         getCustomers(),
-        fetch(`/api/projects/${projectId}/customers`),
-        fetch(`/api/projects/${projectId}/expenses`),
+        fetch(`/api/projects/${projectId}/full`),
       ]);
 
-      const projects = Array.isArray(projectsList) ? projectsList : projectsList.data || [];
       const customerList = Array.isArray(customersList) ? customersList : customersList.data || [];
-      const selectedProject = projects.find((p: Project) => p.id === projectId) || null;
-
-      setProject(selectedProject);
       setCustomers(customerList);
 
-      if (projectCustomersRes.ok) {
-        const data = await projectCustomersRes.json();
-        setProjectCustomers(data);
-      }
-
-      if (expensesRes.ok) {
-        const data = await expensesRes.json();
-        setExpenses(data);
+      if (detailRes.ok) {
+        const data = await detailRes.json();
+        setProject(data.project);
+        setProjectCustomers(data.customers);
+        setExpenses(data.expenses);
+      } else {
+        setProject(null);
       }
     } catch (error) {
       console.error('[ProjectDetailPage] Error loading project detail:', error);
@@ -107,6 +102,66 @@ export function ProjectDetailView({ projectId }: ProjectDetailViewProps) {
     fetchData();
   }, [projectId]);
 
+  const fetchExpenses = async () => {
+    try {
+      const res = await fetch(`/api/projects/${projectId}/expenses`);
+      if (res.ok) {
+        setExpenses(await res.json());
+      }
+    } catch (error) {
+      console.error('[ProjectDetailPage] Error loading expenses:', error);
+    }
+  };
+
+  // Live updates: patch the totals and shares from the deltas; the deltas carry no
+  // expense rows, so only this project's expense list is reloaded when it changed
+  useChangeFeed(
+    (deltas) => {
+      let expensesChanged = false;
+      for (const delta of deltas) {
+        if (delta.action === 'deleted' && delta.entity === 'project' && delta.id === projectId) {
+          setProject(null);
+          return;
+        }
+        if (delta.action === 'deleted' && delta.entity === 'customer' && delta.id !== null) {
+          const deletedId = delta.id;
+          setCustomers((prev) => prev.filter((customer) => customer.id !== deletedId));
+          setProjectCustomers((prev) => prev.filter((pc) => pc.customer_id !== deletedId));
+        }
+        for (const { id, name } of delta.customers ?? []) {
+          if (name === null) continue;
+          setCustomers((prev) =>
+            prev.some((customer) => customer.id === id)
+              ? prev.map((customer) => (customer.id === id ? { ...customer, name } : customer))
+              : [...prev, { id, name }]
+          );
+        }
+        if (delta.project?.id !== projectId) continue;
+
+        const { name, description, total_expenses, shares } = delta.project;
+        setProject((prev) =>
+          prev && {
+            ...prev,
+            name: name ?? prev.name,
+            description: description ?? '',
+            total_cost: total_expenses,
+            customers: shares.length,
+          }
+        );
+        setProjectCustomers(shares.map((share) => ({ ...share, project_id: projectId })));
+        if (delta.entity === 'expense') {
+          if (delta.action === 'deleted') {
+            setExpenses((prev) => prev.filter((expense) => expense.id !== delta.id));
+          } else {
+            expensesChanged = true;
+          }
+        }
+      }
+      if (expensesChanged) fetchExpenses();
+    },
+    () => fetchData(false)
+  );
+
   const availableCustomers = useMemo(
     () => customers.filter((c) => !projectCustomers.some((pc) => pc.customer_id === c.id)),
     [customers, projectCustomers]
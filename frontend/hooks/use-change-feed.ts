@@ -0,0 +1,176 @@
+import * as React from 'react'
+
+export interface ChangeDelta {
+  entity: 'customer' | 'project' | 'expense' | 'allocation'
+  action: string
+  id: number | null
+  project?: {
+    id: number
+    name: string | null
+    description: string | null
+    total_expenses: number
+    // The project's allocation rows
+    shares: {
+      id: number
+      customer_id: number
+      customer_name: string
+      cost_percentage: number
+      cost_share: number
+    }[]
+  }
+  customers?: { id: number; name: string | null; total_cost: number }[]
+  // On the last delta of a transaction: how the dashboard totals moved
+  summary?: {
+    total_expenses_change: number
+    allocated_cost_change: number
+    invalid_allocation_count?: number
+  }
+  resync?: boolean
+}
+
+// Deltas arriving within this window are handled as one change
+const DEBOUNCE_MS = 500
+// Wait before opening a new stream once the browser has given up on one
+const RECONNECT_MS = 3000
+
+/**
+ * Subscribes to the backend's live change feed (/api/events) and calls
+ * onChange with the deltas received since the last call, for the view to
+ * patch its state.
+ *
+ * onResync is called instead when the view cannot catch up from deltas:
+ * the backend sent a resync (a slow client, lost events, a delta too large
+ * to send), or the stream came back after a drop without an event id the
+ * backend could replay from. A reconnect passes the last event id on, so
+ * usually the backend just replays the missed deltas.
+ */
+export function useChangeFeed(
+  onChange: (deltas: ChangeDelta[]) => void,
+  onResync: () => void
+) {
+  const onChangeRef = React.useRef(onChange)
+  const onResyncRef = React.useRef(onResync)
+  onChangeRef.current = onChange
+  onResyncRef.current = onResync
+
+  React.useEffect(() => {
+    let source: EventSource | undefined
+    let lastEventId = ''
+    let dropped = false
+    let pending: ChangeDelta[] = []
+    let resync = false
+    let timer: ReturnType<typeof setTimeout> | undefined
+    let reconnectTimer: ReturnType<typeof setTimeout> | undefined
+
+    const flush = () => {
+      const deltas = pending
+      pending = []
+      if (resync) {
+        resync = false
+        onResyncRef.current()
+      } else if (deltas.length) {
+        onChangeRef.current(deltas)
+      }
+    }
+
+    const schedule = () => {
+      clearTimeout(timer)
+      timer = setTimeout(flush, DEBOUNCE_MS)
+    }
+
+    const onMessage = (event: MessageEvent) => {
+      if (event.lastEventId) lastEventId = event.lastEventId
+      let delta: ChangeDelta
+      try {
+        delta = JSON.parse(event.data)
+      } catch {
+        return
+      }
+      if (delta.action === 'resync' || delta.resync) {
+        // A refetch covers every delta before it
+        resync = true
+        pending = []
+      } else {
+        pending.push(delta)
+      }
+      schedule()
+    }
+
+    const onOpen = () => {
+      // Without an event id the backend cannot tell what was missed
+      if (dropped && !lastEventId) {
+        resync = true
+        schedule()
+      }
+      dropped = false
+    }
+
+    const onError = () => {
+      dropped = true
+      // The browser retries by itself (sending Last-Event-ID) unless the stream failed outright
+      if (source?.readyState === EventSource.CLOSED) {
+        clearTimeout(reconnectTimer)
+        reconnectTimer = setTimeout(connect, RECONNECT_MS)
+      }
+    }
+
+    const connect = () => {
+      source?.close()
+      const query = lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : ''
+      source = new EventSource(`/api/events${query}`)
+      source.addEventListener('change', onMessage)
+      source.addEventListener('open', onOpen)
+      source.addEventListener('error', onError)
+    }
+
+    connect()
+    return () => {
+      clearTimeout(timer)
+      clearTimeout(reconnectTimer)
+      source?.close()
+    }
+  }, [])
+}
+
+export interface RankedEntry {
+  rank: number
+  id: number
+  name: string
+  total_cost: number
+}
+
+/**
+ * A top-N list with new totals applied and removed ids dropped. Returns
+ * null when the list cannot be known from what is shown: it was full and
+ * fewer than N entries still reach its old last place, so something not
+ * shown may now rank higher.
+ */
+export function patchTopList(
+  list: RankedEntry[],
+  size: number,
+  updates: { id: number; name: string | null; total_cost: number }[],
+  removed: number[]
+): RankedEntry[] | null {
+  if (!updates.length && !removed.length) return list
+  // A list shorter than size already shows every ranked entity
+  const full = list.length >= size
+  const lastPlace = full ? Math.min(...list.map((entry) => entry.total_cost)) : -Infinity
+  const entries = new Map(list.map((entry) => [entry.id, entry]))
+  for (const id of removed) entries.delete(id)
+  for (const update of updates) {
+    const known = entries.get(update.id)
+    if (known) {
+      entries.set(update.id, { ...known, name: update.name ?? known.name, total_cost: update.total_cost })
+    } else if (update.name !== null && !removed.includes(update.id)) {
+      entries.set(update.id, { rank: 0, id: update.id, name: update.name, total_cost: update.total_cost })
+    }
+  }
+  // Entities without costs are not ranked
+  const ranked = [...entries.values()]
+    .filter((entry) => entry.total_cost !== 0)
+    .sort((a, b) => b.total_cost - a.total_cost || a.id - b.id)
+  if (full && ranked.filter((entry) => entry.total_cost >= lastPlace).length < size) {
+    return null
+  }
+  return ranked.slice(0, size).map((entry, index) => ({ ...entry, rank: index + 1 }))
+}
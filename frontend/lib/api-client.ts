@@ -52,3 +52,11 @@ export async function createProject(data: any) {
     body: JSON.stringify(data),
   });
 }
+
+export async function getDashboardSummary() {
+  return apiCall('/dashboard/summary');
+}
+
+export async function getLeaderboard(kind: 'projects' | 'customers', limit = 10) {
+  return apiCall(`/leaderboards/${kind}?limit=${limit}`);
+}